@@ -17,9 +17,64 @@ def create_app():
 
     # Config
     app.config["MONGO_URI"] = os.getenv("MONGO_URI") or "mongodb://localhost:27017/sigepren_db"
+    # Lecturas en paralelo de secciones HCP (app.utils.fanout)
+    app.config["FANOUT_MAX_WORKERS"] = int(os.getenv("FANOUT_MAX_WORKERS") or 4)
+    app.config["FANOUT_TIMEOUT"] = float(os.getenv("FANOUT_TIMEOUT") or 5)
+    # Lecturas de historial desde historial_snapshots ("0" para desactivar)
+    app.config["HISTORIAL_SNAPSHOTS"] = (os.getenv("HISTORIAL_SNAPSHOTS") or "1") != "0"
 
-    # Inicializar Mongo
-    mongo.init_app(app)
+    # Cabeceras de depuración con el nº de comandos Mongo por request
+    app.config["DB_DEBUG_HEADERS"] = (os.getenv("DB_DEBUG_HEADERS") or "0") == "1"
+    # TTL (s) del conteo cacheado de ?count=estimated en listados con filtro
+    app.config["COUNT_CACHE_TTL"] = float(os.getenv("COUNT_CACHE_TTL") or 60)
+    # Índices al arrancar ("0" para delegarlo a `flask indexes apply`)
+    app.config["INDEXES_ON_STARTUP"] = (os.getenv("INDEXES_ON_STARTUP") or "1") != "0"
+    # Completar busqueda_claves de pacientes anteriores a la búsqueda indexada
+    # ("0" para delegarlo a `flask pacientes reindex-busqueda --faltantes`)
+    app.config["BUSQUEDA_BACKFILL_ON_STARTUP"] = (os.getenv("BUSQUEDA_BACKFILL_ON_STARTUP") or "1") != "0"
+
+    # JSON de respuestas: ObjectId/datetime/Decimal128 nativos (orjson si está instalado).
+    # Fechas con el formato de siempre ("Tue, 14 Oct 2025 ... GMT"); JSON_FECHAS=iso para ISO 8601.
+    app.config["JSON_FECHAS"] = (os.getenv("JSON_FECHAS") or "http").lower()
+    # Zona de la hora clínica de sala (dia_hora/fecha_hora de las series); vacío = hora local del servidor
+    app.config["ZONA_HORARIA"] = os.getenv("ZONA_HORARIA") or None
+    # Documentos por lote del cursor en respuestas NDJSON (?stream=1)
+    app.config["STREAM_BATCH_SIZE"] = int(os.getenv("STREAM_BATCH_SIZE") or 500)
+
+    # Inicializar Mongo (con listener para contar comandos por request)
+    from app.utils import db_metrics
+    mongo.init_app(app, event_listeners=[db_metrics.listener])
+    db_metrics.init_app(app)
+    # Después de mongo.init_app: Flask-PyMongo instala su propio app.json
+    from app.utils import json_bson
+    json_bson.init_app(app)
+    from app.db import identity_map
+    identity_map.init_app(app)
+
+    # Índices: una vez por proceso y solo si cambió INDEXES_VERSION
+    if app.config["INDEXES_ON_STARTUP"]:
+        from pymongo.errors import PyMongoError
+        from app.db import ensure_indexes
+        try:
+            with app.app_context():
+                ensure_indexes()
+        except PyMongoError as e:
+            # Sin Mongo disponible la app arranca igual; se puede aplicar luego por CLI.
+            # Cualquier otro error (config, código) sí frena el arranque.
+            print(f"[indexes] aviso: {e}")
+
+    # Sin busqueda_claves un paciente no aparece en listar/buscar: se completan al
+    # arrancar (solo los que faltan; una vez hecho es una consulta vacía)
+    if app.config["BUSQUEDA_BACKFILL_ON_STARTUP"]:
+        from pymongo.errors import PyMongoError
+        from app.services import service_paciente
+        try:
+            with app.app_context():
+                total = service_paciente.reindexar_busqueda(solo_faltantes=True)
+            if total:
+                print(f"[pacientes] busqueda_claves completada en {total} pacientes")
+        except PyMongoError as e:
+            print(f"[pacientes] aviso: busqueda_claves sin completar: {e}")
 
     # Registrar rutas (blueprints)
     try:
@@ -29,6 +84,12 @@ def create_app():
         # Si aún no tienes el paquete routes, no tires la app.
         print(f"[routes] aviso: {e}")
 
+    # Comandos CLI (flask snapshots rebuild, flask indexes apply, ...)
+    from app.cli import register_commands
+    register_commands(app)
+
+    json_bson.verificar(app)
+
     # Salud
     @app.get("/")
     def home():
@@ -0,0 +1,185 @@
+import click
+from flask.cli import AppGroup
+
+# Comandos de mantenimiento: `flask <grupo> <comando>`
+snapshots_cli = AppGroup("snapshots", help="Snapshots desnormalizados de historiales.")
+indexes_cli = AppGroup("indexes", help="Índices de MongoDB (registro central en app.db).")
+pacientes_cli = AppGroup("pacientes", help="Mantenimiento de pacientes.")
+bench_cli = AppGroup("bench", help="Micro-benchmarks (sin Mongo).")
+export_cli = AppGroup("export", help="Exportaciones masivas (reporte perinatal SIP/HCP).")
+
+
+@snapshots_cli.command("rebuild")
+@click.option("--historial-id", default=None, help="Reconstruir solo este historial.")
+@click.option("--desde-id", default=None, help="Reanudar a partir de este _id (exclusivo).")
+@click.option("--lote", default=200, show_default=True, help="Tamaño de lote del cursor.")
+def snapshots_rebuild(historial_id, desde_id, lote):
+    """Reconstruye historial_snapshots desde las colecciones fuente."""
+    from app.services import service_historial_snapshot as svc_snap
+
+    if historial_id:
+        snap = svc_snap.reconstruir(historial_id)
+        click.echo("OK" if snap else f"Historial {historial_id} no encontrado")
+        return
+
+    def _progreso(n, ultimo_id):
+        click.echo(f"  {n} snapshots (último _id: {ultimo_id})")
+
+    total = svc_snap.reconstruir_todos(lote=lote, desde_id=desde_id, on_progress=_progreso)
+    click.echo(f"[snapshots] OK – {total} reconstruidos")
+
+
+def _echo_reporte(reporte):
+    for coleccion, rep in reporte.items():
+        if not any(rep.values()):
+            continue
+        click.echo(coleccion)
+        for s in rep["faltantes"]:
+            click.echo(f"  + falta       {s['name']} {s['keys']}")
+        for c in rep["conflictos"]:
+            click.echo(f"  ! conflicto   {c['name']}: {c['motivo']} (esperado {c['esperado']}, actual {c['actual']})")
+        for r in rep["redundantes"]:
+            click.echo(f"  - redundante  {r['name']} {r['key']} ({r['cubierto_por']})")
+        for e in rep["extra"]:
+            click.echo(f"  ? no declarado {e['name']} {e['key']}")
+
+
+@indexes_cli.command("diff")
+@click.option("--coleccion", "colecciones", multiple=True, help="Limitar a estas colecciones.")
+def indexes_diff(colecciones):
+    """Compara app.db.index_spec con list_indexes(). Sale con código 1 si hay diferencias."""
+    from app.db import index_drift
+
+    reporte = index_drift.comparar(list(colecciones) or None)
+    _echo_reporte(reporte)
+    if index_drift.hay_diferencias(reporte):
+        raise SystemExit(1)
+    click.echo("[indexes] sin diferencias con la spec")
+
+
+@indexes_cli.command("apply")
+@click.option("--coleccion", "colecciones", multiple=True, help="Limitar a estas colecciones.")
+@click.option("--keep-redundant", is_flag=True, help="No borrar los índices redundantes.")
+@click.option("--fix-conflicts", is_flag=True, help="Borrar y recrear los índices en conflicto.")
+@click.option("--dry-run", is_flag=True, help="Solo mostrar el diff.")
+def indexes_apply(colecciones, keep_redundant, fix_conflicts, dry_run):
+    """Crea los faltantes y borra los redundantes según app.db.index_spec."""
+    from app.db import index_drift, registrar_version_indexes, INDEXES_VERSION
+
+    reporte = index_drift.comparar(list(colecciones) or None)
+    _echo_reporte(reporte)
+    if dry_run:
+        return
+
+    def _accion(accion, col, nombre, error):
+        if error is None:
+            click.echo(f"  {accion} {col}.{nombre}")
+        else:
+            click.echo(f"  ERROR {accion} {col}.{nombre}: {error}", err=True)
+
+    resultado = index_drift.aplicar(
+        reporte,
+        borrar_redundantes=not keep_redundant,
+        corregir_conflictos=fix_conflicts,
+        on_accion=_accion,
+    )
+    hechas, fallidas = resultado["hechas"], resultado["fallidas"]
+    if fallidas:
+        # la versión queda sin registrar: el próximo apply/arranque lo reintenta
+        raise click.ClickException(
+            f"{len(hechas)} cambios aplicados, {len(fallidas)} fallidos; versión {INDEXES_VERSION} sin registrar"
+        )
+    if not colecciones:
+        registrar_version_indexes()
+    click.echo(f"[indexes] versión {INDEXES_VERSION}: {len(hechas)} cambios aplicados")
+
+
+@pacientes_cli.command("reindex-busqueda")
+@click.option("--lote", default=500, show_default=True, help="Tamaño de lote del bulk_write.")
+@click.option("--faltantes", is_flag=True, help="Solo pacientes sin busqueda_claves (lo mismo que hace el arranque).")
+def pacientes_reindex_busqueda(lote, faltantes):
+    """
+    Recalcula busqueda_claves. El arranque ya completa los pacientes que no la
+    tienen; sin --faltantes recalcula todos (p. ej. tras cambiar app.utils.busqueda).
+    """
+    from app.services import service_paciente
+
+    total = service_paciente.reindexar_busqueda(
+        lote=lote, on_progress=lambda n: click.echo(f"  {n} pacientes"), solo_faltantes=faltantes
+    )
+    click.echo(f"[pacientes] OK – {total} reindexados")
+
+
+@bench_cli.command("validacion")
+@click.option("--n", default=2000, show_default=True, help="Payloads por medición.")
+@click.option("--seccion", "secciones", multiple=True, help="Limitar a estas secciones.")
+def bench_validacion(n, secciones):
+    """Costo de validar un payload (_build_doc) por sección, válido e inválido."""
+    from app.utils import bench_validacion
+
+    for linea in bench_validacion.lineas(bench_validacion.medir(n=n, secciones=list(secciones) or None)):
+        click.echo(linea)
+
+
+def _echo_job(job):
+    click.echo(f"job {job['_id']}: {job['estado']} – {job.get('exportados', 0)} exportados "
+               f"({job.get('leidos', 0)} historiales leídos, {len(job.get('partes') or [])} partes)")
+    click.echo(f"  directorio: {job['directorio']}")
+    if job.get("ultimo_id"):
+        click.echo(f"  último _id: {job['ultimo_id']}")
+    if job.get("error"):
+        click.echo(f"  error: {job['error']}")
+
+
+@export_cli.command("hcp")
+@click.option("--dir", "directorio", default="exports", show_default=True, help="Directorio de salida.")
+@click.option("--formato", type=click.Choice(["ndjson", "csv"]), default="ndjson", show_default=True)
+@click.option("--mes", default=None, help="YYYY-MM: historiales con egreso materno en ese mes.")
+@click.option("--todos", is_flag=True, help="Todos los historiales activos, cerrados o no.")
+@click.option("--lote", default=500, show_default=True, help="Historiales por lote ($in por sección).")
+@click.option("--por-parte", default=10000, show_default=True, help="Historiales por archivo comprimido.")
+@click.option("--reanudar", "job_id", default=None, help="Continuar este job desde su último _id.")
+def export_hcp(directorio, formato, mes, todos, lote, por_parte, job_id):
+    """Exporta historiales cerrados con sus diez secciones (NDJSON/CSV comprimido)."""
+    from app.services import service_exportacion as svc_exp
+
+    if job_id:
+        job = svc_exp.obtener_job(job_id)
+        if not job:
+            raise click.ClickException(f"Job {job_id} no encontrado")
+    else:
+        try:
+            job = svc_exp.crear_job(directorio, formato=formato, mes=mes, todos=todos,
+                                    lote=lote, por_parte=por_parte)
+        except ValueError as ve:
+            raise click.ClickException(str(ve))
+    click.echo(f"[export] job {job['_id']} -> {job['directorio']}")
+
+    def _progreso(j):
+        click.echo(f"  {j['exportados']} exportados, {j['leidos']} leídos (último _id: {j['ultimo_id']})")
+
+    try:
+        job = svc_exp.ejecutar(job["_id"], on_progress=_progreso)
+    except Exception as e:
+        raise click.ClickException(f"{e} – reanudar con: flask export hcp --reanudar {job['_id']}")
+    _echo_job(job)
+
+
+@export_cli.command("estado")
+@click.argument("job_id")
+def export_estado(job_id):
+    """Progreso de un job de exportación."""
+    from app.services import service_exportacion as svc_exp
+
+    job = svc_exp.obtener_job(job_id)
+    if not job:
+        raise click.ClickException(f"Job {job_id} no encontrado")
+    _echo_job(job)
+
+
+def register_commands(app):
+    app.cli.add_command(snapshots_cli)
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(pacientes_cli)
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(export_cli)
@@ -57,7 +57,7 @@ def get_hoy():
     except Exception:
         return jsonify(_fail("limit inválido", 422)[0]), 422
     start_utc, end_utc = _range_today_system_tz()
-    res, code = listar_hoy(start_utc, end_utc, limit)
+    res, code = listar_hoy(start_utc, end_utc, limit, count=request.args.get("count"))
     return jsonify(res), code
 
 
@@ -85,7 +85,7 @@ def get_proximas():
             return jsonify(_fail("days/dias inválido", 422)[0]), 422
         days = max(min(days, 30), 1)
         start_utc, end_utc = _range_next_days_from_tomorrow_system_tz(days)
-    res, code = listar_proximas(start_utc, end_utc, limit)
+    res, code = listar_proximas(start_utc, end_utc, limit, count=request.args.get("count"))
     return jsonify(res), code
 
 
@@ -1,21 +1,14 @@
 from flask import Blueprint, request, jsonify
-from bson import ObjectId
-from app import mongo
-from app.db import start_session_if_possible
+from app.db import start_session_if_possible, identity_map
 from app.utils.jwt_manager import verificar_token
+from app.utils import paginacion, streaming
 from app.services import (
     service_historial,
-    service_identificacion,
-    service_antencedentes,
+    service_historial_agregado,
+    service_historial_plan,
     service_gestacion_actual,
     service_parto_aborto,
-    service_patologias,
-    service_recien_nacido,
     service_puerperio,
-    service_egreso_neonatal,
-    service_egreso_materno,
-    service_anticoncepcion,
-    service_paciente,
 )
 
 bp = Blueprint("historiales", __name__, url_prefix="/historiales")
@@ -32,11 +25,20 @@ def _usuario_actual_from_request():
     return datos if datos and datos.get("usuario_id") else None
 
 
+def _es_dry_run():
+    valor = (request.args.get("dry_run") or "").strip().lower()
+    return valor in ("1", "true", "t", "yes", "y")
+
+
 @bp.post("/create")
 def crear_historial():
     """
     Orquesta la creación de: historial (requerido) + secciones HCP (opcionales).
-    Si algún paso falla dentro de la transacción, se revierte.
+    Primero valida todos los bloques sin tocar Mongo (service_historial_plan.planificar)
+    y responde 422 con los errores de cada bloque; solo con el cuerpo válido abre la
+    transacción y escribe todo en bloque. Si algo falla dentro, se revierte.
+    ?dry_run=1: solo la validación; responde 200 con los bloques válidos y no escribe nada
+    (numero_gesta, paciente y unicidad se resuelven al crear de verdad).
     """
     usuario_actual = _usuario_actual_from_request()
     if not usuario_actual:
@@ -50,207 +52,247 @@ def crear_historial():
         res, code = _fail("Falta bloque: datos (historial)", 422)
         return jsonify(res), code
 
-    def _resolve_numero_gesta(paciente_id_value, session=None):
-        try:
-            oid = ObjectId(paciente_id_value)
-        except Exception:
-            raise ValueError("datos.paciente_id debe ser un ObjectId válido")
-        kwargs = {"sort": [("numero_gesta", -1)]}
-        if session:
-            kwargs["session"] = session
-        doc = mongo.db.historiales.find_one({"paciente_id": oid}, **kwargs)
-        if not doc:
-            return 1
-        ultimo = doc.get("numero_gesta") or 0
-        try:
-            ultimo = int(ultimo)
-        except Exception:
-            ultimo = 0
-        return ultimo + 1
-
-    historial_id = None
-    paciente_id = None
-    resumen = {"secciones_creadas": {}}
-    session_used = False
+    plan, errores = service_historial_plan.planificar(body, usuario_actual)
+    if errores:
+        res = {
+            "ok": False,
+            "data": {"errores": errores},
+            "error": "Datos inválidos en: " + ", ".join(errores),
+        }
+        return jsonify(res), 422
+
+    if _es_dry_run():
+        bloques = ["datos"] + [nombre for nombre, _c, _s, _d in plan["secciones"]]
+        res, code = _ok({"valido": True, "bloques": bloques}, 200)
+        return jsonify(res), code
 
     try:
         with start_session_if_possible() as s:
-            session_used = bool(s)
             try:
                 if s:
-                    s.start_transaction()
-
-                # 1) Crear historial 
-                hist_payload = dict(body["datos"] or {})
-                paciente_id = hist_payload.get("paciente_id")
-                if not paciente_id:
-                    raise RuntimeError("datos.paciente_id es requerido")
-
-                numero_gesta = hist_payload.get("numero_gesta")
-                if numero_gesta in (None, "", 0):
-                    numero_gesta = _resolve_numero_gesta(paciente_id, session=s)
-                hist_payload["numero_gesta"] = numero_gesta
-
-                his_res, his_code = service_historial.crear_historial(hist_payload, session=s)
-                if his_code not in (200, 201) or not his_res.get("ok"):
-                    raise RuntimeError(his_res.get("error") or "Error creando historial")
-
-                historial_id = his_res["data"].get("id")
-                resumen["historial_id"] = historial_id
-                resumen["paciente_id"] = paciente_id
-
-                upd_res, upd_code = service_paciente.actualizar_paciente_por_id(
-                    paciente_id, {"historial_id": historial_id}, session=s
-                )
-                if upd_code not in (200, 201) or not upd_res.get("ok"):
-                    raise RuntimeError(upd_res.get("error") or "Error actualizando paciente")
-
-                # Helper para crear secciones opcionales (inyectando historial_id)
-                def _crear(nombre_bloque, servicio, nombre_fn):
-                    if nombre_bloque not in body:
-                        return
-                    payload = dict(body[nombre_bloque] or {})
-                    if not hasattr(servicio, nombre_fn):
-                        raise RuntimeError(f"{nombre_bloque}: función '{nombre_fn}' no encontrada")
-                    func = getattr(servicio, nombre_fn)
-                    res, code = func(historial_id, payload, session=s, usuario_actual=usuario_actual)
-                    if code not in (200, 201) or not res.get("ok"):
-                        raise RuntimeError(res.get("error") or f"Error creando {nombre_bloque}")
-                    resumen["secciones_creadas"][f"{nombre_bloque}_id"] = res["data"].get("id")
-
-                    # Vincular campo *_id en el documento de historial
-                    ref_field = f"{nombre_bloque}_id"
-                    vinc_res, vinc_code = service_historial.vincular_segmento(
-                        historial_id, ref_field, res["data"].get("id"), session=s
+                    # with_transaction reintenta todo el plan ante TransientTransactionError
+                    # (dos altas concurrentes del mismo paciente chocan en gesta_seq) y
+                    # UnknownTransactionCommitResult; ante otro error aborta y lo relanza
+                    resumen = s.with_transaction(
+                        lambda ses: service_historial_plan.ejecutar(plan, session=ses)
                     )
-                    if vinc_code not in (200, 201) or not vinc_res.get("ok"):
-                        raise RuntimeError(vinc_res.get("error") or f"Error vinculando {ref_field}")
-
-                # 2) Crear secciones si vienen
-                _crear("identificacion",  service_identificacion,   "crear_identificacion")
-                _crear("antecedentes",    service_antencedentes,    "crear_antecedentes")
-                _crear("gestacion_actual",service_gestacion_actual, "crear_gestacion_actual")
-                _crear("parto_aborto",    service_parto_aborto,     "crear_parto_aborto")
-                _crear("patologias",      service_patologias,       "crear_patologias")
-                _crear("recien_nacido",   service_recien_nacido,    "crear_recien_nacido")
-                _crear("puerperio",       service_puerperio,        "crear_puerperio")
-                _crear("egreso_neonatal", service_egreso_neonatal,  "crear_egreso_neonatal")
-                _crear("egreso_materno",  service_egreso_materno,   "crear_egreso_materno")
-                _crear("anticoncepcion",  service_anticoncepcion,   "crear_anticoncepcion")
-
-                if s:
-                    s.commit_transaction()
+                else:
+                    resumen = service_historial_plan.ejecutar(plan)
 
             except Exception:
-                if s:
-                    s.abort_transaction()
+                if not s:
+                    # Sin transacción: limpiar lo que alcanzó a escribirse (también
+                    # si el paciente no existe: el historial y las secciones ya se insertaron)
+                    service_historial_plan.deshacer(plan)
+                # Lo registrado en el identity map ya no existe tras el abort
+                identity_map.limpiar()
                 raise
 
+    except LookupError as le:
+        res, code = _fail(str(le), 404)
+        return jsonify(res), code
     except Exception as e:
-        # Si alcanzamos a crear historial, intentamos limpiarlo
-        if historial_id:
-            try:
-                service_historial.eliminar_historial_por_id(historial_id, hard=True)
-            except Exception:
-                pass
-        if paciente_id and historial_id and not session_used:
-            try:
-                service_paciente.actualizar_paciente_por_id(paciente_id, {"historial_id": None})
-            except Exception:
-                pass
-        res, code = _fail(f"Transacción revertida: {str(e)}", 500)
+        msg = str(e)
+        if "duplicate key" in msg.lower():
+            res, code = _fail("Duplicado: ya existe un historial con ese (paciente_id, numero_gesta)", 409)
+        else:
+            res, code = _fail(f"Transacción revertida: {msg}", 500)
         return jsonify(res), code
 
     res, code = _ok(resumen, 201)
     return jsonify(res), code
 
 
-@bp.get("/<historial_id>")
-def obtener_historial(historial_id):
+def _seleccion_desde_request():
+    """?sections=a,b y ?fields=seccion.campo,... (ValueError si no son válidos)."""
+    return service_historial_agregado.parsear_seleccion(
+        request.args.get("sections"), request.args.get("fields")
+    )
+
+
+def _responder_agregado(lector, clave):
     """
-    Devuelve el agregado del historial + secciones HCP por historial_id.
+    Ruta de lectura única para /<historial_id> y /por-paciente/<paciente_id>.
+    `lector` es la función de service_historial (snapshot o $lookup): cada sección
+    se resuelve una sola vez y se expone también en el nivel superior, como antes.
+    Con DB_DEBUG_HEADERS, las cabeceras X-DB-* reportan los comandos Mongo usados.
     """
-    hist_res, hist_code = service_historial.obtener_historial(historial_id)
+    try:
+        secciones, campos = _seleccion_desde_request()
+    except ValueError as ve:
+        res, code = _fail(str(ve), 422)
+        return jsonify(res), code
+
+    hist_res, hist_code = lector(clave, secciones, campos)
     if hist_code not in (200, 201) or not hist_res.get("ok"):
         return jsonify(hist_res), hist_code
 
-    agregado = {"historial": hist_res["data"]}
-
-    # Helper para obtener secciones por historial (usa el primer método disponible)
-    def _obtener(servicio, candidatos):
-        for fn in candidatos:
-            if hasattr(servicio, fn):
-                try:
-                    r, c = getattr(servicio, fn)(historial_id)
-                    if c in (200, 201) and r.get("ok"):
-                        return r["data"]
-                except Exception:
-                    pass
-        return None
-
-    agregado["identificacion"]  = _obtener(service_identificacion,  ("obtener_identificacion_por_historial",  "get_identificacion_by_historial_id"))
-    agregado["antecedentes"]    = _obtener(service_antencedentes,   ("obtener_antecedentes_por_historial",    "get_antecedentes_by_historial_id"))
-    agregado["gestacion_actual"]= _obtener(service_gestacion_actual,("obtener_gestacion_actual_por_historial","get_gestacion_actual_by_historial_id"))
-    agregado["parto_aborto"]    = _obtener(service_parto_aborto,    ("obtener_parto_aborto_por_historial",    "get_parto_aborto_by_historial_id"))
-    agregado["patologias"]      = _obtener(service_patologias,      ("obtener_patologias_por_historial",      "get_patologias_by_historial_id"))
-    agregado["recien_nacido"]   = _obtener(service_recien_nacido,   ("obtener_recien_nacido_por_historial",   "get_recien_nacido_by_historial_id"))
-    agregado["puerperio"]       = _obtener(service_puerperio,       ("obtener_puerperio_por_historial",       "get_puerperio_by_historial_id"))
-    agregado["egreso_neonatal"] = _obtener(service_egreso_neonatal, ("obtener_egreso_neonatal_por_historial", "get_egreso_neonatal_by_historial_id"))
-    agregado["egreso_materno"]  = _obtener(service_egreso_materno,  ("obtener_egreso_materno_por_historial",  "get_egreso_materno_by_historial_id"))
-    agregado["anticoncepcion"]  = _obtener(service_anticoncepcion,  ("obtener_anticoncepcion_por_historial",  "get_anticoncepcion_by_historial_id"))
+    data = hist_res["data"]
+    agregado = {"historial": data}
+    for nombre in secciones:
+        agregado[nombre] = data.get(nombre)
 
     res, code = _ok(agregado, 200)
     return jsonify(res), code
 
 
+@bp.get("/")
+def listar_historiales():
+    """
+    Listado de historiales (created_at desc, numero_gesta desc).
+    Query: paciente_id, page, per_page, after=<next_cursor> (paginación por cursor),
+           count=exact|estimated|none.
+    ?stream=1 o Accept: application/x-ndjson: todos los resultados como NDJSON, sin paginar.
+    """
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    if streaming.pide_stream():
+        try:
+            items = service_historial.iterar_historiales(
+                paciente_id=request.args.get("paciente_id"), batch_size=streaming.batch_size()
+            )
+        except ValueError as ve:
+            res, code = _fail(str(ve), 422)
+            return jsonify(res), code
+        return streaming.ndjson(items)
+
+    res, code = service_historial.listar_historiales(
+        paciente_id=request.args.get("paciente_id"),
+        page=request.args.get("page", 1),
+        per_page=request.args.get("per_page", 20),
+        after=paginacion.parsear_after(request.args.get("after")),
+        count=request.args.get("count"),
+    )
+    return jsonify(res), code
+
+
+@bp.get("/<historial_id>")
+def obtener_historial(historial_id):
+    """
+    Devuelve el agregado del historial + secciones HCP por historial_id.
+    Admite ?sections= y ?fields= para traer solo lo necesario.
+    """
+    return _responder_agregado(service_historial.obtener_historial, historial_id)
+
+
 @bp.get("/por-paciente/<paciente_id>")
 def obtener_historial_por_paciente(paciente_id):
     """
     Devuelve el agregado del historial más reciente para un paciente dado.
     Si no existe historial previo, responde 404.
+    Admite ?sections= y ?fields= igual que /historiales/<historial_id>.
     """
-    # Buscar el historial más reciente del paciente
-    hist_list_res, hist_list_code = service_historial.listar_historiales(
-        paciente_id=paciente_id, page=1, per_page=1
+    return _responder_agregado(service_historial.obtener_historial_reciente_por_paciente, paciente_id)
+
+
+# ---------------- Controles prenatales (APN) ----------------
+# Agregan/editan/borran un control sobre la gestación actual más reciente del
+# historial sin reenviar el documento completo.
+
+@bp.post("/<historial_id>/gestacion-actual/apn")
+def agregar_control_apn(historial_id):
+    """Agrega un control prenatal ($push). Responde 201 con su apn_id."""
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    res, code = service_gestacion_actual.agregar_control_apn(historial_id, request.get_json(silent=True))
+    return jsonify(res), code
+
+
+@bp.patch("/<historial_id>/gestacion-actual/apn/<apn_ref>")
+def actualizar_control_apn(historial_id, apn_ref):
+    """Actualiza solo los campos enviados del control (apn_id, o su posición en controles antiguos)."""
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    res, code = service_gestacion_actual.actualizar_control_apn(
+        historial_id, apn_ref, request.get_json(silent=True)
     )
-    if hist_list_code not in (200, 201) or not hist_list_res.get("ok"):
-        return jsonify(hist_list_res), hist_list_code
+    return jsonify(res), code
+
 
-    items = (hist_list_res["data"] or {}).get("items", [])
-    if not items:
-        res, code = _fail("Historial no encontrado para paciente", 404)
+@bp.delete("/<historial_id>/gestacion-actual/apn/<apn_ref>")
+def eliminar_control_apn(historial_id, apn_ref):
+    """Elimina el control ($pull)."""
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
         return jsonify(res), code
+    res, code = service_gestacion_actual.eliminar_control_apn(historial_id, apn_ref)
+    return jsonify(res), code
 
-    historial_id = items[0].get("id")
 
-    # Reutilizar la lógica de agregado por historial_id
-    hist_res, hist_code = service_historial.obtener_historial(historial_id)
-    if hist_code not in (200, 201) or not hist_res.get("ok"):
-        return jsonify(hist_res), hist_code
+# ---------------- Partograma en curso ----------------
 
-    agregado = {"historial": hist_res["data"]}
-
-    def _obtener(servicio, candidatos):
-        for fn in candidatos:
-            if hasattr(servicio, fn):
-                try:
-                    r, c = getattr(servicio, fn)(historial_id)
-                    if c in (200, 201) and r.get("ok"):
-                        return r["data"]
-                except Exception:
-                    pass
-        return None
+@bp.post("/<historial_id>/parto-aborto/partograma")
+def agregar_control_partograma(historial_id):
+    """Agrega un control del partograma (validado solo él). Responde 201 con el control."""
+    usuario_actual = _usuario_actual_from_request()
+    if not usuario_actual:
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    res, code = service_parto_aborto.agregar_control_partograma(
+        historial_id, request.get_json(silent=True), usuario_actual=usuario_actual
+    )
+    return jsonify(res), code
 
-    agregado["identificacion"]  = _obtener(service_identificacion,  ("obtener_identificacion_por_historial",  "get_identificacion_by_historial_id"))
-    agregado["antecedentes"]    = _obtener(service_antencedentes,   ("obtener_antecedentes_por_historial",    "get_antecedentes_by_historial_id"))
-    agregado["gestacion_actual"]= _obtener(service_gestacion_actual,("obtener_gestacion_actual_por_historial","get_gestacion_actual_by_historial_id"))
-    agregado["parto_aborto"]    = _obtener(service_parto_aborto,    ("obtener_parto_aborto_por_historial",    "get_parto_aborto_by_historial_id"))
-    agregado["patologias"]      = _obtener(service_patologias,      ("obtener_patologias_por_historial",      "get_patologias_by_historial_id"))
-    agregado["recien_nacido"]   = _obtener(service_recien_nacido,   ("obtener_recien_nacido_por_historial",   "get_recien_nacido_by_historial_id"))
-    agregado["puerperio"]       = _obtener(service_puerperio,       ("obtener_puerperio_por_historial",       "get_puerperio_by_historial_id"))
-    agregado["egreso_neonatal"] = _obtener(service_egreso_neonatal, ("obtener_egreso_neonatal_por_historial", "get_egreso_neonatal_by_historial_id"))
-    agregado["egreso_materno"]  = _obtener(service_egreso_materno,  ("obtener_egreso_materno_por_historial",  "get_egreso_materno_by_historial_id"))
-    agregado["anticoncepcion"]  = _obtener(service_anticoncepcion,  ("obtener_anticoncepcion_por_historial",  "get_anticoncepcion_by_historial_id"))
 
-    res, code = _ok(agregado, 200)
+@bp.get("/<historial_id>/parto-aborto/partograma")
+def obtener_partograma(historial_id):
+    """
+    Controles en orden de hora + `cursor` (entero). Query: since=<cursor> para traer
+    solo lo registrado desde el último sondeo.
+    """
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    res, code = service_parto_aborto.obtener_partograma(historial_id, since=request.args.get("since"))
+    return jsonify(res), code
+
+
+# ---------------- Puerperio: signos vitales ----------------
+
+@bp.get("/puerperio/signos-vitales")
+def tablero_signos_vitales():
+    """
+    Tablero de sala: últimas `horas` (24 por defecto) de signos vitales de todas
+    las pacientes, resumidas cada `cada` minutos (60 por defecto).
+    """
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    res, code = service_puerperio.tablero_signos_vitales(
+        horas=request.args.get("horas"), cada=request.args.get("cada")
+    )
+    return jsonify(res), code
+
+
+@bp.post("/<historial_id>/puerperio/registros")
+def agregar_registro_puerperio(historial_id):
+    """Agrega un registro de puerperio inmediato a la serie. Responde 201 con el registro."""
+    usuario_actual = _usuario_actual_from_request()
+    if not usuario_actual:
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    res, code = service_puerperio.agregar_registro_serie(
+        historial_id, request.get_json(silent=True), usuario_actual=usuario_actual
+    )
+    return jsonify(res), code
+
+
+@bp.get("/<historial_id>/puerperio/registros")
+def obtener_registros_puerperio(historial_id):
+    """
+    Query: desde, hasta (fecha/hora; por defecto las últimas 24 h) y
+    cada=<minutos> para el resumen por ventana en vez de cada registro.
+    """
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    res, code = service_puerperio.obtener_serie(
+        historial_id,
+        desde=request.args.get("desde"),
+        hasta=request.args.get("hasta"),
+        cada=request.args.get("cada"),
+    )
     return jsonify(res), code
@@ -4,22 +4,25 @@ from datetime import datetime, timezone
 import re
 
 from app import mongo
+from app.db import counters
 from app.services.medicos_service import validar_payload_medico, serializar_medico
+from app.utils import paginacion
 
 medicos_bp = Blueprint("medicos_bp", __name__, url_prefix="/medicos")
 
 FOLIO_PREFIX = "MED-"
 FOLIO_PATTERN = re.compile(r"^MED-\d{4,}$")  # MED-0001, MED-0123, MED-10000
+FOLIO_COUNTER = "folio:medicos"
 
 
 def oid(value):
     return ObjectId(value) if value and ObjectId.is_valid(value) else None
 
 
-def generar_siguiente_folio():
+def _max_folio_existente():
     """
-    Genera el siguiente folio secuencial con prefijo MED- y 4+ dígitos.
-    Usa una agregación para extraer la parte numérica del folio actual más alto.
+    Número del folio MED-#### más alto guardado (0 si no hay).
+    Recorre toda la colección: solo se usa para sembrar el contador la primera vez.
     """
     pipeline = [
         {"$match": {"folio": {"$regex": r"^MED-\d{4,}$"}}},
@@ -39,8 +42,16 @@ def generar_siguiente_folio():
     ]
 
     docs = list(mongo.db.medicos.aggregate(pipeline))
-    last_num = docs[0]["_folio_num"] if docs else 0
-    next_num = last_num + 1
+    return docs[0]["_folio_num"] if docs else 0
+
+
+def generar_siguiente_folio():
+    """
+    Genera el siguiente folio secuencial con prefijo MED- y 4+ dígitos.
+    Un $inc atómico sobre counters (folio:medicos); el contador se siembra
+    una única vez con el folio más alto existente.
+    """
+    next_num = counters.siguiente(FOLIO_COUNTER, semilla=_max_folio_existente)
     # zfill(4) garantiza al menos 4 dígitos
     return f"{FOLIO_PREFIX}{str(next_num).zfill(4)}"
 
@@ -61,6 +72,9 @@ def crear_medico():
         if not FOLIO_PATTERN.match(folio_in):
             return jsonify({"message": "Validación fallida", "errors": {"folio": "Formato inválido. Use MED-0001"}}), 422
         cleaned["folio"] = folio_in
+        # que la secuencia automática no vuelva a entregar este número
+        counters.asegurar_minimo(FOLIO_COUNTER, int(folio_in[len(FOLIO_PREFIX):]),
+                                 semilla=_max_folio_existente)
     else:
         cleaned["folio"] = generar_siguiente_folio()
 
@@ -96,6 +110,8 @@ def listar_medicos():
       sexo: femenino|masculino|otro|no_especificado
       page: int (1..)
       limit: int (1..200)
+      after: token `next_cursor` de la respuesta anterior (paginación por cursor, sin skip)
+      count: exact|estimated|none (por defecto exact; none en modo cursor)
       sort: updated_at|-updated_at|nombre_completo|-nombre_completo|fecha_nacimiento|-fecha_nacimiento|folio|-folio
     """
     q = (request.args.get("q") or "").strip()
@@ -136,24 +152,32 @@ def listar_medicos():
         "-folio": ("folio", -1),
     }
     sort_field, sort_dir = sort_map.get(sort, ("updated_at", -1))
+    orden = paginacion.orden_con_desempate([(sort_field, sort_dir)])
 
     col = mongo.db.medicos
-    total = col.count_documents(filtro)
-    docs = (
-        col.find(filtro)
-        .sort(sort_field, sort_dir)
-        .skip((page - 1) * limit)
-        .limit(limit)
-    )
-    data = [serializar_medico(d) for d in docs]
-
-    return jsonify({
-        "data": data,
-        "page": page,
+    after = paginacion.parsear_after(request.args.get("after"))
+    try:
+        if after is not None:
+            conteo = paginacion.parsear_conteo(request.args.get("count"), default="none")
+            pag = paginacion.paginar_keyset(col, filtro, orden, limit, after, serializar_medico, conteo=conteo)
+        else:
+            conteo = paginacion.parsear_conteo(request.args.get("count"))
+            pag = paginacion.paginar_offset(col, filtro, orden, page, limit, serializar_medico, conteo=conteo)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 422
+
+    resp = {
+        "data": pag["items"],
         "limit": limit,
-        "total": total,
-        "has_more": page * limit < total
-    }), 200
+        "has_more": pag["has_more"],
+        "next_cursor": pag["next_cursor"],
+    }
+    if after is None:
+        resp["page"] = page
+        resp["total"] = pag["total"]
+    elif "total" in pag:
+        resp["total"] = pag["total"]
+    return jsonify(resp), 200
 
 
 @medicos_bp.get("/<id>")
@@ -180,6 +204,9 @@ def actualizar_medico(id):
         if not FOLIO_PATTERN.match(folio_in):
             return jsonify({"message": "Validación fallida", "errors": {"folio": "Formato inválido. Use MED-0001"}}), 422
         cleaned["folio"] = folio_in
+        # igual que al crear: la secuencia no debe volver a entregar este número
+        counters.asegurar_minimo(FOLIO_COUNTER, int(folio_in[len(FOLIO_PREFIX):]),
+                                 semilla=_max_folio_existente)
 
     cleaned["updated_at"] = datetime.now(timezone.utc)
     cleaned["updated_by"] = None
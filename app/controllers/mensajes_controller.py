@@ -3,6 +3,7 @@ from app.services import service_mensajes as svc
 from app.services import service_paciente as svc_pac
 from datetime import datetime, timezone
 from app.utils.jwt_manager import verificar_token
+from app.utils import paginacion, streaming
 
 bp = Blueprint("mensajes", __name__, url_prefix="/mensajes")
 
@@ -54,7 +55,7 @@ def _resolver_paciente_id_por_hint(*, paciente_id=None, tipo_identificacion=None
             return res["data"]["id"], None, None
         return None, res.get("error") or "Paciente no encontrado", 404 if code == 404 else 422
 
-    # Por nombre y apellido -> usar listar_pacientes(q) y exigir match único
+    # Por nombre y apellido -> usar buscar_pacientes(q) (índice de búsqueda) y exigir match único
     consulta = None
     if nombre and apellido:
         consulta = f"{nombre} {apellido}"
@@ -63,7 +64,7 @@ def _resolver_paciente_id_por_hint(*, paciente_id=None, tipo_identificacion=None
 
     if consulta:
         try:
-            lr, lc = svc_pac.listar_pacientes(q=consulta, page=1, per_page=5, solo_activos=True)
+            lr, lc = svc_pac.buscar_pacientes(consulta, limit=5, solo_activos=True)
         except Exception as e:
             return None, str(e), 400
         if lc == 200 and lr.get("ok"):
@@ -110,9 +111,18 @@ def list_mensajes():
         if err:
             return jsonify({"ok": False, "data": None, "error": err}), err_code
         paciente_id = pid
+    # ?stream=1 o Accept: application/x-ndjson: todos los mensajes como NDJSON, sin paginar
+    if streaming.pide_stream():
+        try:
+            items = svc.iterar_mensajes(paciente_id=paciente_id, batch_size=streaming.batch_size())
+        except ValueError as ve:
+            return jsonify({"ok": False, "data": None, "error": str(ve)}), 422
+        return streaming.ndjson(items)
     page = request.args.get("page", 1)
     per_page = request.args.get("per_page", 20)
-    res, code = svc.listar_mensajes(paciente_id=paciente_id, page=page, per_page=per_page)
+    after = paginacion.parsear_after(request.args.get("after"))
+    res, code = svc.listar_mensajes(paciente_id=paciente_id, page=page, per_page=per_page, after=after,
+                                    count=request.args.get("count"))
     if code == 200 and res.get("ok") and res.get("data"):
         try:
             now = datetime.now(timezone.utc)
@@ -1,8 +1,7 @@
 from flask import Blueprint, request, jsonify
-from bson import ObjectId
-from app import mongo
-from app.db import start_session_if_possible
+from app.db import start_session_if_possible, identity_map
 from app.utils.jwt_manager import verificar_token
+from app.utils import paginacion, streaming
 from app.services import service_paciente, service_historial
 
 bp = Blueprint("pacientes", __name__, url_prefix="/pacientes")
@@ -73,28 +72,6 @@ def crear_paciente():
     historial_id = None
     session_used = False
 
-    def _resolve_numero_gesta(current_payload, paciente_id_str, session=None):
-        supplied = current_payload.get("numero_gesta")
-        if supplied not in (None, "", 0):
-            return supplied
-        try:
-            oid = ObjectId(paciente_id_str)
-        except Exception:
-            return 1
-        query = {"paciente_id": oid}
-        if session:
-            doc = mongo.db.historiales.find_one(query, sort=[("numero_gesta", -1)], session=session)
-        else:
-            doc = mongo.db.historiales.find_one(query, sort=[("numero_gesta", -1)])
-        if not doc:
-            return 1
-        ultimo = doc.get("numero_gesta") or 0
-        try:
-            ultimo = int(ultimo)
-        except Exception:
-            ultimo = 0
-        return ultimo + 1
-
     try:
         with start_session_if_possible() as s:
             session_used = bool(s)
@@ -114,7 +91,12 @@ def crear_paciente():
                 if hist_data is not None:
                     hist_payload = dict(hist_data or {})
                     hist_payload["paciente_id"] = paciente_id
-                    hist_payload["numero_gesta"] = _resolve_numero_gesta(hist_payload, paciente_id, session=s)
+                    ges_res, ges_code = service_paciente.asignar_numero_gesta(
+                        paciente_id, hist_payload.get("numero_gesta"), session=s
+                    )
+                    if ges_code != 200 or not ges_res.get("ok"):
+                        raise RuntimeError(ges_res.get("error") or "Error asignando numero_gesta")
+                    hist_payload["numero_gesta"] = ges_res["data"]["numero_gesta"]
 
                     his_res, his_code = service_historial.crear_historial(hist_payload, session=s)
                     if his_code not in (200, 201) or not his_res.get("ok"):
@@ -136,6 +118,8 @@ def crear_paciente():
             except Exception:
                 if s:
                     s.abort_transaction()
+                # Lo registrado en el identity map ya no existe tras el abort
+                identity_map.limpiar()
                 raise
     except Exception as e:
         if paciente_id and not session_used:
@@ -154,6 +138,67 @@ def crear_paciente():
     res, code = _ok(resumen, 201)
     return jsonify(res), code
 
+@bp.get("/")
+def listar_pacientes():
+    """
+    Listado de pacientes (created_at desc).
+    Query: q, page, per_page, activos=0|1, after=<next_cursor> (paginación por cursor),
+           count=exact|estimated|none.
+    ?stream=1 o Accept: application/x-ndjson: todos los resultados como NDJSON, sin paginar.
+    """
+    if not _usuario_actual_from_request():
+        res, code = _fail("usuario no autenticado", 401)
+        return jsonify(res), code
+    if streaming.pide_stream():
+        try:
+            items = service_paciente.iterar_pacientes(
+                q=request.args.get("q"),
+                solo_activos=(request.args.get("activos") or "1") != "0",
+                batch_size=streaming.batch_size(),
+            )
+        except ValueError as ve:
+            res, code = _fail(str(ve), 422)
+            return jsonify(res), code
+        return streaming.ndjson(items)
+
+    res, code = service_paciente.listar_pacientes(
+        q=request.args.get("q"),
+        page=request.args.get("page", 1),
+        per_page=request.args.get("per_page", 20),
+        solo_activos=(request.args.get("activos") or "1") != "0",
+        after=paginacion.parsear_after(request.args.get("after")),
+        count=request.args.get("count"),
+    )
+    return jsonify(res), code
+
+@bp.get("/buscar")
+def buscar_pacientes():
+    """
+    Búsqueda rankeada por nombre/apellido (prefijos, sin tildes) o por
+    identificación/expediente (con o sin guiones).
+    Query: q (requerido), limit (1..50, defecto 10), activos=0|1.
+    """
+    res, code = service_paciente.buscar_pacientes(
+        request.args.get("q"),
+        limit=request.args.get("limit", 10),
+        solo_activos=(request.args.get("activos") or "1") != "0",
+    )
+    return jsonify(res), code
+
+@bp.get("/buscar-fonetico")
+def buscar_pacientes_fonetico():
+    """
+    Búsqueda aproximada por nombre/apellido: "Maria Jose Lopez" encuentra
+    "MARÍA JOSÉ LÓPEZ DE LA O", "Jerardo" encuentra "Gerardo".
+    Query: q (requerido), limit (1..50, defecto 10), activos=0|1.
+    """
+    res, code = service_paciente.buscar_pacientes_fonetico(
+        request.args.get("q"),
+        limit=request.args.get("limit", 10),
+        solo_activos=(request.args.get("activos") or "1") != "0",
+    )
+    return jsonify(res), code
+
 @bp.get("/<paciente_id>")
 def obtener_paciente(paciente_id):
     """
@@ -165,7 +210,7 @@ def obtener_paciente(paciente_id):
 
     # Traer historial más reciente
     hist_list_res, hist_list_code = service_historial.listar_historiales(
-        paciente_id=paciente_id, page=1, per_page=1
+        paciente_id=paciente_id, page=1, per_page=1, count="none"
     )
 
     historial_mas_reciente = None
@@ -5,10 +5,16 @@ from app.models.usuario_model import serializar_usuario
 from app.utils.helpers import encriptar_password, verificar_password
 from app.utils.jwt_manager import generar_token, token_required
 from app.utils.helpers import verificar_password
+from app.utils import streaming
 
 @token_required
 def obtener_usuarios(usuario_actual):
-    usuarios = mongo.db.usuarios.find()
+    # sin password: solo los campos que expone serializar_usuario
+    proyeccion = {"password": 0}
+    if streaming.pide_stream():
+        cursor = mongo.db.usuarios.find({}, proyeccion, batch_size=streaming.batch_size())
+        return streaming.ndjson(serializar_usuario(usuario) for usuario in cursor)
+    usuarios = mongo.db.usuarios.find({}, proyeccion)
     resultado = [serializar_usuario(usuario) for usuario in usuarios]
     return jsonify(resultado)
 
@@ -1,101 +1,87 @@
-from pymongo import ASCENDING, DESCENDING
 from flask import current_app
 from contextlib import contextmanager
+from datetime import datetime
 
 def get_db():
-    """Devuelve la DB actual sin importar directamente 'mongo' para evitar ciclos."""
-    return current_app.extensions["pymongo"].db
+    """
+    Devuelve la DB de la app. Flask-PyMongo no se registra en app.extensions:
+    se usa la instancia `mongo` (import diferido para evitar ciclos).
+    """
+    from app import mongo
+    if mongo.db is None:
+        raise RuntimeError("Mongo no está inicializado (falta mongo.init_app o MONGO_URI sin base)")
+    return mongo.db
 
 def _safe_create(collection, keys, **kwargs):
     """
     Crea un índice si no existe. No rompe si ya existe o si hay race-conditions.
     keys: lista de tuplas [("campo", ASCENDING|DESCENDING)]
     kwargs: name=..., unique=True, etc.
+    Retorna None si quedó creado, o el error si falló.
     """
     db = get_db()
     try:
         db[collection].create_index(keys, **kwargs)
     except Exception as e:
-        # Loguea y continúa para no frenar el arranque
+        # Loguea y continúa con los demás; quien llama decide si la versión queda aplicada
         print(f"[indexes] WARN {collection}:{kwargs.get('name')} -> {e}")
+        return e
+    return None
+
+# Versión de app.db.index_spec. Subirla cada vez que cambie la spec:
+# el arranque (o `flask indexes apply`) la compara con la guardada en db_meta.
+INDEXES_VERSION = 7
+META_COLLECTION = "db_meta"
 
 def init_indexes():
+    """
+    Crea los índices declarados en app.db.index_spec. Es el único lugar que
+    ejecuta create_index; los services no crean índices en cada request.
+    Solo crea: borrar redundantes/conflictivos es cosa de `flask indexes apply`.
+    Retorna la lista de fallidos [(coleccion, nombre, error)] (vacía si todo OK).
+    """
+    from app.db.index_spec import INDEXES, opciones
+
+    fallidos = []
+    for coleccion, specs in INDEXES.items():
+        for s in specs:
+            error = _safe_create(coleccion, s["keys"], name=s["name"], **opciones(s))
+            if error is not None:
+                fallidos.append((coleccion, s["name"], error))
+
+    if fallidos:
+        print(f"[indexes] {len(fallidos)} índices sin crear; revisar con `flask indexes diff`")
+    else:
+        print("[indexes] OK – índices creados/actualizados")
+    return fallidos
+
+def registrar_version_indexes():
+    ahora = datetime.utcnow()
+    get_db()[META_COLLECTION].update_one(
+        {"_id": "indexes"},
+        {
+            "$set": {"version": INDEXES_VERSION, "applied_at": ahora},
+            "$push": {"aplicadas": {"version": INDEXES_VERSION, "applied_at": ahora}},
+        },
+        upsert=True,
+    )
+
+def ensure_indexes(force: bool = False):
+    """
+    Aplica init_indexes() solo si la versión registrada en db_meta es distinta
+    de INDEXES_VERSION (o si force=True). Retorna True si aplicó.
+    La versión solo se registra si se crearon todos los índices: si alguno falló
+    (p. ej. un único con duplicados), el próximo arranque vuelve a intentarlo.
+    """
     db = get_db()
+    meta = db[META_COLLECTION].find_one({"_id": "indexes"}) or {}
+    if not force and meta.get("version") == INDEXES_VERSION:
+        return False
 
-    # ---------------- pacientes ----------------
-    _safe_create("paciente", [("identificacion", ASCENDING)], name="uq_identificacion", unique=True)
-    _safe_create("paciente", [("codigo_expediente", ASCENDING)], name="uq_codigo_expediente", unique=True)
-
-    # ---------------- historiales ----------------
-    _safe_create("historiales", [("paciente_id", ASCENDING), ("numero_gesta", ASCENDING)],
-                 name="uq_paciente_gesta", unique=True)
-    _safe_create("historiales", [("paciente_id", ASCENDING)], name="ix_paciente")
-    _safe_create("historiales", [("created_at", DESCENDING), ("numero_gesta", DESCENDING)],
-                 name="ix_created_gesta")
-    for ref in [
-        "identificacion_id", "antecedentes_id", "gestacion_actual_id",
-        "parto_aborto_id", "patologias_id", "recien_nacido_id",
-        "puerperio_id", "egreso_neonatal_id", "egreso_materno_id",
-        "anticoncepcion_id"
-    ]:
-        _safe_create("historiales", [(ref, ASCENDING)], name=f"ix_{ref}")
-
-    # ---------------- identificacion ----------------
-    _safe_create("identificacion", [("historial_id", ASCENDING)], name="historial_idx")
-    _safe_create("identificacion", [("created_at", DESCENDING)], name="created_desc_idx")
-
-    # ---------------- antecedentes ----------------
-    _safe_create("antecedentes", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-
-    # ---------------- gestacion_actual ----------------
-    _safe_create("gestacion_actual", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-
-    # ---------------- parto_aborto ----------------
-    _safe_create("parto_aborto", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-    _safe_create("parto_aborto", [("historial_id", ASCENDING), ("fecha_ingreso", DESCENDING)],
-                 name="historial_fecha_ingreso_idx")
-    _safe_create("parto_aborto", [("fecha_ingreso", DESCENDING)], name="fecha_ingreso_idx")  # opcional
-
-    # ---------------- patologias ----------------
-    _safe_create("patologias", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-
-    # ---------------- recien_nacidos (ojo: plural) ----------------
-    _safe_create("recien_nacidos", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-
-    # ---------------- mensajes ----------------
-    _safe_create("mensajes", [("paciente_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="ix_mensajes_paciente_created")
-    _safe_create("mensajes", [("created_at", DESCENDING)], name="ix_mensajes_created")
-
-    # ---------------- citas ----------------
-    _safe_create("citas", [("start_at", ASCENDING)], name="ix_citas_start_at")
-    _safe_create("citas", [("paciente_id", ASCENDING)], name="ix_citas_paciente")
-    _safe_create("citas", [("status", ASCENDING)], name="ix_citas_status")
-
-    # ---------------- puerperio ----------------
-    _safe_create("puerperio", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-
-    # ---------------- egreso_neonatal ----------------
-    _safe_create("egreso_neonatal", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-
-    # ---------------- egreso_materno ----------------
-    _safe_create("egreso_materno", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-    _safe_create("egreso_materno", [("egreso_materno.fecha", DESCENDING)],
-                 name="paciente_fecha_egreso_idx")  # si ese path existe
-
-    # ---------------- anticoncepcion ----------------
-    _safe_create("anticoncepcion", [("historial_id", ASCENDING), ("created_at", DESCENDING)],
-                 name="historial_created_desc_idx")
-
-    print("[indexes] OK – índices creados/actualizados")
+    if init_indexes():
+        return False
+    registrar_version_indexes()
+    return True
 
 @contextmanager
 def start_session_if_possible():
@@ -109,7 +95,8 @@ def start_session_if_possible():
                 ... operaciones con session=s ...
     """
     try:
-        client = current_app.extensions["pymongo"].cx  # PyMongo MongoClient
+        from app import mongo
+        client = mongo.cx  # PyMongo MongoClient
         session = client.start_session()
     except Exception as e:
         # No hay replicaset / driver no soporta / etc.
@@ -0,0 +1,56 @@
+from pymongo import ReturnDocument
+from app import mongo
+
+# Secuencias atómicas (colección counters): {_id: <clave>, seq: <último valor entregado>}.
+# Cada asignación es un único find_one_and_update con $inc, así dos requests
+# concurrentes nunca reciben el mismo valor y no hay bucles de reintento.
+#
+# Claves en uso:
+#   expediente:<MMM><IIII><S><DDMMAA>   dígitos de control de codigo_expediente
+#   folio:medicos                      número de folio MED-####
+#   partograma:<historial_id>          seq de los controles (cursor ?since= de la serie)
+
+
+def _col():
+    return mongo.db.counters
+
+
+def siguiente(clave: str, semilla=None, session=None) -> int:
+    """
+    Incrementa y devuelve la secuencia `clave` (1 la primera vez).
+    semilla: callable opcional que devuelve el último valor ya usado fuera del
+    contador (datos previos a la secuencia). Solo se consulta si el contador aún
+    no existe; se aplica con $max, por lo que es segura ante carreras.
+    """
+    doc = _col().find_one_and_update(
+        {"_id": clave}, {"$inc": {"seq": 1}},
+        return_document=ReturnDocument.AFTER, session=session
+    )
+    if doc is not None:
+        return int(doc["seq"])
+
+    if semilla is not None:
+        asegurar_minimo(clave, int(semilla() or 0), session=session)
+
+    doc = _col().find_one_and_update(
+        {"_id": clave}, {"$inc": {"seq": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER, session=session
+    )
+    return int(doc["seq"])
+
+
+def asegurar_minimo(clave: str, valor: int, semilla=None, session=None):
+    """
+    Garantiza seq >= valor ($max). Para valores asignados a mano (p. ej. un folio
+    enviado por el cliente), así la secuencia nunca vuelve a entregarlos.
+    Con `semilla`, si el contador aún no existe se siembra antes (igual que en siguiente()).
+    """
+    if semilla is not None and actual(clave, session=session) is None:
+        valor = max(int(valor), int(semilla() or 0))
+    _col().update_one({"_id": clave}, {"$max": {"seq": int(valor)}}, upsert=True, session=session)
+
+
+def actual(clave: str, session=None):
+    """Último valor entregado (None si la secuencia no existe)."""
+    doc = _col().find_one({"_id": clave}, {"seq": 1}, session=session)
+    return int(doc["seq"]) if doc else None
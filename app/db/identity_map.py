@@ -0,0 +1,102 @@
+from flask import g, has_app_context, current_app
+from app import mongo
+
+# Identity map por request (flask.g): {(colección, _id): documento}.
+# Los services consultan aquí antes de ir a Mongo; las escrituras del mismo
+# request registran el documento nuevo o invalidan la entrada.
+# Fuera de un app context no cachea nada.
+
+
+def _estado():
+    if not has_app_context():
+        return None
+    est = getattr(g, "_identity_map", None)
+    if est is None:
+        est = {"docs": {}, "hits": 0, "misses": 0}
+        g._identity_map = est
+    return est
+
+
+def obtener_por_id(coleccion: str, oid, session=None):
+    """
+    find_one({"_id": oid}) con cache por request.
+    Retorna una copia superficial del documento (o None, que no se cachea).
+    """
+    est = _estado()
+    clave = (coleccion, oid)
+    if est is not None and clave in est["docs"]:
+        est["hits"] += 1
+        return dict(est["docs"][clave])
+
+    doc = mongo.db[coleccion].find_one({"_id": oid}, session=session)
+    if est is not None:
+        est["misses"] += 1
+        if doc is not None:
+            est["docs"][clave] = doc
+    return dict(doc) if doc is not None else None
+
+
+def registrar(coleccion: str, doc: dict):
+    """Guarda/actualiza el documento tras un insert o un find_one_and_update."""
+    est = _estado()
+    if est is not None and doc and doc.get("_id") is not None:
+        est["docs"][(coleccion, doc["_id"])] = dict(doc)
+
+
+def invalidar(coleccion: str, oid=None):
+    """Quita una entrada (o toda la colección si oid es None)."""
+    est = _estado()
+    if est is None:
+        return
+    if oid is None:
+        for clave in [k for k in est["docs"] if k[0] == coleccion]:
+            est["docs"].pop(clave, None)
+    else:
+        est["docs"].pop((coleccion, oid), None)
+
+
+def limpiar():
+    """Vacía el mapa (p. ej. tras abortar una transacción)."""
+    est = _estado()
+    if est is not None:
+        est["docs"].clear()
+
+
+def exportar():
+    """Copia del mapa (docs + contadores) para pasarlo a otro app context, o None."""
+    est = _estado()
+    if est is None:
+        return None
+    return {"docs": dict(est["docs"]), "hits": est["hits"], "misses": est["misses"]}
+
+def cargar(datos):
+    """Inicia el mapa de este app context con los documentos de `datos` (sin contadores)."""
+    est = _estado()
+    if est is not None and datos:
+        est["docs"].update(datos["docs"])
+
+def fusionar(datos):
+    """Incorpora lo leído en otro app context; lo ya presente aquí no se pisa."""
+    est = _estado()
+    if est is None or not datos:
+        return
+    for clave, doc in datos["docs"].items():
+        est["docs"].setdefault(clave, doc)
+    est["hits"] += datos["hits"]
+    est["misses"] += datos["misses"]
+
+def estadisticas():
+    est = _estado()
+    if est is None:
+        return {"hits": 0, "misses": 0}
+    return {"hits": est["hits"], "misses": est["misses"]}
+
+
+def init_app(app):
+    """Con DB_DEBUG_HEADERS (o app.debug) expone X-Identity-Map: hits=..,misses=.."""
+    @app.after_request
+    def _identity_map_headers(response):
+        if current_app.config.get("DB_DEBUG_HEADERS") or current_app.debug:
+            est = estadisticas()
+            response.headers["X-Identity-Map"] = f"hits={est['hits']},misses={est['misses']}"
+        return response
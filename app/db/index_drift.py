@@ -0,0 +1,151 @@
+from app.db import get_db, _safe_create
+from app.db.index_spec import INDEXES, RETIRADOS, OPCIONES, opciones
+
+# Compara app.db.index_spec con lo que hay en cada colección (list_indexes()).
+# Clasificación por colección:
+#   faltantes:   declarados en la spec y ausentes en la colección
+#   conflictos:  mismo nombre con otro key/opciones, o mismo key+opciones con otro nombre
+#   redundantes: no declarados y cubiertos por otro índice (mismo key o key prefijo),
+#                o listados en RETIRADOS -> se borran
+#   extra:       no declarados y no cubiertos; solo se reportan (puede ser un índice manual)
+
+
+def _key(keys):
+    """Normaliza [(campo, dir)] o {campo: dir} a una tupla comparable."""
+    items = keys.items() if hasattr(keys, "items") else keys
+    out = []
+    for campo, direccion in items:
+        try:
+            direccion = int(direccion)
+        except (TypeError, ValueError):
+            pass  # "text", "2dsphere", ...
+        out.append((campo, direccion))
+    return tuple(out)
+
+def _opts(info: dict) -> dict:
+    return {k: info[k] for k in OPCIONES if info.get(k) not in (None, False)}
+
+def _es_prefijo(corto, largo):
+    return len(corto) <= len(largo) and largo[:len(corto)] == corto
+
+def _actuales(db, coleccion):
+    try:
+        infos = list(db[coleccion].list_indexes())
+    except Exception:
+        return {}  # la colección aún no existe
+    return {
+        i["name"]: {"name": i["name"], "key": _key(i["key"]), "opts": _opts(i)}
+        for i in infos if i["name"] != "_id_"
+    }
+
+
+def comparar_coleccion(coleccion: str, specs: list, actuales: dict, retirados=()) -> dict:
+    rep = {"faltantes": [], "conflictos": [], "redundantes": [], "extra": []}
+    declarados = {
+        s["name"]: {"name": s["name"], "key": _key(s["keys"]), "opts": _opts(opciones(s)), "spec": s}
+        for s in specs
+    }
+
+    for nombre, d in declarados.items():
+        actual = actuales.get(nombre)
+        if actual is not None:
+            if actual["key"] != d["key"] or actual["opts"] != d["opts"]:
+                rep["conflictos"].append({
+                    "name": nombre, "motivo": "definición distinta",
+                    "esperado": {"key": d["key"], **d["opts"]},
+                    "actual": {"key": actual["key"], **actual["opts"]},
+                    "spec": d["spec"],
+                })
+            continue
+        otro = next((a for a in actuales.values()
+                     if a["name"] not in declarados and a["key"] == d["key"]), None)
+        if otro is not None and otro["opts"] == d["opts"]:
+            # create_index fallaría ("already exists with a different name")
+            rep["conflictos"].append({
+                "name": nombre, "motivo": f"existe como '{otro['name']}'",
+                "esperado": {"key": d["key"], **d["opts"]},
+                "actual": {"key": otro["key"], **otro["opts"]},
+                "spec": d["spec"], "reemplaza": otro["name"],
+            })
+        else:
+            rep["faltantes"].append(d["spec"])
+
+    reemplazados = {c.get("reemplaza") for c in rep["conflictos"]}
+    # Índices que quedan tras aplicar: los declarados (con su key) cubren a los no declarados
+    cubridores = [d["key"] for d in declarados.values()]
+    for nombre, a in actuales.items():
+        if nombre in declarados or nombre in reemplazados:
+            continue
+        if nombre in retirados:
+            rep["redundantes"].append({"name": nombre, "key": a["key"], "cubierto_por": "retirado"})
+            continue
+        # un único / parcial / TTL impone algo más que el orden: nunca se trata como redundante
+        if a["opts"]:
+            rep["extra"].append({"name": nombre, "key": a["key"], **a["opts"]})
+            continue
+        cubierto_por = next((k for k in cubridores if _es_prefijo(a["key"], k)), None)
+        if cubierto_por is not None:
+            rep["redundantes"].append({"name": nombre, "key": a["key"], "cubierto_por": cubierto_por})
+        else:
+            rep["extra"].append({"name": nombre, "key": a["key"]})
+    return rep
+
+
+def comparar(colecciones=None) -> dict:
+    """{coleccion: reporte} para las colecciones de la spec (o las indicadas)."""
+    db = get_db()
+    nombres = colecciones or sorted(INDEXES)
+    return {
+        c: comparar_coleccion(c, INDEXES.get(c, []), _actuales(db, c), RETIRADOS.get(c, ()))
+        for c in nombres
+    }
+
+def hay_diferencias(reporte: dict) -> bool:
+    return any(r["faltantes"] or r["conflictos"] or r["redundantes"] for r in reporte.values())
+
+
+def aplicar(reporte: dict, borrar_redundantes=True, corregir_conflictos=False, on_accion=None):
+    """
+    Lleva cada colección a la spec: crea faltantes, borra redundantes y,
+    con corregir_conflictos, borra y recrea los índices en conflicto.
+    Cada acción es independiente: si una falla se reporta y se sigue con las demás.
+    Retorna {"hechas": [(accion, coleccion, nombre)],
+             "fallidas": [(accion, coleccion, nombre, error)]}.
+    """
+    db = get_db()
+    hechas, fallidas = [], []
+
+    def _hecho(accion, coleccion, nombre, error=None):
+        if error is None:
+            hechas.append((accion, coleccion, nombre))
+        else:
+            fallidas.append((accion, coleccion, nombre, str(error)))
+        if on_accion:
+            on_accion(accion, coleccion, nombre, error)
+        return error is None
+
+    def _drop(coleccion, nombre):
+        try:
+            db[coleccion].drop_index(nombre)
+        except Exception as e:
+            return _hecho("drop", coleccion, nombre, e)
+        return _hecho("drop", coleccion, nombre)
+
+    def _create(coleccion, s):
+        error = _safe_create(coleccion, s["keys"], name=s["name"], **opciones(s))
+        return _hecho("create", coleccion, s["name"], error)
+
+    for coleccion, rep in reporte.items():
+        for s in rep["faltantes"]:
+            _create(coleccion, s)
+
+        if corregir_conflictos:
+            for c in rep["conflictos"]:
+                # si no se pudo borrar el viejo, recrear fallaría igual
+                if _drop(coleccion, c.get("reemplaza") or c["name"]):
+                    _create(coleccion, c["spec"])
+
+        if borrar_redundantes:
+            for r in rep["redundantes"]:
+                _drop(coleccion, r["name"])
+    return {"hechas": hechas, "fallidas": fallidas}
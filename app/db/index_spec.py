@@ -0,0 +1,119 @@
+from pymongo import ASCENDING, DESCENDING
+
+# Especificación declarativa de índices por colección.
+# Es la única fuente de verdad: init_indexes() la aplica y `flask indexes diff`
+# la compara con list_indexes() de cada colección.
+#
+# Cada entrada: {"name", "keys": [(campo, dirección)], <opciones de create_index>}
+# Regla: no declarar un índice cuyo key sea prefijo de otro ya declarado
+# (p. ej. historial_id solo, si existe historial_id + created_at); el compuesto
+# ya lo cubre y cada índice extra se paga en cada insert.
+
+# Secciones HCP: se leen "la más reciente por historial" (historial_id + created_at desc)
+# y por paciente_id (compat con documentos antiguos).
+_SECCIONES = {
+    "identificacion": "ix_ident_paciente",
+    "antecedentes": "ix_antecedentes_paciente_id",
+    "gestacion_actual": "ix_ga_paciente_id",
+    "parto_aborto": "ix_pa_paciente",
+    "patologias": "ix_pat_paciente",
+    "recien_nacidos": "ix_rn_paciente",
+    "puerperio": "ix_puer_paciente",
+    "egreso_neonatal": "ix_en_paciente_id",
+    "egreso_materno": "ix_em_paciente_id",
+    "anticoncepcion": "ix_anticoncepcion_paciente_id",
+}
+
+_REFS_HISTORIAL = [
+    "identificacion_id", "antecedentes_id", "gestacion_actual_id",
+    "parto_aborto_id", "patologias_id", "recien_nacido_id",
+    "puerperio_id", "egreso_neonatal_id", "egreso_materno_id",
+    "anticoncepcion_id",
+]
+
+INDEXES = {
+    "paciente": [
+        {"name": "uq_tipo_num_identificacion",
+         "keys": [("tipo_identificacion", ASCENDING), ("numero_identificacion", ASCENDING)],
+         "unique": True},
+        {"name": "uq_codigo_expediente", "keys": [("codigo_expediente", ASCENDING)], "unique": True},
+        {"name": "ix_historial_id", "keys": [("historial_id", ASCENDING)]},
+        # listado por cursor: created_at desc + _id (con y sin filtro activo)
+        {"name": "ix_activo_created_id",
+         "keys": [("activo", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "ix_created_id", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+        # búsqueda por prefijos/identificador (multikey, ver app.utils.busqueda)
+        {"name": "ix_busqueda_claves", "keys": [("busqueda_claves", ASCENDING), ("activo", ASCENDING)]},
+    ],
+    "historiales": [
+        # también cubre las búsquedas solo por paciente_id
+        {"name": "uq_paciente_gesta",
+         "keys": [("paciente_id", ASCENDING), ("numero_gesta", ASCENDING)],
+         "unique": True},
+        # listado por cursor (reemplaza a ix_created_gesta, que es prefijo de estos)
+        {"name": "ix_created_gesta_id",
+         "keys": [("created_at", DESCENDING), ("numero_gesta", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "ix_paciente_created_gesta_id",
+         "keys": [("paciente_id", ASCENDING), ("created_at", DESCENDING),
+                  ("numero_gesta", DESCENDING), ("_id", DESCENDING)]},
+    ] + [{"name": f"ix_{ref}", "keys": [(ref, ASCENDING)]} for ref in _REFS_HISTORIAL],
+    "historial_snapshots": [
+        {"name": "ix_snap_paciente_created_gesta",
+         "keys": [("paciente_id", ASCENDING), ("created_at", DESCENDING), ("numero_gesta", DESCENDING)]},
+    ],
+    "mensajes": [
+        {"name": "ix_mensajes_paciente_created_id",
+         "keys": [("paciente_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "ix_mensajes_created_id", "keys": [("created_at", DESCENDING), ("_id", DESCENDING)]},
+    ],
+    # un índice por cada `sort` admitido en GET /medicos (se recorre en ambos sentidos)
+    "medicos": [
+        {"name": f"ix_{campo}_id", "keys": [(campo, ASCENDING), ("_id", ASCENDING)]}
+        for campo in ("updated_at", "nombre_completo", "fecha_nacimiento", "folio")
+    ],
+    "citas": [
+        {"name": "ix_citas_start_at", "keys": [("start_at", ASCENDING)]},
+        {"name": "ix_citas_paciente", "keys": [("paciente_id", ASCENDING)]},
+        {"name": "ix_citas_status", "keys": [("status", ASCENDING)]},
+    ],
+}
+
+for _col, _ix_paciente in _SECCIONES.items():
+    INDEXES[_col] = [
+        {"name": "historial_created_desc_idx", "keys": [("historial_id", ASCENDING), ("created_at", DESCENDING)]},
+        {"name": _ix_paciente, "keys": [("paciente_id", ASCENDING)]},
+    ]
+
+INDEXES["parto_aborto"] += [
+    {"name": "historial_fecha_ingreso_idx", "keys": [("historial_id", ASCENDING), ("fecha_ingreso", DESCENDING)]},
+    {"name": "fecha_ingreso_idx", "keys": [("fecha_ingreso", DESCENDING)]},
+]
+INDEXES["egreso_materno"] += [
+    {"name": "paciente_fecha_egreso_idx", "keys": [("egreso_materno.fecha", DESCENDING)]},
+]
+
+# Series en buckets (app.db.series): la lectura filtra por clave y recorre por inicio
+for _col in ("partograma_series", "puerperio_series"):
+    INDEXES[_col] = [
+        {"name": "historial_inicio_idx", "keys": [("historial_id", ASCENDING), ("inicio", ASCENDING)]},
+    ]
+# tablero de sala: últimas N horas de todas las pacientes (un rango sobre inicio)
+INDEXES["puerperio_series"] += [
+    {"name": "inicio_idx", "keys": [("inicio", ASCENDING)]},
+]
+
+# Índices que existieron y deben borrarse aunque no estén cubiertos por otro.
+RETIRADOS = {
+    # paciente no tiene campo `identificacion`: el único sobre null rechaza la segunda alta
+    "paciente": ["uq_identificacion"],
+    # reemplazados por historial_created_desc_idx
+    "identificacion": ["historial_idx", "created_desc_idx"],
+}
+
+# Opciones que, si difieren, hacen que dos índices con el mismo key no sean equivalentes
+OPCIONES = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "collation")
+
+
+def opciones(spec: dict) -> dict:
+    """Opciones de create_index de una entrada (todo menos name/keys)."""
+    return {k: v for k, v in spec.items() if k not in ("name", "keys")}
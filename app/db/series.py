@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from bson import ObjectId
+from flask import current_app
+from app import mongo
+from app.db import counters
+
+# Series de tiempo en buckets (patrón bucket): en vez de un documento por lectura o
+# un array que crece sin límite dentro de la sección, cada colección de serie guarda
+#   {_id, <clave...>, inicio, n, items: [...], primero, ultimo, ultimo_registro,
+#    ultimo_seq, created_at, updated_at}
+# - inicio: comienzo de la ventana de tiempo clínica del bucket (p. ej. la hora)
+# - items: ordenados por `ts` ($push con $sort), a lo sumo `max_items` por bucket
+#   (si se llena, la siguiente lectura de esa ventana abre otro bucket)
+# - ultimo_seq: mayor `seq` de sus items, para las lecturas incrementales (?since=).
+#   `seq` sale de un contador por serie (app.db.counters, un $inc en el servidor),
+#   no del reloj de cada proceso: un item cargado tarde con ts antiguo igual se entrega.
+# `ts` es la hora clínica tal como se ingresa en sala (naive, sin zona): los rangos
+# por defecto ("últimas 24 h") se calculan con ahora_clinica(), no con utcnow().
+# `registrado` sí es UTC (solo lo usa el cursor).
+# Cada agregado es un update_one con upsert (más el $inc de la secuencia si la hay);
+# leer trae solo los buckets tocados.
+
+# Un hueco en la secuencia (seq asignado y aún no escrito) frena el cursor; si el
+# item siguiente al hueco lleva más que esto registrado, el hueco se da por perdido
+# (la escritura falló después de asignar el seq).
+_HUECO_SEGUNDOS = 60
+
+
+def ahora_clinica() -> datetime:
+    """Ahora en la base de `ts`: ZONA_HORARIA de la config (p. ej. "America/Guayaquil") o la hora local del servidor."""
+    zona = current_app.config.get("ZONA_HORARIA")
+    if zona:
+        return datetime.now(ZoneInfo(zona)).replace(tzinfo=None)
+    return datetime.now()
+
+def ventana(ts: datetime, minutos: int) -> datetime:
+    """Inicio de la ventana de `minutos` que contiene ts (60 -> la hora en punto)."""
+    base = ts.replace(second=0, microsecond=0)
+    return base - timedelta(minutes=(base.hour * 60 + base.minute) % minutos)
+
+
+def agregar(coleccion: str, clave: dict, item: dict, minutos: int = 60, max_items: int = 60,
+            secuencia: str | None = None, session=None) -> dict:
+    """
+    Agrega `item` (con su `ts` datetime) al bucket de su ventana. Asigna item["_id"]
+    y item["registrado"]; con `secuencia` (clave del contador de la serie) también
+    item["seq"], que es lo que usa leer(since=). Retorna el item guardado.
+    """
+    ahora = datetime.utcnow()
+    item = {**item, "_id": ObjectId(), "registrado": ahora}
+    maximos = {"ultimo": item["ts"], "ultimo_registro": ahora}
+    if secuencia:
+        # fuera de la sesión: el contador no entra en la transacción (un hueco si falla)
+        item["seq"] = maximos["ultimo_seq"] = counters.siguiente(secuencia)
+    ts = item["ts"]
+    mongo.db[coleccion].update_one(
+        {**clave, "inicio": ventana(ts, minutos), "n": {"$lt": max_items}},
+        {
+            "$push": {"items": {"$each": [item], "$sort": {"ts": 1}}},
+            "$inc": {"n": 1},
+            "$min": {"primero": ts},
+            "$max": maximos,
+            "$set": {"updated_at": ahora},
+            "$setOnInsert": {"created_at": ahora},
+        },
+        upsert=True, session=session,
+    )
+    return item
+
+
+def _filtro_rango(clave: dict, desde, hasta, minutos: int) -> dict:
+    """
+    Buckets que pueden tener items en [desde, hasta]. Se filtra por `inicio` (fijo
+    desde que se crea el bucket), así el rango usa el índice (clave..., inicio).
+    """
+    filtro = dict(clave)
+    rango = {}
+    if desde is not None:
+        rango["$gte"] = ventana(desde, minutos)
+    if hasta is not None:
+        rango["$lte"] = hasta
+    if rango:
+        filtro["inicio"] = rango
+    return filtro
+
+def _items(buckets, desde=None, hasta=None, since=None):
+    """Aplana los buckets aplicando rango clínico (ts) y since (seq)."""
+    for bucket in buckets:
+        for it in bucket.get("items") or []:
+            if since is not None and it.get("seq", 0) <= since:
+                continue
+            if (desde is not None and it["ts"] < desde) or (hasta is not None and it["ts"] > hasta):
+                continue
+            yield bucket, it
+
+def _cursor(items, since):
+    """
+    Mayor seq hasta el que no faltan items: un seq asignado cuya escritura aún no
+    llegó no se salta (se entrega en el próximo sondeo), salvo que ya sea un hueco perdido.
+    """
+    cursor = since or 0
+    limite = datetime.utcnow() - timedelta(seconds=_HUECO_SEGUNDOS)
+    for it in sorted(items, key=lambda it: it.get("seq", 0)):
+        seq = it.get("seq", 0)
+        if seq <= cursor:
+            continue
+        if seq != cursor + 1 and it["registrado"] > limite:
+            break
+        cursor = seq
+    return cursor
+
+def leer(coleccion: str, clave: dict, desde=None, hasta=None, since: int | None = None,
+         minutos: int = 60, session=None) -> dict:
+    """
+    Items de la serie en orden de ts.
+      desde/hasta: rango clínico (ts) inclusivo
+      since:       solo items con seq mayor (series con `secuencia`)
+    Retorna {"items": [...], "cursor": <seq para el próximo ?since=>}. Los items
+    posteriores a un hueco reciente se repiten en el próximo sondeo (deduplicar por id).
+    """
+    filtro = _filtro_rango(clave, desde, hasta, minutos)
+    if since is not None:
+        filtro["ultimo_seq"] = {"$gt": since}
+
+    buckets = mongo.db[coleccion].find(filtro, {"items": 1}, session=session).sort([("inicio", 1), ("_id", 1)])
+    items = [it for _b, it in _items(buckets, desde, hasta, since)]
+    # buckets de ventanas distintas ya vienen en orden; varios de la misma ventana pueden solaparse
+    items.sort(key=lambda it: it["ts"])
+    return {"items": items, "cursor": _cursor(items, since)}
+
+def leer_por_clave(coleccion: str, campo: str, desde, hasta=None, minutos: int = 60,
+                   extra=(), filtro_extra: dict | None = None, session=None) -> dict:
+    """
+    Una sola consulta por rango (índice inicio) para TODAS las series de la colección.
+    Retorna {valor de `campo`: {"items": [en orden de ts], <campos de `extra`>}}
+    (p. ej. por historial_id, con paciente_id como extra).
+    """
+    filtro = _filtro_rango(filtro_extra or {}, desde, hasta, minutos)
+    proyeccion = {campo: 1, "items": 1, **{c: 1 for c in extra}}
+    grupos = {}
+    buckets = mongo.db[coleccion].find(filtro, proyeccion, session=session)
+    for bucket, it in _items(buckets, desde, hasta):
+        grupo = grupos.get(bucket.get(campo))
+        if grupo is None:
+            grupo = grupos[bucket.get(campo)] = {"items": [], **{c: bucket.get(c) for c in extra}}
+        grupo["items"].append(it)
+    for grupo in grupos.values():
+        grupo["items"].sort(key=lambda it: it["ts"])
+    return grupos
+
+def resumir(items: list, minutos: int, valores) -> list:
+    """
+    Downsampling: agrupa items (ya ordenados por ts) en ventanas de `minutos` y
+    resume cada valor numérico que devuelve valores(item) -> {nombre: número}.
+    Retorna [{"ts": inicio, "n": cantidad, nombre: {"min", "max", "prom", "ultimo"}}].
+    """
+    out, actual, acum = [], None, None
+    for it in items:
+        inicio = ventana(it["ts"], minutos)
+        if inicio != actual:
+            if acum is not None:
+                out.append(_cerrar(actual, acum))
+            actual, acum = inicio, {"n": 0}
+        acum["n"] += 1
+        for nombre, v in valores(it).items():
+            if v is None:
+                continue
+            r = acum.setdefault(nombre, {"min": v, "max": v, "suma": 0.0, "cuenta": 0})
+            r["min"], r["max"] = min(r["min"], v), max(r["max"], v)
+            r["suma"] += v
+            r["cuenta"] += 1
+            r["ultimo"] = v
+    if acum is not None:
+        out.append(_cerrar(actual, acum))
+    return out
+
+def _cerrar(inicio, acum):
+    punto = {"ts": inicio, "n": acum.pop("n")}
+    for nombre, r in acum.items():
+        punto[nombre] = {"min": r["min"], "max": r["max"],
+                         "prom": round(r["suma"] / r["cuenta"], 2), "ultimo": r["ultimo"]}
+    return punto
+
+
+def eliminar(coleccion: str, clave: dict, session=None) -> int:
+    """Borra todos los buckets de la serie. Retorna cuántos."""
+    return mongo.db[coleccion].delete_many(clave, session=session).deleted_count
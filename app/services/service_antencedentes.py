@@ -1,7 +1,13 @@
 from datetime import datetime 
 from dateutil.relativedelta import relativedelta 
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import (
+    ErrorValidacion, compilar, campo, booleano, entero, fecha_hora, opcion, texto, object_id, objeto,
+)
 
 # ---------------- Respuestas estándar ----------------
 def _ok(data, code=200):   return {"ok": True, "data": data, "error": None}, code
@@ -23,24 +29,14 @@ _PESO_ULTIMO_PREVIO_ENUM = {
     "no aplica/sin dato",
 }
 
-_REQUIRED_FIELDS = [
-    "antecedentes_familiares",
-    "antecedentes_personales",
-    "gesta_previa",
-    "partos",
-    "cesareas",
-    "vaginales",
-    "abortos",
-    "nacidos_vivos",
-    "nacidos_muertos",
-    "embarazo_ectopico",
-    "hijos_vivos",
-    "muertos_primera_semana",
-    "muertos_despues_semana",
-    "fecha_fin_ultimo_embarazo",
-    "embarazo_planeado",
-    "fracaso_metodo_anticonceptivo",
-]
+_CONTEOS = (
+    "gesta_previa", "partos", "cesareas", "vaginales", "abortos",
+    "nacidos_vivos", "nacidos_muertos", "embarazo_ectopico",
+    "hijos_vivos", "muertos_primera_semana", "muertos_despues_semana",
+)
+
+# fecha_fin_ultimo_embarazo: si solo viene 'YYYY-MM', queda el día 01
+_FORMATOS_FFUE = ("%Y-%m-%d", "%d/%m/%Y", "%Y-%m")
 
 # ---------------- Utils ----------------
 def _to_oid(v, field):
@@ -49,53 +45,6 @@ def _to_oid(v, field):
     except Exception:
         raise ValueError(f"{field} no es un ObjectId válido")
 
-def _norm_enum(v, opts, field):
-    if isinstance(v, str):
-        vv = v.strip()
-        if vv in opts:
-            return vv
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(opts))}")
-
-def _as_nonneg_int(v, field):
-    try:
-        iv = int(v)
-        if iv < 0:
-            raise ValueError
-        return iv
-    except Exception:
-        raise ValueError(f"{field} debe ser entero >= 0")
-
-def _as_bool(v, field):
-    if isinstance(v, bool):
-        return v
-    if isinstance(v, (int, float)) and v in (0, 1):
-        return bool(v)
-    if isinstance(v, str) and v.lower() in ("true", "false"):
-        return v.lower() == "true"
-    raise ValueError(f"{field} debe ser booleano")
-
-def _parse_date(s, field):
-    """
-    Acepta 'YYYY-MM-DD' o 'DD/MM/YYYY'. Si solo viene 'YYYY-MM', asume día 01.
-    """
-    if not isinstance(s, str):
-        raise ValueError(f"{field} debe ser string")
-    s = s.strip()
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y-%m"):
-        try:
-            dt = datetime.strptime(s, fmt)
-            if fmt == "%Y-%m":
-                dt = dt.replace(day=1)
-            return dt
-        except ValueError:
-            continue
-    raise ValueError(f"{field} debe tener formato 'YYYY-MM-DD', 'DD/MM/YYYY' o 'YYYY-MM'")
-
-def _require_fields(payload: dict):
-    faltan = [f for f in _REQUIRED_FIELDS if f not in payload]
-    if faltan:
-        raise ValueError("Campos requeridos faltantes: " + ", ".join(faltan))
-
 #  helper para clasificar el intervalo desde FFUE a fecha de referencia
 def _clasificar_tiempo_desde_ultimo_embarazo(ffue: datetime, ref: datetime | None = None) -> str:
     """
@@ -218,11 +167,11 @@ def _validate_obstetric_coherence(data: dict):
             "nacidos_vivos", "nacidos_muertos", "embarazo_ectopico",
             "hijos_vivos", "muertos_primera_semana", "muertos_despues_semana"
         ]
-        for campo in campos_a_cero:
-            valor = data.get(campo)
+        for nombre in campos_a_cero:
+            valor = data.get(nombre)
             if valor is not None and int(valor) != 0:
                 raise ValueError(
-                    f"Inconsistencia de datos: Si 'gesta_previa' es 0, '{campo}' debe ser 0."
+                    f"Inconsistencia de datos: Si 'gesta_previa' es 0, '{nombre}' debe ser 0."
                 )
 
     if partos != cesareas + vaginales:
@@ -240,16 +189,6 @@ def _validate_obstetric_coherence(data: dict):
             )
 
 # ======================================================================
-def _ensure_indexes():
-    try:
-        mongo.db.antecedentes.create_index("historial_id", name="ix_antecedentes_historial_id")
-    except Exception:
-        pass
-    try:
-        mongo.db.antecedentes.create_index("paciente_id", name="ix_antecedentes_paciente_id")
-    except Exception:
-        pass
-
 def _serialize(doc: dict):
     return {
         "id": str(doc["_id"]),
@@ -282,124 +221,100 @@ def _serialize(doc: dict):
         "updated_at": doc.get("updated_at"),
     }
 
-# ---------------- Normalizadores de subdocumentos ----------------
-_FAM_REQ = {"tbc", "diabetes", "hipertension", "preeclampsia", "eclampsia", "otra_condicion_medica_grave"}
-_FAM_OPT = {"observaciones"}
+# ---------------- Esquemas (compilados una vez al importar) ----------------
+_FAM_REQ = ("tbc", "diabetes", "hipertension", "preeclampsia", "eclampsia", "otra_condicion_medica_grave")
 
-_PER_REQ = {
+_PER_REQ = (
     "tbc", "diabetes", "hipertension", "preeclampsia", "eclampsia",
     "otra_condicion_medica_grave", "violencia", "vih", "cirugia_genito_urinaria",
-    "infertilidad", "cardiopatia", "nefropatia"
-}
-#  agregar peso_ultimo_previo como opcional
-_PER_OPT = {"antecedente_gemelares", "observaciones", "diabetes_tipo", "peso_ultimo_previo"}
+    "infertilidad", "cardiopatia", "nefropatia",
+)
 
-#  defaults para completar faltantes al CREAR
-_FAM_DEFAULTS = {k: False for k in _FAM_REQ}
-_PER_DEFAULTS = {k: False for k in _PER_REQ}
-
-def _norm_str(v, field):
-    if v is None:
-        return None
+def _peso_ultimo_previo(v):
+    """Enum del schema o etiqueta legacy del front (ver _map_peso_client_to_schema)."""
     if not isinstance(v, str):
-        raise ValueError(f"{field} debe ser string")
-    return v.strip()
+        raise ValueError("debe ser string")
+    mapeado = _map_peso_client_to_schema(v)
+    if mapeado is None:
+        raise ValueError("inválido")
+    return mapeado
+
+# Al crear los flags que faltan (o vienen null) quedan en False
+_ESQUEMA_FAM = [
+    *(campo(k, booleano(), ausente=False) for k in _FAM_REQ),
+    campo("observaciones", texto()),
+]
+_ESQUEMA_PER = [
+    *(campo(k, booleano(), ausente=False) for k in _PER_REQ),
+    campo("antecedente_gemelares", booleano()),
+    campo("observaciones", texto()),
+    campo("diabetes_tipo", opcion(_DIABETES_TIPO)),
+    campo("peso_ultimo_previo", _peso_ultimo_previo),
+]
 
-#  normalizador RELAJADO para crear (completa faltantes con False)
-def _norm_antecedentes_familiares(obj: dict) -> dict:
-    if not isinstance(obj, dict):
-        # si no mandan objeto, inicializamos a todos False
-        obj = {}
-    out = dict(_FAM_DEFAULTS)  # completa todo a False
-    # pisa con lo que venga en el payload (validando tipos si vienen)
-    for k in _FAM_REQ:
-        if k in obj and obj[k] is not None:
-            out[k] = _as_bool(obj[k], f"antecedentes_familiares.{k}")
-    if "observaciones" in obj and obj["observaciones"] is not None:
-        out["observaciones"] = _norm_str(obj["observaciones"], "antecedentes_familiares.observaciones")
-    return out
+# Documento completo; actualizar usa parcial=True (los subdocumentos aparte, ver _subdoc_parcial)
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),
+    campo("identificacion_id", object_id(), si="valor"),
+    campo("antecedentes_familiares", objeto(_ESQUEMA_FAM), requerido=True),
+    campo("antecedentes_personales", objeto(_ESQUEMA_PER), requerido=True),
+    *(campo(k, entero(0), requerido=True) for k in _CONTEOS),
+    campo("fecha_fin_ultimo_embarazo", fecha_hora(_FORMATOS_FFUE), requerido=True),
+    campo("tiempo_desde_ultimo_embarazo", opcion(_TIEMPO_INTERVALOS)),
+    campo("embarazo_planeado", opcion(_SI_NO), requerido=True),
+    campo("fracaso_metodo_anticonceptivo", opcion(_FRACASO_METODO), requerido=True),
+])
+
+# En update los subdocumentos son parciales: solo las claves enviadas, sin defaults
+_SUBDOCS = {
+    "antecedentes_familiares": compilar(_ESQUEMA_FAM),
+    "antecedentes_personales": compilar(_ESQUEMA_PER),
+}
 
-#  normalizador RELAJADO para crear (completa faltantes con False)
-def _norm_antecedentes_personales(obj: dict) -> dict:
+def _subdoc_parcial(nombre: str, obj) -> dict:
     if not isinstance(obj, dict):
-        obj = {}
-    out = dict(_PER_DEFAULTS)
-    for k in _PER_REQ:
-        if k in obj and obj[k] is not None:
-            out[k] = _as_bool(obj[k], f"antecedentes_personales.{k}")
-
-    # opcionales
-    if "antecedente_gemelares" in obj and obj["antecedente_gemelares"] is not None:
-        out["antecedente_gemelares"] = _as_bool(obj["antecedente_gemelares"], "antecedentes_personales.antecedente_gemelares")
-    if "observaciones" in obj and obj["observaciones"] is not None:
-        out["observaciones"] = _norm_str(obj["observaciones"], "antecedentes_personales.observaciones")
-
-    # peso_ultimo_previo (acepta legacy y enum)
-    if "peso_ultimo_previo" in obj and obj["peso_ultimo_previo"] is not None:
-        p = _norm_str(obj["peso_ultimo_previo"], "antecedentes_personales.peso_ultimo_previo")
-        mapped = _map_peso_client_to_schema(p)
-        if mapped is None or mapped not in _PESO_ULTIMO_PREVIO_ENUM:
-            raise ValueError("antecedentes_personales.peso_ultimo_previo inválido")
-        out["peso_ultimo_previo"] = mapped
-
-    # diabetes_tipo
-    diab = out.get("diabetes", False)
-    if "diabetes_tipo" in obj and obj["diabetes_tipo"] is not None:
-        dt = _norm_str(obj["diabetes_tipo"], "antecedentes_personales.diabetes_tipo")
-        if dt not in _DIABETES_TIPO:
-            raise ValueError("antecedentes_personales.diabetes_tipo inválido")
-        out["diabetes_tipo"] = dt
-    else:
-        # si no mandan diabetes_tipo:
-        out["diabetes_tipo"] = "ninguna" if not diab else "ninguna"  # por defecto
-        if diab:
-            # si diabetes es True y no vino tipo, exige tipo explícito
+        raise ValueError(f"{nombre} debe ser objeto")
+    validar = _SUBDOCS[nombre]
+    extras = set(obj) - set(validar.campos)
+    if extras:
+        raise ValueError(f"{nombre}: campos no permitidos: " + ", ".join(sorted(extras)))
+    try:
+        return validar(obj, parcial=True)
+    except ErrorValidacion as ev:
+        raise ErrorValidacion([(f"{nombre}.{c}", t) for c, t in ev.errores])
+
+def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
+    payload = _compat_map_legacy(payload, for_update=False)
+
+    normalized_data = {
+        "historial_id": _to_oid(historial_id, "historial_id"),
+        **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
+           if usuario_actual and usuario_actual.get("usuario_id") else {}),
+        **_validar(payload),
+    }
+
+    # Si envían el tiempo categorizado ya se validó; si no, lo calculamos.
+    if "tiempo_desde_ultimo_embarazo" not in normalized_data:
+        normalized_data["tiempo_desde_ultimo_embarazo"] = _clasificar_tiempo_desde_ultimo_embarazo(
+            normalized_data["fecha_fin_ultimo_embarazo"]
+        )
+
+    # diabetes_tipo: "ninguna" por defecto, salvo que diabetes sea true (entonces es obligatorio)
+    personales = normalized_data["antecedentes_personales"]
+    if "diabetes_tipo" not in personales:
+        if personales["diabetes"]:
             raise ValueError("Si antecedentes_personales.diabetes es true, debe indicar diabetes_tipo")
+        personales["diabetes_tipo"] = "ninguna"
 
-    return out
+    _validate_obstetric_coherence(normalized_data)
 
-# --- Estos dos siguen siendo 'partial' para UPDATE (ya existían) ---
-def _norm_antecedentes_familiares_partial(obj: dict) -> dict:
-    if not isinstance(obj, dict):
-        raise ValueError("antecedentes_familiares debe ser objeto")
-    extras = set(obj.keys()) - (_FAM_REQ | _FAM_OPT)
-    if extras:
-        raise ValueError("antecedentes_familiares: campos no permitidos: " + ", ".join(sorted(extras)))
-    out = {}
-    for k in (set(obj.keys()) & _FAM_REQ):
-        out[k] = _as_bool(obj[k], f"antecedentes_familiares.{k}")
-    if "observaciones" in obj and obj["observaciones"] is not None:
-        out["observaciones"] = _norm_str(obj["observaciones"], "antecedentes_familiares.observaciones")
-    return out
+    doc = {
+        **normalized_data,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+    return doc
 
-def _norm_antecedentes_personales_partial(obj: dict) -> dict:
-    if not isinstance(obj, dict):
-        raise ValueError("antecedentes_personales debe ser objeto")
-    extras = set(obj.keys()) - (_PER_REQ | _PER_OPT)
-    if extras:
-        raise ValueError("antecedentes_personales: campos no permitidos: " + ", ".join(sorted(extras)))
-    out = {}
-    for k in (set(obj.keys()) & _PER_REQ):
-        out[k] = _as_bool(obj[k], f"antecedentes_personales.{k}")
-    if "antecedente_gemelares" in obj and obj["antecedente_gemelares"] is not None:
-        out["antecedente_gemelares"] = _as_bool(obj["antecedente_gemelares"], "antecedentes_personales.antecedente_gemelares")
-    if "observaciones" in obj and obj["observaciones"] is not None:
-        out["observaciones"] = _norm_str(obj["observaciones"], "antecedentes_personales.observaciones")
-
-    # permitir actualización parcial de peso_ultimo_previo (acepta legacy y enum)
-    if "peso_ultimo_previo" in obj and obj["peso_ultimo_previo"] is not None:
-        p = _norm_str(obj["peso_ultimo_previo"], "antecedentes_personales.peso_ultimo_previo")
-        mapped = _map_peso_client_to_schema(p)
-        if mapped is None or mapped not in _PESO_ULTIMO_PREVIO_ENUM:
-            raise ValueError("antecedentes_personales.peso_ultimo_previo inválido")
-        out["peso_ultimo_previo"] = mapped
-
-    if "diabetes_tipo" in obj and obj["diabetes_tipo"] is not None:
-        dt = _norm_str(obj["diabetes_tipo"], "antecedentes_personales.diabetes_tipo")
-        if dt not in _DIABETES_TIPO:
-            raise ValueError("antecedentes_personales.diabetes_tipo inválido")
-        out["diabetes_tipo"] = dt
-    return out
 
 # ---------------- Services ----------------
 def crear_antecedentes(
@@ -414,63 +329,14 @@ def crear_antecedentes(
         if not historial_id:
             return _fail("historial_id es requerido", 422)
 
-        payload = _compat_map_legacy(payload, for_update=False)
-        _require_fields(payload)
-        _ensure_indexes()
-
         historial_oid = _to_oid(historial_id, "historial_id")
-        if not mongo.db.historiales.find_one({"_id": historial_oid}):
+        if not identity_map.obtener_por_id("historiales", historial_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
-        fecha_ffue = _parse_date(payload["fecha_fin_ultimo_embarazo"], "fecha_fin_ultimo_embarazo")
-
-        # Si envían el tiempo categorizado, lo validamos; si no, lo calculamos.
-        if "tiempo_desde_ultimo_embarazo" in payload and payload["tiempo_desde_ultimo_embarazo"] is not None:
-            tiempo_cat = _norm_enum(
-                payload["tiempo_desde_ultimo_embarazo"], _TIEMPO_INTERVALOS, "tiempo_desde_ultimo_embarazo"
-            )
-        else:
-            tiempo_cat = _clasificar_tiempo_desde_ultimo_embarazo(fecha_ffue)
-
-        normalized_data = {
-            "historial_id": historial_oid,
-            **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-               if payload.get("paciente_id") else {}),
-            **({"identificacion_id": _to_oid(payload["identificacion_id"], "identificacion_id")}
-               if payload.get("identificacion_id") else {}),
-            **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
-               if usuario_actual and usuario_actual.get("usuario_id") else {}),
-            # RELAJADO: completa faltantes con False
-            "antecedentes_familiares": _norm_antecedentes_familiares(payload.get("antecedentes_familiares", {})),
-            "antecedentes_personales": _norm_antecedentes_personales(payload.get("antecedentes_personales", {})),
-            "gesta_previa": _as_nonneg_int(payload["gesta_previa"], "gesta_previa"),
-            "partos": _as_nonneg_int(payload["partos"], "partos"),
-            "cesareas": _as_nonneg_int(payload["cesareas"], "cesareas"),
-            "vaginales": _as_nonneg_int(payload["vaginales"], "vaginales"),
-            "abortos": _as_nonneg_int(payload["abortos"], "abortos"),
-            "nacidos_vivos": _as_nonneg_int(payload["nacidos_vivos"], "nacidos_vivos"),
-            "nacidos_muertos": _as_nonneg_int(payload["nacidos_muertos"], "nacidos_muertos"),
-            "embarazo_ectopico": _as_nonneg_int(payload["embarazo_ectopico"], "embarazo_ectopico"),
-            "hijos_vivos": _as_nonneg_int(payload["hijos_vivos"], "hijos_vivos"),
-            "muertos_primera_semana": _as_nonneg_int(payload["muertos_primera_semana"], "muertos_primera_semana"),
-            "muertos_despues_semana": _as_nonneg_int(payload["muertos_despues_semana"], "muertos_despues_semana"),
-            "fecha_fin_ultimo_embarazo": fecha_ffue,
-            "tiempo_desde_ultimo_embarazo": tiempo_cat,  # NUEVO
-            "embarazo_planeado": _norm_enum(payload["embarazo_planeado"], _SI_NO, "embarazo_planeado"),
-            "fracaso_metodo_anticonceptivo": _norm_enum(
-                payload["fracaso_metodo_anticonceptivo"], _FRACASO_METODO, "fracaso_metodo_anticonceptivo"
-            ),
-        }
-
-        _validate_obstetric_coherence(normalized_data)
-
-        doc = {
-            **normalized_data,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
-        }
+        doc = _build_doc(historial_id, payload, usuario_actual)
         res = (mongo.db.antecedentes.insert_one(doc, session=session)
                if session else mongo.db.antecedentes.insert_one(doc))
+        svc_snap.sincronizar_seccion("antecedentes", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -538,71 +404,41 @@ def actualizar_antecedentes_por_id(ant_id: str, payload: dict, session=None):
         # Ids / FK
         if "historial_id" in upd and upd["historial_id"] is not None:
             h_oid = _to_oid(upd["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
-        if "identificacion_id" in upd and upd["identificacion_id"]:
-            upd["identificacion_id"] = _to_oid(upd["identificacion_id"], "identificacion_id")
-        if "paciente_id" in upd and upd["paciente_id"]:
-            upd["paciente_id"] = _to_oid(upd["paciente_id"], "paciente_id")
         if "usuario_id" in upd and upd["usuario_id"]:
             upd["usuario_id"] = _to_oid(upd["usuario_id"], "usuario_id")
 
-        # Enums
-        if "diabetes_tipo" in upd and upd["diabetes_tipo"] is not None:
-            upd["diabetes_tipo"] = _norm_enum(upd["diabetes_tipo"], _DIABETES_TIPO, "diabetes_tipo")
-        if "embarazo_planeado" in upd and upd["embarazo_planeado"] is not None:
-            upd["embarazo_planeado"] = _norm_enum(upd["embarazo_planeado"], _SI_NO, "embarazo_planeado")
-        if "fracaso_metodo_anticonceptivo" in upd and upd["fracaso_metodo_anticonceptivo"] is not None:
-            upd["fracaso_metodo_anticonceptivo"] = _norm_enum(
-                upd["fracaso_metodo_anticonceptivo"], _FRACASO_METODO, "fracaso_metodo_anticonceptivo"
+        # "__auto__" en tiempo_desde_ultimo_embarazo fuerza el recálculo (no es un valor del enum)
+        tiempo = payload.get("tiempo_desde_ultimo_embarazo")
+        auto = isinstance(tiempo, str) and tiempo.strip() == "__auto__"
+
+        # mismo esquema que al crear, solo con los campos enviados; subdocumentos parciales
+        upd.update(_validar(
+            {k: v for k, v in payload.items()
+             if k not in _SUBDOCS and not (auto and k == "tiempo_desde_ultimo_embarazo")},
+            parcial=True,
+        ))
+        for nombre in _SUBDOCS:
+            if upd.get(nombre) is not None:
+                upd[nombre] = _subdoc_parcial(nombre, upd[nombre])
+
+        if auto:
+            # calculo usando la fecha nueva (si vino) o la ya almacenada
+            current_doc_res = obtener_antecedentes_por_id(ant_id)
+            if not current_doc_res[0]["ok"]:
+                return current_doc_res
+            current_doc = current_doc_res[0]["data"]
+            base_fecha = upd.get("fecha_fin_ultimo_embarazo") or (
+                datetime.strptime(current_doc["fecha_fin_ultimo_embarazo"], "%Y-%m-%d")
+                if current_doc.get("fecha_fin_ultimo_embarazo") else None
             )
-
-        # NUEVO: permitir establecer/forzar tiempo_desde_ultimo_embarazo
-        fecha_en_update = None
-        if "fecha_fin_ultimo_embarazo" in upd and upd["fecha_fin_ultimo_embarazo"]:
-            fecha_en_update = _parse_date(upd["fecha_fin_ultimo_embarazo"], "fecha_fin_ultimo_embarazo")
-            upd["fecha_fin_ultimo_embarazo"] = fecha_en_update
-
-        if "tiempo_desde_ultimo_embarazo" in upd and upd["tiempo_desde_ultimo_embarazo"] is not None:
-            # Permito el valor especial "__auto__" para forzar recálculo sin enviar enum
-            if isinstance(upd["tiempo_desde_ultimo_embarazo"], str) and upd["tiempo_desde_ultimo_embarazo"].strip() == "__auto__":
-                # si mandan "__auto__", calculo usando la fecha nueva (si vino) o la ya almacenada
-                current_doc_res = obtener_antecedentes_por_id(ant_id)
-                if not current_doc_res[0]["ok"]:
-                    return current_doc_res
-                current_doc = current_doc_res[0]["data"]
-                base_fecha = fecha_en_update or (
-                    datetime.strptime(current_doc["fecha_fin_ultimo_embarazo"], "%Y-%m-%d")
-                    if current_doc.get("fecha_fin_ultimo_embarazo") else None
-                )
-                if not base_fecha:
-                    return _fail("No se puede autocalcular tiempo_desde_ultimo_embarazo sin fecha_fin_ultimo_embarazo", 422)
-                upd["tiempo_desde_ultimo_embarazo"] = _clasificar_tiempo_desde_ultimo_embarazo(base_fecha)
-            else:
-                upd["tiempo_desde_ultimo_embarazo"] = _norm_enum(
-                    upd["tiempo_desde_ultimo_embarazo"], _TIEMPO_INTERVALOS, "tiempo_desde_ultimo_embarazo"
-                )
-        elif fecha_en_update is not None:
-            # Si actualizaron la fecha pero no mandaron el tiempo, NO lo tocamos automáticamente
-            # (evitamos cambios silenciosos). Si lo quieres automático siempre, descomenta:
-            # upd["tiempo_desde_ultimo_embarazo"] = _clasificar_tiempo_desde_ultimo_embarazo(fecha_en_update)
-            pass
-
-        # Subdocumentos (parciales en update)
-        if "antecedentes_familiares" in upd and upd["antecedentes_familiares"] is not None:
-            upd["antecedentes_familiares"] = _norm_antecedentes_familiares_partial(upd["antecedentes_familiares"])
-        if "antecedentes_personales" in upd and upd["antecedentes_personales"] is not None:
-            upd["antecedentes_personales"] = _norm_antecedentes_personales_partial(upd["antecedentes_personales"])
-
-        # Ints
-        for k in (
-            "gesta_previa", "partos", "cesareas", "vaginales", "abortos",
-            "nacidos_vivos", "nacidos_muertos", "embarazo_ectopico",
-            "hijos_vivos", "muertos_primera_semana", "muertos_despues_semana"
-        ):
-            if k in upd and upd[k] is not None:
-                upd[k] = _as_nonneg_int(upd[k], k)
+            if not base_fecha:
+                return _fail("No se puede autocalcular tiempo_desde_ultimo_embarazo sin fecha_fin_ultimo_embarazo", 422)
+            upd["tiempo_desde_ultimo_embarazo"] = _clasificar_tiempo_desde_ultimo_embarazo(base_fecha)
+        # Si actualizaron la fecha pero no mandaron el tiempo, NO lo tocamos automáticamente
+        # (evitamos cambios silenciosos).
 
         # Validación de coherencia sobre el merge
         current_doc_res = obtener_antecedentes_por_id(ant_id)
@@ -624,9 +460,14 @@ def actualizar_antecedentes_por_id(ant_id: str, payload: dict, session=None):
         _validate_obstetric_coherence(merged)
 
         upd["updated_at"] = datetime.utcnow()
-        res = mongo.db.antecedentes.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.antecedentes.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "antecedentes", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Antecedentes actualizados"}, 200)
 
     except ValueError as ve:
@@ -637,9 +478,12 @@ def actualizar_antecedentes_por_id(ant_id: str, payload: dict, session=None):
 def eliminar_antecedentes_por_id(ant_id: str, session=None):
     try:
         oid = _to_oid(ant_id, "ant_id")
-        res = mongo.db.antecedentes.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.antecedentes.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Antecedentes eliminados"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -650,6 +494,8 @@ def eliminar_antecedentes_por_historial_id(historial_id: str, session=None):
     try:
         oid = _to_oid(historial_id, "historial_id")
         res = mongo.db.antecedentes.delete_many({"historial_id": oid}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(historial_id=oid, session=session)
         if res.deleted_count == 0:
             return _fail("No se encontraron documentos para este historial", 404)
         return _ok({"mensaje": f"Se eliminaron {res.deleted_count} antecedentes"}, 200)
@@ -662,6 +508,8 @@ def eliminar_antecedentes_por_paciente_id(paciente_id: str, session=None):
     try:
         oid = _to_oid(paciente_id, "paciente_id")
         res = mongo.db.antecedentes.delete_many({"paciente_id": oid}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(paciente_id=oid, session=session)
         if res.deleted_count == 0:
             return _fail("No se encontraron documentos para este paciente", 404)
         return _ok({"mensaje": f"Se eliminaron {res.deleted_count} antecedentes"}, 200)
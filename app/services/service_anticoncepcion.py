@@ -2,7 +2,11 @@
 
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import compilar, campo, opcion, object_id
 
 # ---------------- Respuestas estándar ----------------
 def _ok(data, code=200):   return {"ok": True, "data": data, "error": None}, code
@@ -21,7 +25,14 @@ _METODO = {
     "ninguno",
 }
 
-_REQUIRED_FIELDS = ["consejeria", "metodo_elegido"]  # historial_id se exige en la firma
+# Esquema compilado una vez; lo comparten crear y actualizar (parcial=True).
+# historial_id se exige en la firma.
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),        # apoyo/migración
+    campo("identificacion_id", object_id(), si="valor"),
+    campo("consejeria", opcion(_CONSEJERIA), requerido=True),
+    campo("metodo_elegido", opcion(_METODO), requerido=True),
+])
 
 # ---------------- Utils ----------------
 def _to_oid(v, field):
@@ -30,26 +41,6 @@ def _to_oid(v, field):
     except Exception:
         raise ValueError(f"{field} no es un ObjectId válido")
 
-def _norm_enum(v, opts, field):
-    if isinstance(v, str) and (vv := v.strip()) in opts:
-        return vv
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(opts))}")
-
-def _require_fields(payload: dict):
-    faltan = [f for f in _REQUIRED_FIELDS if f not in payload]
-    if faltan:
-        raise ValueError("Campos requeridos faltantes: " + ", ".join(faltan))
-
-def _ensure_indexes():
-    try:
-        mongo.db.anticoncepcion.create_index("historial_id", name="ix_anticoncepcion_historial_id")
-    except Exception:
-        pass
-    try:
-        mongo.db.anticoncepcion.create_index("paciente_id", name="ix_anticoncepcion_paciente_id")
-    except Exception:
-        pass
-
 def _serialize(doc: dict):
     return {
         "id": str(doc["_id"]),
@@ -63,6 +54,20 @@ def _serialize(doc: dict):
         "updated_at": doc.get("updated_at"),
     }
 
+def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
+    h_oid = _to_oid(historial_id, "historial_id")
+
+    doc = {
+        "historial_id": h_oid,
+        **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
+           if usuario_actual and usuario_actual.get("usuario_id") else {}),
+        **_validar(payload),
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+    return doc
+
+
 # ---------------- Services ----------------
 def crear_anticoncepcion(
     historial_id: str,
@@ -82,30 +87,16 @@ def crear_anticoncepcion(
         if not historial_id:
             return _fail("historial_id es requerido", 422)
 
-        _require_fields(payload)
-        _ensure_indexes()
-
         h_oid = _to_oid(historial_id, "historial_id")
         # validar que el historial exista
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
-        doc = {
-            "historial_id": h_oid,
-            **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-               if payload.get("paciente_id") else {}),
-            **({"identificacion_id": _to_oid(payload["identificacion_id"], "identificacion_id")}
-               if payload.get("identificacion_id") else {}),
-            **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
-               if usuario_actual and usuario_actual.get("usuario_id") else {}),
-            "consejeria": _norm_enum(payload["consejeria"], _CONSEJERIA, "consejeria"),
-            "metodo_elegido": _norm_enum(payload["metodo_elegido"], _METODO, "metodo_elegido"),
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
-        }
+        doc = _build_doc(historial_id, payload, usuario_actual)
 
         res = (mongo.db.anticoncepcion.insert_one(doc, session=session)
                if session else mongo.db.anticoncepcion.insert_one(doc))
+        svc_snap.sincronizar_seccion("anticoncepcion", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -180,29 +171,26 @@ def actualizar_anticoncepcion_por_id(ac_id: str, payload: dict, session=None):
         # FK principal puede cambiarse si se envía
         if "historial_id" in upd and upd["historial_id"] is not None:
             h_oid = _to_oid(upd["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
 
-        # ids auxiliares
-        if "identificacion_id" in upd and upd["identificacion_id"]:
-            upd["identificacion_id"] = _to_oid(upd["identificacion_id"], "identificacion_id")
-        if "paciente_id" in upd and upd["paciente_id"]:
-            upd["paciente_id"] = _to_oid(upd["paciente_id"], "paciente_id")
         if "usuario_id" in upd and upd["usuario_id"]:
             upd["usuario_id"] = _to_oid(upd["usuario_id"], "usuario_id")
 
-        # enums
-        if "consejeria" in upd and upd["consejeria"] is not None:
-            upd["consejeria"] = _norm_enum(upd["consejeria"], _CONSEJERIA, "consejeria")
-        if "metodo_elegido" in upd and upd["metodo_elegido"] is not None:
-            upd["metodo_elegido"] = _norm_enum(upd["metodo_elegido"], _METODO, "metodo_elegido")
+        # mismo esquema que al crear, solo con los campos enviados
+        upd.update(_validar(payload, parcial=True))
 
         upd["updated_at"] = datetime.utcnow()
 
-        res = mongo.db.anticoncepcion.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.anticoncepcion.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "anticoncepcion", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Anticoncepción actualizada"}, 200)
 
     except ValueError as ve:
@@ -213,9 +201,12 @@ def actualizar_anticoncepcion_por_id(ac_id: str, payload: dict, session=None):
 def eliminar_anticoncepcion_por_id(ac_id: str, session=None):
     try:
         oid = _to_oid(ac_id, "ac_id")
-        res = mongo.db.anticoncepcion.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.anticoncepcion.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Anticoncepción eliminada"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -226,6 +217,8 @@ def eliminar_anticoncepcion_por_historial_id(historial_id: str, session=None):
     try:
         oid = _to_oid(historial_id, "historial_id")
         res = mongo.db.anticoncepcion.delete_many({"historial_id": oid}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(historial_id=oid, session=session)
         if res.deleted_count == 0:
             return _fail("No se encontraron documentos para este historial", 404)
         return _ok({"mensaje": f"Se eliminaron {res.deleted_count} anticoncepciones"}, 200)
@@ -237,6 +230,8 @@ def eliminar_anticoncepcion_por_paciente_id(paciente_id: str, session=None):
     try:
         oid = _to_oid(paciente_id, "paciente_id")
         res = mongo.db.anticoncepcion.delete_many({"paciente_id": oid}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(paciente_id=oid, session=session)
         if res.deleted_count == 0:
             return _fail("No se encontraron documentos para este paciente", 404)
         return _ok({"mensaje": f"Se eliminaron {res.deleted_count} anticoncepciones"}, 200)
@@ -3,6 +3,8 @@ from typing import Optional, Tuple
 from bson import ObjectId
 from flask import current_app
 from app import mongo
+from app.db import identity_map
+from app.utils import paginacion
 
 
 # ---------------- Respuestas estándar ----------------
@@ -39,44 +41,32 @@ def _parse_iso(s: str, field: str) -> datetime:
     return dt.astimezone(timezone.utc)
 
 
+def _iso(v):
+    return v.isoformat().replace("+00:00", "Z") if isinstance(v, datetime) else v
+
 def _serialize(doc: dict) -> dict:
+    # strings explícitos: el formato de fechas de citas no depende de JSON_FECHAS
+    paciente_id = doc.get("paciente_id")
     return {
         "_id": str(doc.get("_id")),
-        "paciente_id": str(doc.get("paciente_id")) if isinstance(doc.get("paciente_id"), ObjectId) else (doc.get("paciente_id") or None),
+        "paciente_id": str(paciente_id) if isinstance(paciente_id, ObjectId) else (paciente_id or None),
         "title": doc.get("title"),
         "description": doc.get("description"),
         "provider": doc.get("provider"),
         "status": doc.get("status"),
-        "start_at": (doc.get("start_at").isoformat().replace("+00:00", "Z") if isinstance(doc.get("start_at"), datetime) else doc.get("start_at")),
-        "end_at": (doc.get("end_at").isoformat().replace("+00:00", "Z") if isinstance(doc.get("end_at"), datetime) else doc.get("end_at")),
-        "created_at": (doc.get("created_at").isoformat().replace("+00:00", "Z") if isinstance(doc.get("created_at"), datetime) else doc.get("created_at")),
-        "updated_at": (doc.get("updated_at").isoformat().replace("+00:00", "Z") if isinstance(doc.get("updated_at"), datetime) else doc.get("updated_at")),
+        "start_at": _iso(doc.get("start_at")),
+        "end_at": _iso(doc.get("end_at")),
+        "created_at": _iso(doc.get("created_at")),
+        "updated_at": _iso(doc.get("updated_at")),
     }
 
 
-def _ensure_indexes():
-    try:
-        mongo.db.citas.create_index([("start_at", 1)], name="ix_citas_start_at")
-    except Exception:
-        pass
-    try:
-        mongo.db.citas.create_index([("paciente_id", 1)], name="ix_citas_paciente")
-    except Exception:
-        pass
-    try:
-        mongo.db.citas.create_index([("status", 1)], name="ix_citas_status")
-    except Exception:
-        pass
-
-
 # ---------------- Services ----------------
 def crear_cita(payload: dict):
     try:
         if not isinstance(payload, dict):
             return _fail("JSON inválido", 400)
 
-        _ensure_indexes()
-
         paciente_id = payload.get("paciente_id")
         if not paciente_id:
             return _fail("paciente_id es requerido", 422)
@@ -87,7 +77,7 @@ def crear_cita(payload: dict):
             return _fail(str(ve), 422)
 
         # validar que el paciente exista (FK suave)
-        pac = mongo.db.paciente.find_one({"_id": pac_oid})
+        pac = identity_map.obtener_por_id("paciente", pac_oid)
         if not pac:
             return _fail("paciente no existe", 404)
 
@@ -123,35 +113,33 @@ def crear_cita(payload: dict):
         return _fail("No se pudo crear la cita", 500)
 
 
-def listar_hoy(start_utc: datetime, end_utc: datetime, limit: int = 100):
+def _listar_rango(query: dict, limit: int, count: str):
+    """items ordenados por start_at; total según count (exact|estimated|none)."""
+    conteo = paginacion.parsear_conteo(count)
+    docs = list(mongo.db.citas.find(query).sort("start_at", 1).limit(limit + 1))
+    return {
+        "items": [_serialize(d) for d in docs[:limit]],
+        "total": paginacion.contar(mongo.db.citas, query, conteo),
+        "has_more": len(docs) > limit,
+    }
+
+
+def listar_hoy(start_utc: datetime, end_utc: datetime, limit: int = 100, count: str | None = None):
     try:
-        _ensure_indexes()
-        cur = (
-            mongo.db.citas
-            .find({"start_at": {"$gte": start_utc, "$lte": end_utc}})
-            .sort("start_at", 1)
-            .limit(int(limit) if limit else 100)
-        )
-        items = [_serialize(d) for d in cur]
-        total = mongo.db.citas.count_documents({"start_at": {"$gte": start_utc, "$lte": end_utc}})
-        return _ok({"items": items, "total": total}, 200)
+        query = {"start_at": {"$gte": start_utc, "$lte": end_utc}}
+        return _ok(_listar_rango(query, int(limit) if limit else 100, count), 200)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
     except Exception:
         return _fail("Error al listar citas de hoy", 500)
 
 
-def listar_proximas(start_utc: datetime, end_utc: datetime, limit: int = 200):
+def listar_proximas(start_utc: datetime, end_utc: datetime, limit: int = 200, count: str | None = None):
     try:
-        _ensure_indexes()
         query = {"start_at": {"$gte": start_utc, "$lte": end_utc}}
-        cur = (
-            mongo.db.citas
-            .find(query)
-            .sort("start_at", 1)
-            .limit(int(limit) if limit else 200)
-        )
-        items = [_serialize(d) for d in cur]
-        total = mongo.db.citas.count_documents(query)
-        return _ok({"items": items, "total": total}, 200)
+        return _ok(_listar_rango(query, int(limit) if limit else 200, count), 200)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
     except Exception:
         return _fail("Error al listar próximas citas", 500)
 
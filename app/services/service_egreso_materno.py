@@ -1,6 +1,10 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import compilar, campo, booleano, entero, fecha_hora, opcion, texto, object_id, objeto
 
 # ---------------- Respuestas estándar ----------------
 def _ok(data, code=200):   return {"ok": True, "data": data, "error": None}, code
@@ -10,13 +14,27 @@ def _fail(msg, code=400):  return {"ok": False, "data": None, "error": msg}, cod
 _SI_NO_NC = {"si", "no", "n/c"}
 _ESTADO = {"viva", "fallece"}
 
-_REQUIRED_TOP_LEVEL = [
-    "antirrubeola_post_parto",
-    "gamma_globulina_antiD",
-    "egreso_materno",
-    "dias_completos_desde_parto",
-    "responsable",
-]
+# egreso_materno.fecha: si viene solo la fecha, se asume 00:00
+_FORMATOS_FECHA = ("%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d")
+
+# Esquema compilado una vez; lo comparten crear y actualizar (parcial=True).
+# egreso_materno se valida completo también al actualizar (reemplaza el subdocumento).
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),          # apoyo/migración
+    campo("identificacion_id", object_id(), si="valor"),
+    campo("antirrubeola_post_parto", opcion(_SI_NO_NC, minusculas=True), requerido=True),
+    campo("gamma_globulina_antiD", opcion(_SI_NO_NC, minusculas=True), requerido=True),
+    campo("egreso_materno", objeto([
+        campo("estado", opcion(_ESTADO, minusculas=True), requerido=True),
+        campo("fecha", fecha_hora(_FORMATOS_FECHA), requerido=True),
+        campo("traslado", booleano(), ausente=False),
+        campo("lugar_traslado", texto()),
+        campo("fallece_durante_o_en_traslado", booleano()),
+        campo("edad_en_dias_fallecimiento", entero(0)),
+    ]), requerido=True),
+    campo("dias_completos_desde_parto", entero(0), requerido=True),
+    campo("responsable", texto(), requerido=True),
+])
 
 # ---------------- Utils ----------------
 def _to_oid(v, field):
@@ -25,60 +43,22 @@ def _to_oid(v, field):
     except Exception:
         raise ValueError(f"{field} no es un ObjectId válido")
 
-def _norm_enum(v, opts, field):
-    if isinstance(v, str) and v.strip().lower() in opts:
-        return v.strip().lower()
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(opts))}")
-
-def _as_int(v, field):
-    try:
-        iv = int(v)
-        return iv
-    except Exception:
-        raise ValueError(f"{field} debe ser entero")
-
-def _as_nonneg_int(v, field):
-    iv = _as_int(v, field)
-    if iv < 0:
-        raise ValueError(f"{field} debe ser >= 0")
-    return iv
-
-def _parse_dt_flexible(s, field):
-    """
-    Acepta:
-      - DD/MM/YYYY HH:MM
-      - DD/MM/YYYY
-      - YYYY-MM-DDTHH:MM
-      - YYYY-MM-DD
-    Si viene solo fecha, se asume 00:00.
-    """
-    if not isinstance(s, str):
-        raise ValueError(f"{field} debe ser string")
-    s = s.strip()
-    for fmt in ("%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
-        try:
-            dt = datetime.strptime(s, fmt)
-            if fmt in ("%d/%m/%Y", "%Y-%m-%d"):
-                dt = dt.replace(hour=0, minute=0)
-            return dt
-        except ValueError:
-            continue
-    raise ValueError(f"{field} con formato inválido")
-
-def _require_fields(payload: dict):
-    faltan = [f for f in _REQUIRED_TOP_LEVEL if f not in payload]
-    if faltan:
-        raise ValueError("Campos requeridos faltantes: " + ", ".join(faltan))
-
-def _ensure_indexes():
-    try:
-        mongo.db.egreso_materno.create_index("historial_id", name="ix_em_historial_id")
-    except Exception:
-        pass
-    try:
-        mongo.db.egreso_materno.create_index("paciente_id", name="ix_em_paciente_id")
-    except Exception:
-        pass
+def _coherencia_egreso(egreso: dict):
+    """Reglas de traslado/fallecimiento sobre egreso_materno ya validado."""
+    if egreso["traslado"]:
+        if not egreso.get("lugar_traslado"):
+            raise ValueError("Si 'traslado' es true, 'lugar_traslado' es obligatorio")
+    else:
+        egreso.pop("lugar_traslado", None)
+
+    if egreso["estado"] == "fallece":
+        if egreso.get("edad_en_dias_fallecimiento") is None:
+            raise ValueError("Si estado='fallece', 'edad_en_dias_fallecimiento' es obligatorio")
+    elif egreso["traslado"] and egreso.get("fallece_durante_o_en_traslado"):
+        if egreso.get("edad_en_dias_fallecimiento") is None:
+            raise ValueError("Si fallece durante/en traslado, 'edad_en_dias_fallecimiento' es obligatorio")
+    else:
+        egreso.pop("edad_en_dias_fallecimiento", None)
 
 def _serialize(doc: dict):
     egreso = dict(doc.get("egreso_materno") or {})
@@ -99,6 +79,19 @@ def _serialize(doc: dict):
         "updated_at": doc.get("updated_at"),
     }
 
+def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
+    doc = {
+        "historial_id": _to_oid(historial_id, "historial_id"),
+        **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
+           if usuario_actual and usuario_actual.get("usuario_id") else {}),
+        **_validar(payload),
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+    _coherencia_egreso(doc["egreso_materno"])
+    return doc
+
+
 # ---------------- Services ----------------
 def crear_egreso_materno(
     historial_id: str,
@@ -119,74 +112,16 @@ def crear_egreso_materno(
         if not historial_id:
             return _fail("historial_id es requerido", 422)
 
-        _require_fields(payload)
-        _ensure_indexes()
-
         # validar FK principal
         h_oid = _to_oid(historial_id, "historial_id")
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
-        # enums top-level
-        antirr = _norm_enum(payload["antirrubeola_post_parto"], _SI_NO_NC, "antirrubeola_post_parto")
-        gammaD = _norm_enum(payload["gamma_globulina_antiD"], _SI_NO_NC, "gamma_globulina_antiD")
-
-        # egreso_materno
-        egreso = payload["egreso_materno"]
-        if not isinstance(egreso, dict):
-            return _fail("egreso_materno debe ser objeto", 422)
-        if "estado" not in egreso or "fecha" not in egreso:
-            return _fail("En egreso_materno faltan 'estado' y/o 'fecha'", 422)
-
-        estado = _norm_enum(str(egreso["estado"]), _ESTADO, "egreso_materno.estado")
-        fecha_dt = _parse_dt_flexible(egreso["fecha"], "egreso_materno.fecha")
-
-        traslado_flag = bool(egreso.get("traslado", False))
-        lugar_traslado = (egreso.get("lugar_traslado") or "").strip() if traslado_flag else None
-        if traslado_flag and not lugar_traslado:
-            return _fail("Si 'traslado' es true, 'lugar_traslado' es obligatorio", 422)
-
-        fallece_tx = egreso.get("fallece_durante_o_en_traslado", None)
-        if fallece_tx is not None:
-            fallece_tx = bool(fallece_tx)
-
-        edad_fall = egreso.get("edad_en_dias_fallecimiento", None)
-        if estado == "fallece":
-            if edad_fall is None:
-                return _fail("Si estado='fallece', 'edad_en_dias_fallecimiento' es obligatorio", 422)
-            edad_fall = _as_nonneg_int(edad_fall, "egreso_materno.edad_en_dias_fallecimiento")
-        elif traslado_flag and fallece_tx:
-            if edad_fall is None:
-                return _fail("Si fallece durante/en traslado, 'edad_en_dias_fallecimiento' es obligatorio", 422)
-            edad_fall = _as_nonneg_int(edad_fall, "egreso_materno.edad_en_dias_fallecimiento")
-        else:
-            edad_fall = None
-
-        doc = {
-            "historial_id": h_oid,
-            **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-               if payload.get("paciente_id") else {}),
-            **({"identificacion_id": _to_oid(payload["identificacion_id"], "identificacion_id")}
-               if payload.get("identificacion_id") else {}),
-            **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
-               if usuario_actual and usuario_actual.get("usuario_id") else {}),
-            "antirrubeola_post_parto": antirr,
-            "gamma_globulina_antiD": gammaD,
-            "egreso_materno": {
-                "estado": estado,
-                "fecha": fecha_dt,
-                **({"traslado": True, "lugar_traslado": lugar_traslado} if traslado_flag else {"traslado": False}),
-                **({"fallece_durante_o_en_traslado": fallece_tx} if fallece_tx is not None else {}),
-                **({"edad_en_dias_fallecimiento": edad_fall} if edad_fall is not None else {}),
-            },
-            "dias_completos_desde_parto": _as_nonneg_int(payload["dias_completos_desde_parto"], "dias_completos_desde_parto"),
-            "responsable": str(payload["responsable"]).strip(),
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
-        }
+        doc = _build_doc(historial_id, payload, usuario_actual)
 
         res = (mongo.db.egreso_materno.insert_one(doc, session=session)
                if session else mongo.db.egreso_materno.insert_one(doc))
+        svc_snap.sincronizar_seccion("egreso_materno", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -248,66 +183,28 @@ def actualizar_egreso_materno_por_id(egreso_id: str, payload: dict, session=None
         # FK principal
         if "historial_id" in upd and upd["historial_id"] is not None:
             h_oid = _to_oid(upd["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
 
-        # ids auxiliares
-        if "identificacion_id" in upd and upd["identificacion_id"]:
-            upd["identificacion_id"] = _to_oid(upd["identificacion_id"], "identificacion_id")
-        if "paciente_id" in upd and upd["paciente_id"]:
-            upd["paciente_id"] = _to_oid(upd["paciente_id"], "paciente_id")
         if "usuario_id" in upd and upd["usuario_id"]:
             upd["usuario_id"] = _to_oid(upd["usuario_id"], "usuario_id")
 
-        # top-level enums/ints
-        if "antirrubeola_post_parto" in upd and upd["antirrubeola_post_parto"] is not None:
-            upd["antirrubeola_post_parto"] = _norm_enum(upd["antirrubeola_post_parto"], _SI_NO_NC, "antirrubeola_post_parto")
-
-        if "gamma_globulina_antiD" in upd and upd["gamma_globulina_antiD"] is not None:
-            upd["gamma_globulina_antiD"] = _norm_enum(upd["gamma_globulina_antiD"], _SI_NO_NC, "gamma_globulina_antiD")
-
-        if "dias_completos_desde_parto" in upd and upd["dias_completos_desde_parto"] is not None:
-            upd["dias_completos_desde_parto"] = _as_nonneg_int(upd["dias_completos_desde_parto"], "dias_completos_desde_parto")
-
-        # egreso_materno
-        if "egreso_materno" in upd and isinstance(upd["egreso_materno"], dict):
-            em = dict(upd["egreso_materno"])
-
-            if "estado" in em and em["estado"] is not None:
-                em["estado"] = _norm_enum(str(em["estado"]), _ESTADO, "egreso_materno.estado")
-
-            if "fecha" in em and em["fecha"]:
-                em["fecha"] = _parse_dt_flexible(em["fecha"], "egreso_materno.fecha")
-
-            # traslado & coherencias
-            if "traslado" in em and em["traslado"] is not None:
-                em["traslado"] = bool(em["traslado"])
-
-            traslado_flag = em.get("traslado", None)
-            if traslado_flag is True and not em.get("lugar_traslado"):
-                return _fail("Si 'traslado' es true, 'lugar_traslado' es obligatorio", 422)
-
-            if "fallece_durante_o_en_traslado" in em and em["fallece_durante_o_en_traslado"] is not None:
-                em["fallece_durante_o_en_traslado"] = bool(em["fallece_durante_o_en_traslado"])
-
-            if "edad_en_dias_fallecimiento" in em and em["edad_en_dias_fallecimiento"] is not None:
-                em["edad_en_dias_fallecimiento"] = _as_nonneg_int(em["edad_en_dias_fallecimiento"], "egreso_materno.edad_en_dias_fallecimiento")
-
-            # Reglas de coherencia
-            estado = em.get("estado")
-            if estado == "fallece" and em.get("edad_en_dias_fallecimiento") is None:
-                return _fail("Si estado='fallece', 'edad_en_dias_fallecimiento' es obligatorio", 422)
-            if traslado_flag is True and em.get("fallece_durante_o_en_traslado") is True and em.get("edad_en_dias_fallecimiento") is None:
-                return _fail("Si fallece durante/en traslado, 'edad_en_dias_fallecimiento' es obligatorio", 422)
-
-            upd["egreso_materno"] = em
+        # mismo esquema que al crear, solo con los campos enviados
+        upd.update(_validar(payload, parcial=True))
+        if "egreso_materno" in upd:
+            _coherencia_egreso(upd["egreso_materno"])
 
         upd["updated_at"] = datetime.utcnow()
 
-        res = mongo.db.egreso_materno.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.egreso_materno.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "egreso_materno", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Egreso materno actualizado"}, 200)
 
     except ValueError as ve:
@@ -318,9 +215,12 @@ def actualizar_egreso_materno_por_id(egreso_id: str, payload: dict, session=None
 def eliminar_egreso_materno_por_id(egreso_id: str, session=None):
     try:
         oid = _to_oid(egreso_id, "egreso_id")
-        res = mongo.db.egreso_materno.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.egreso_materno.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Egreso materno eliminado"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -331,6 +231,8 @@ def eliminar_egreso_materno_por_historial_id(historial_id: str, session=None):
     try:
         oid = _to_oid(historial_id, "historial_id")
         res = mongo.db.egreso_materno.delete_many({"historial_id": oid}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(historial_id=oid, session=session)
         if res.deleted_count == 0:
             return _fail("No se encontraron documentos para este historial", 404)
         return _ok({"mensaje": f"Se eliminaron {res.deleted_count} egresos maternos"}, 200)
@@ -0,0 +1,283 @@
+import csv
+import gzip
+import io
+import json
+import os
+from datetime import datetime
+from bson import ObjectId
+from app import mongo
+from app.services.service_historial import _serialize_historial
+from app.services.service_historial_agregado import _SECCIONES
+from app.utils.json_bson import dumps_bytes
+
+# Exportación masiva SIP/HCP (reporte perinatal mensual) como job del servidor.
+# - Recorre historiales por _id (reanudable desde el último _id escrito).
+# - Por cada lote de historiales: 1 consulta $in por colección de sección (la más
+#   reciente por historial, índice historial_id + created_at desc), nunca una por
+#   historial. Solo se trae el resto de secciones de los historiales que pasan el
+#   filtro de cierre (egreso materno registrado, y del mes pedido si hay --mes).
+# - Escribe partes comprimidas (parte-00001.ndjson.gz / .csv.gz) de al menos
+#   `por_parte` historiales: primero a .tmp y se renombran al cerrarlas. El progreso
+#   (ultimo_id) se guarda en export_jobs al cerrar cada parte; reanudar reescribe
+#   la parte que quedó a medias.
+# Memoria: un lote de historiales con sus secciones a la vez (las filas CSV de la
+# parte esperan en un archivo temporal, no en memoria).
+#
+# Cada registro tiene la forma de GET /historiales/<id>: {"historial": {...}, <seccion>: {...}}.
+# En CSV las secciones se aplanan a columnas seccion.campo (listas como JSON);
+# cada parte lleva su propio encabezado con las columnas que aparecen en ella.
+
+FORMATOS = ("ndjson", "csv")
+_JOBS = "export_jobs"
+
+
+def _jobs():
+    return mongo.db[_JOBS]
+
+def _oid(v):
+    try:
+        return ObjectId(v)
+    except Exception:
+        return None
+
+def _rango_mes(mes: str):
+    """'2026-09' -> (2026-09-01, 2026-10-01)."""
+    try:
+        inicio = datetime.strptime(mes, "%Y-%m")
+    except Exception:
+        raise ValueError("mes debe tener formato YYYY-MM")
+    fin = inicio.replace(year=inicio.year + 1, month=1) if inicio.month == 12 else inicio.replace(month=inicio.month + 1)
+    return inicio, fin
+
+
+# ---------------- Job ----------------
+def crear_job(directorio: str, formato: str = "ndjson", mes: str | None = None, todos: bool = False,
+              lote: int = 500, por_parte: int = 10000) -> dict:
+    """Registra el job (aún sin escribir nada). Retorna el documento del job."""
+    if formato not in FORMATOS:
+        raise ValueError(f"formato debe ser uno de: {', '.join(FORMATOS)}")
+    if mes:
+        _rango_mes(mes)
+    ahora = datetime.utcnow()
+    job = {
+        "_id": ObjectId(),
+        "estado": "pendiente",
+        "formato": formato,
+        "mes": mes,
+        "todos": bool(todos),
+        "directorio": os.path.abspath(directorio),
+        "lote": max(int(lote), 1),
+        "por_parte": max(int(por_parte), 1),
+        "ultimo_id": None,
+        "leidos": 0,
+        "exportados": 0,
+        "partes": [],
+        "error": None,
+        "created_at": ahora,
+        "updated_at": ahora,
+    }
+    job["directorio"] = os.path.join(job["directorio"], f"hcp-{mes or 'todo'}-{job['_id']}")
+    _jobs().insert_one(job)
+    return job
+
+def obtener_job(job_id) -> dict | None:
+    oid = _oid(job_id)
+    return _jobs().find_one({"_id": oid}) if oid else None
+
+def _guardar_progreso(job_id, **campos):
+    _jobs().update_one({"_id": job_id}, {"$set": {**campos, "updated_at": datetime.utcnow()}})
+
+
+# ---------------- Lectura por lotes ----------------
+def _filtro_historiales(job: dict, ultimo_id=None) -> dict:
+    filtro = {"activo": {"$ne": False}}
+    if ultimo_id is not None:
+        filtro["_id"] = {"$gt": ultimo_id}
+    if job.get("mes") and not job.get("todos"):
+        # un historial se crea antes de su egreso: nada creado después del mes entra
+        _ini, fin = _rango_mes(job["mes"])
+        filtro.setdefault("_id", {})["$lt"] = ObjectId.from_datetime(fin)
+    return filtro
+
+def _mas_recientes(coleccion: str, historial_ids: list) -> dict:
+    """{historial_id: documento más reciente} con una sola consulta $in."""
+    if not historial_ids:
+        return {}
+    out = {}
+    cursor = mongo.db[coleccion].find({"historial_id": {"$in": historial_ids}}).sort(
+        [("historial_id", 1), ("created_at", -1)]
+    )
+    for doc in cursor:
+        out.setdefault(doc["historial_id"], doc)
+    return out
+
+def _cerrado(egreso: dict | None, rango) -> bool:
+    if not egreso:
+        return False
+    if rango is None:
+        return True
+    fecha = (egreso.get("egreso_materno") or {}).get("fecha")
+    return isinstance(fecha, datetime) and rango[0] <= fecha < rango[1]
+
+def _registros(job: dict, historiales: list):
+    """Registros (serializados) del lote que cumplen el filtro del job."""
+    ids = [h["_id"] for h in historiales]
+    por_seccion = {}
+    if not job.get("todos"):
+        rango = _rango_mes(job["mes"]) if job.get("mes") else None
+        egresos = _mas_recientes("egreso_materno", ids)
+        historiales = [h for h in historiales if _cerrado(egresos.get(h["_id"]), rango)]
+        ids = [h["_id"] for h in historiales]
+        por_seccion["egreso_materno"] = egresos
+
+    for nombre, coleccion, _ref, _svc in _SECCIONES:
+        if nombre not in por_seccion:
+            por_seccion[nombre] = _mas_recientes(coleccion, ids)
+
+    for h in historiales:
+        registro = {"historial": _serialize_historial(h)}
+        for nombre, _col, _ref, servicio in _SECCIONES:
+            doc = por_seccion[nombre].get(h["_id"])
+            registro[nombre] = servicio._serialize(doc) if doc else None
+        yield registro
+
+
+# ---------------- Escritura ----------------
+def _aplanar(registro: dict) -> dict:
+    fila = {}
+    for seccion, datos in registro.items():
+        for campo, valor in (datos or {}).items():
+            if isinstance(valor, (dict, list)):
+                valor = dumps_bytes(valor).decode("utf-8")
+            elif isinstance(valor, datetime):
+                valor = valor.isoformat()
+            elif isinstance(valor, ObjectId):
+                valor = str(valor)
+            fila[f"{seccion}.{campo}"] = valor
+    return fila
+
+class _Parte:
+    """Una parte comprimida; se escribe en .tmp y se publica con cerrar()."""
+
+    def __init__(self, directorio, numero, formato):
+        self.nombre = f"parte-{numero:05d}.{formato}.gz"
+        self.ruta = os.path.join(directorio, self.nombre)
+        self.formato = formato
+        self.n = 0
+        self._gz = gzip.open(self.ruta + ".tmp", "wb")
+        if formato == "csv":
+            # el encabezado depende de las columnas de toda la parte: las filas esperan
+            # en disco (una por línea) y no en memoria hasta cerrar
+            self._columnas = set()
+            self._filas = open(self.ruta + ".filas", "w+", encoding="utf-8")
+
+    def escribir(self, registro):
+        if self.formato == "ndjson":
+            self._gz.write(dumps_bytes(registro) + b"\n")
+        else:
+            fila = _aplanar(registro)
+            self._columnas.update(fila)
+            self._filas.write(json.dumps(fila, ensure_ascii=False) + "\n")
+        self.n += 1
+
+    def cerrar(self):
+        if self.formato == "csv":
+            texto = io.TextIOWrapper(self._gz, encoding="utf-8", newline="")
+            w = csv.DictWriter(texto, fieldnames=sorted(self._columnas))
+            w.writeheader()
+            self._filas.seek(0)
+            for linea in self._filas:
+                w.writerow(json.loads(linea))
+            texto.flush()
+            texto.detach()
+            self._filas.close()
+            os.remove(self.ruta + ".filas")
+        self._gz.close()
+        os.replace(self.ruta + ".tmp", self.ruta)
+        return {"nombre": self.nombre, "registros": self.n}
+
+    def descartar(self):
+        for archivo, ruta in ((self._gz, ".tmp"), (getattr(self, "_filas", None), ".filas")):
+            try:
+                if archivo is not None:
+                    archivo.close()
+                    os.remove(self.ruta + ruta)
+            except Exception:
+                pass
+
+
+def ejecutar(job_id, on_progress=None) -> dict:
+    """
+    Corre (o reanuda) el job hasta el final. Retorna el job actualizado.
+    on_progress(job) se llama al cerrar cada parte.
+    """
+    job = obtener_job(job_id)
+    if not job:
+        raise LookupError("Job de exportación no encontrado")
+    if job["estado"] == "completo":
+        return job
+
+    os.makedirs(job["directorio"], exist_ok=True)
+    _guardar_progreso(job["_id"], estado="en_curso", error=None)
+
+    ultimo_id, leidos, exportados = job.get("ultimo_id"), job.get("leidos", 0), job.get("exportados", 0)
+    partes = list(job.get("partes") or [])
+    parte = None
+    parte_ultimo_id, parte_leidos = ultimo_id, leidos
+    try:
+        cursor = mongo.db.historiales.find(_filtro_historiales(job, ultimo_id)).sort("_id", 1).batch_size(job["lote"])
+        with cursor:
+            lote = []
+            for h in cursor:
+                lote.append(h)
+                if len(lote) < job["lote"]:
+                    continue
+                parte, parte_ultimo_id, parte_leidos, exportados = _procesar_lote(
+                    job, lote, parte, partes, parte_ultimo_id, parte_leidos, exportados, on_progress)
+                lote = []
+            if lote:
+                parte, parte_ultimo_id, parte_leidos, exportados = _procesar_lote(
+                    job, lote, parte, partes, parte_ultimo_id, parte_leidos, exportados, on_progress)
+        if parte is not None and parte.n:
+            partes.append(parte.cerrar())
+        elif parte is not None:
+            parte.descartar()
+        parte = None
+        _escribir_manifiesto(job, partes, exportados)
+        _guardar_progreso(job["_id"], estado="completo", ultimo_id=parte_ultimo_id, leidos=parte_leidos,
+                          exportados=exportados, partes=partes, terminado_at=datetime.utcnow())
+    except Exception as e:
+        if parte is not None:
+            parte.descartar()
+        _guardar_progreso(job["_id"], estado="error", error=str(e))
+        raise
+    return obtener_job(job["_id"])
+
+def _procesar_lote(job, lote, parte, partes, ultimo_id, leidos, exportados, on_progress):
+    """Escribe un lote; al llenar una parte la publica y guarda el progreso (ultimo_id)."""
+    for registro in _registros(job, lote):
+        if parte is None:
+            parte = _Parte(job["directorio"], len(partes) + 1, job["formato"])
+        parte.escribir(registro)
+        exportados += 1
+    ultimo_id, leidos = lote[-1]["_id"], leidos + len(lote)
+    if parte is not None and parte.n >= job["por_parte"]:
+        partes.append(parte.cerrar())
+        parte = None
+        _guardar_progreso(job["_id"], ultimo_id=ultimo_id, leidos=leidos, exportados=exportados, partes=partes)
+        if on_progress:
+            on_progress({**job, "ultimo_id": ultimo_id, "leidos": leidos, "exportados": exportados, "partes": partes})
+    return parte, ultimo_id, leidos, exportados
+
+def _escribir_manifiesto(job, partes, exportados):
+    manifiesto = {
+        "job_id": str(job["_id"]),
+        "formato": job["formato"],
+        "mes": job.get("mes"),
+        "todos": job.get("todos"),
+        "registros": exportados,
+        "partes": partes,
+        "generado_at": datetime.utcnow().isoformat(),
+    }
+    with open(os.path.join(job["directorio"], "manifiesto.json"), "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2)
@@ -1,7 +1,13 @@
 # === app/services/gestacion_actual.py  (FINAL) ===
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import (
+    compilar, campo, booleano, entero, decimal, fecha_ymd, opcion, texto, crudo, object_id, lista,
+)
 
 def _ok(data, code=200):   return {"ok": True, "data": data, "error": None}, code
 def _fail(msg, code=400):  return {"ok": False, "data": None, "error": msg}, code
@@ -29,154 +35,154 @@ _TALLA_MIN, _TALLA_MAX = 0.5, 2.5
 _HEMO_MIN, _HEMO_MAX   = 0.0, 30.0
 _GLU_MIN               = 0.0
 
-_REQUIRED_FIELDS = [
+def _to_oid(v, field):
+    try: return ObjectId(v)
+    except Exception: raise ValueError(f"{field} no es un ObjectId válido")
+
+# ================== Esquema (compilado una vez al importar) ==================
+# Compartido por crear (validar(payload)) y actualizar (validar(payload, parcial=True)).
+_SI_NO_BOOL  = ("si", "no")         # compat: booleanos legacy -> si/no
+_NSI_BOOL    = ("anormal", "normal")
+_SIG_BOOL    = ("+", "-")
+
+def _req(nombre, tipo, **kw):   return campo(nombre, tipo, requerido=True, **kw)
+def _opt(nombre, tipo, **kw):   return campo(nombre, tipo, **kw)
+
+_ESQUEMA_APN = [
+    _opt("apn_id", object_id(), si="valor"),
+    _req("fecha", fecha_ymd()),
+    _req("eg_semanas", entero(0, 45)),
+    _req("peso_kg", decimal(_PESO_MIN, _PESO_MAX)),
+    _req("pa_sis", entero(60, 250)),
+    _req("pa_dia", entero(30, 150)),
+    _opt("altura_uterina_cm", decimal(0, 60)),
+    _opt("presentacion", opcion(_PRESENTACION)),
+    _opt("fcf_lpm", entero(0, 250)),
+    _opt("mov_fetales", opcion(_SINO_NC, desde_bool=_SI_NO_BOOL)),
+    _opt("proteinuria", opcion(_PROTEINURIA)),
+    _opt("nota", texto(strip=False)),
+    _opt("iniciales", texto(strip=False)),
+    _opt("proxima_cita", fecha_ymd(), si="valor"),
+]
+
+_TRIMESTRES = [
+    "fuma_act_t1","fuma_act_t2","fuma_act_t3",
+    "fuma_pas_t1","fuma_pas_t2","fuma_pas_t3",
+    "drogas_t1","drogas_t2","drogas_t3",
+    "alcohol_t1","alcohol_t2","alcohol_t3",
+    "violencia_t1","violencia_t2","violencia_t3",
+]
+
+_ESQUEMA = [
+    _opt("paciente_id", object_id(), si="valor"),
+    _opt("identificacion_id", object_id(), si="valor"),
     # básicos
-    "peso_anterior","talla","fum","fpp","eg_confiable",
-    # estilos de vida global
-    "fumadora_activa","fumadora_pasiva","drogas","alcohol","violencia",
+    _req("peso_anterior", decimal(_PESO_MIN, _PESO_MAX)),
+    _req("talla", decimal(_TALLA_MIN, _TALLA_MAX)),
+    _req("fum", fecha_ymd()),
+    _req("fpp", fecha_ymd()),
+    _req("eg_confiable", booleano()),
+    _opt("eg_confiable_por", opcion(_EG_POR), si="valor", ausente=None),
+    # estilos de vida (global)
+    _req("fumadora_activa", booleano()),
+    _req("fumadora_pasiva", booleano()),
+    _req("drogas", booleano()),
+    _req("alcohol", booleano()),
+    _req("violencia", booleano()),
+    # por trimestre (si se envían)
+    *[_opt(k, opcion(_SINO_NC, desde_bool=_SI_NO_BOOL)) for k in _TRIMESTRES],
     # vacunas / exámenes
-    "vacuna_rubeola","vacuna_antitetanica","examen_mamas","examen_odonto","cervix_normal",
-    # grupo/rh
-    "grupo_sanguineo","rh","inmunizada",
-    # laboratorios principales
-    "hemoglobina","anemia",
-    # glucemias y cortes por edad gestacional
-    "glucemia1","glucemia_ayunas_ge_92_lt24",
-    "glucemia2","glucemia_ayunas_ge_92_ge24",
-    # bacteriuria/estreptococo (solicitudes)
-    "bacteriuria","estreptococo",
-    # resultados obligatorios
-    "chagas_res","malaria_res",
-    # VIH por corte gestacional
-    "vih_solicitada_lt20","vih_resultado_lt20","tarv_emb_lt20",
-    "vih_solicitada_ge20","vih_resultado_ge20","tarv_emb_ge20",
-    # Sífilis por corte gestacional
-    "sifilis_no_trep_lt20","sifilis_trep_lt20","sifilis_tratamiento_lt20","pareja_tratada_lt20",
-    "sifilis_no_trep_ge20","sifilis_trep_ge20","sifilis_tratamiento_ge20","pareja_tratada_ge20",
-    # consejería
-    "preparacion_parto","consejeria_lactancia_materna",
+    _req("vacuna_rubeola", opcion(_VAC_RUBEOLA)),
+    _req("vacuna_antitetanica", booleano()),
+    _opt("antitetanica_dosis", entero(0, 6), ausente=None),
+    _opt("antitetanica_mes_gestacion", entero(0, 45), ausente=None),
+    _req("examen_mamas", booleano()),
+    _req("examen_odonto", booleano()),
+    _req("cervix_normal", booleano()),
+    _opt("cervix_inspeccion", opcion(_TRI_NSI, desde_bool=_NSI_BOOL), si="presente", ausente=None),
+    _opt("pap", opcion(_TRI_NSI, desde_bool=_NSI_BOOL), si="presente", ausente=None),
+    _opt("colposcopia", opcion(_TRI_NSI, desde_bool=_NSI_BOOL), si="presente", ausente=None),
+    _req("grupo_sanguineo", opcion(_GRUPO_SANG)),
+    _req("rh", opcion(_RH)),
+    _req("inmunizada", booleano()),
+    _opt("gammaglobulina", booleano()),
+    _opt("gammaglobulina_estado", opcion(_SINO_NC, desde_bool=_SI_NO_BOOL), ausente=None),
+    # toxoplasmosis (nuevo); compat: aceptar legacy igg/igm si llegan
+    _opt("toxoplasmosis_igg", booleano()),
+    _opt("toxoplasmosis_igm", booleano()),
+    _opt("toxoplasmosis_igg_lt20", opcion(_TRI_SIG, desde_bool=_SIG_BOOL), si="presente", ausente=None),
+    _opt("toxoplasmosis_igg_ge20", opcion(_TRI_SIG, desde_bool=_SIG_BOOL), si="presente", ausente=None),
+    _opt("toxoplasmosis_igm_primera", opcion(_TRI_SIG, desde_bool=_SIG_BOOL), si="presente", ausente=None),
+    _opt("hb_lt20", decimal(_HEMO_MIN, _HEMO_MAX), ausente=None),
+    _opt("hb_ge20", decimal(_HEMO_MIN, _HEMO_MAX), ausente=None),
+    _opt("hierro_acido_folico", booleano()),
+    _req("hierro_indicado", booleano()),
+    _req("acido_folico_indicado", booleano()),
+    _req("hemoglobina", decimal(_HEMO_MIN, _HEMO_MAX)),
+    _req("anemia", booleano()),
+    # VIH compat legacy
+    _opt("vih_solicitado", booleano()),
+    _opt("vih_resultado", opcion(_VIH_RES)),
+    _opt("tratamiento_vih", booleano()),
+    _opt("tarv", opcion(_TARV_ENUM, desde_bool=_SI_NO_BOOL)),
+    # VIH nueva estructura (la clave es obligatoria; null permitido)
+    _req("vih_solicitada_lt20", opcion(_SINO_NC, desde_bool=_SI_NO_BOOL), si="no_nulo", ausente=None),
+    _req("vih_resultado_lt20", opcion(_VIH_RES), si="no_nulo", ausente=None),
+    _req("tarv_emb_lt20", opcion(_SINO_NC, desde_bool=_SI_NO_BOOL), si="no_nulo", ausente=None),
+    _req("vih_solicitada_ge20", opcion(_SINO_NC, desde_bool=_SI_NO_BOOL), si="no_nulo", ausente=None),
+    _req("vih_resultado_ge20", opcion(_VIH_RES), si="no_nulo", ausente=None),
+    _req("tarv_emb_ge20", opcion(_SINO_NC, desde_bool=_SI_NO_BOOL), si="no_nulo", ausente=None),
+    # sífilis
+    _opt("sifilis", opcion(_SIFILIS)),
+    _req("sifilis_no_trep_lt20", opcion(_SIFILIS), si="valor", ausente=None),
+    _req("sifilis_no_trep_ge20", opcion(_SIFILIS), si="valor", ausente=None),
+    _req("sifilis_trep_lt20", opcion(_SIFILIS_TREP), si="valor", ausente=None),
+    _req("sifilis_trep_ge20", opcion(_SIFILIS_TREP), si="valor", ausente=None),
+    _opt("sifilis_tratamiento", booleano()),
+    _opt("pareja_tratada", booleano()),
+    _req("sifilis_tratamiento_lt20", opcion(_SI_NO_SD_NC), si="no_nulo", ausente=None),
+    _req("pareja_tratada_lt20", opcion(_SI_NO_SD_NC), si="no_nulo", ausente=None),
+    _req("sifilis_tratamiento_ge20", opcion(_SI_NO_SD_NC), si="no_nulo", ausente=None),
+    _req("pareja_tratada_ge20", opcion(_SI_NO_SD_NC), si="no_nulo", ausente=None),
+    # chagas / malaria / bacteriuria / estreptococo
+    _opt("chagas", booleano()),
+    _opt("malaria", booleano()),
+    _req("bacteriuria", booleano()),
+    _req("chagas_res", opcion(_TRI_SIG, desde_bool=_SIG_BOOL)),
+    _req("malaria_res", opcion(_TRI_SIG, desde_bool=_SIG_BOOL)),
+    _opt("bacteriuria_res", opcion(_TRI_NSI, desde_bool=_NSI_BOOL), si="presente", ausente=None),
+    _req("estreptococo", booleano()),
+    _opt("estreptococo_res", opcion(_TRI_SIG, desde_bool=_SIG_BOOL), si="presente", ausente=None),
+    # glucemias
+    _req("glucemia1", decimal(_GLU_MIN, None)),
+    _req("glucemia2", decimal(_GLU_MIN, None)),
+    _req("glucemia_ayunas_ge_92_lt24", booleano()),
+    _req("glucemia_ayunas_ge_92_ge24", booleano()),
+    # consejería nueva + compat legacy
+    _req("preparacion_parto", booleano()),
+    _req("consejeria_lactancia_materna", booleano()),
+    _opt("plan_parto", booleano()),
+    _opt("consejeria_lactancia", booleano()),
+    _opt("nota_control", crudo(), si="presente", ausente=None),
+    _opt("iniciales_personal", crudo(), si="presente", ausente=None),
+    # lista APN si llega
+    _opt("apn", lista(_ESQUEMA_APN), si="presente"),
+    _opt("proxima_cita", fecha_ymd(), si="valor", ausente=None),
 ]
 
-def _to_oid(v, field):
-    try: return ObjectId(v)
-    except Exception: raise ValueError(f"{field} no es un ObjectId válido")
+_validar = compilar(_ESQUEMA)
+_validar_apn = compilar([c for c in _ESQUEMA if c["nombre"] == "apn"])
+_validar_control = compilar(_ESQUEMA_APN)
 
-def _as_bool(v, field):
-    if isinstance(v, bool): return v
-    if isinstance(v, (int,float)) and v in (0,1): return bool(v)
-    if isinstance(v, str) and v.lower() in ("true","false"): return v.lower()=="true"
-    raise ValueError(f"{field} debe ser booleano")
-
-def _as_int_in_range(v, field, lo=None, hi=None):
-    try: x=int(v)
-    except Exception: raise ValueError(f"{field} debe ser entero")
-    if (lo is not None and x<lo) or (hi is not None and x>hi):
-        raise ValueError(f"{field} fuera de rango permitido [{lo}, {hi}]")
-    return x
-
-def _as_float(v, field):
-    try: return float(v)
-    except Exception: raise ValueError(f"{field} debe ser numérico")
-
-def _as_float_in_range(v, field, lo=None, hi=None):
-    x=_as_float(v, field)
-    if (lo is not None and x<lo) or (hi is not None and x>hi):
-        raise ValueError(f"{field} fuera de rango permitido [{lo}, {hi}]")
-    return x
-
-def _as_date_ymd(s, field):
-    if not isinstance(s, str): raise ValueError(f"{field} debe ser string con formato YYYY-MM-DD")
-    try: return datetime.strptime(s.strip(), "%Y-%m-%d")
-    except Exception: raise ValueError(f"{field} debe tener formato YYYY-MM-DD")
-
-def _norm_enum(v, opts, field):
-    if isinstance(v, str) and v.strip() in opts: return v.strip()
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(opts))}")
-
-# compat: aceptar booleanos y mapear a enums
-def _norm_sino_nc_legacy(v, field):
-    if isinstance(v, bool): return "si" if v else "no"
-    return _norm_enum(v, _SINO_NC, field)
-
-def _norm_tarv_legacy(v, field):
-    if isinstance(v, bool): return "si" if v else "no"
-    return _norm_enum(v, _TARV_ENUM, field)
-
-def _norm_tri_nsi_legacy_from_bool(v, field):
-    if isinstance(v, bool): return "anormal" if v else "normal"
-    return _norm_enum(v, _TRI_NSI, field)
-
-def _norm_tri_sig_legacy_from_bool(v, field):
-    if isinstance(v, bool): return "+" if v else "-"
-    return _norm_enum(v, _TRI_SIG, field)
-
-def _norm_si_no_sd_nc(v, field):
-    return _norm_enum(v, _SI_NO_SD_NC, field)
-
-def _as_optional_str(v):
-    if v is None: return None
-    if isinstance(v, str): return v
-    return str(v)
-
-def _as_float_in_range_or_none(v, field, lo=None, hi=None):
-    if v is None: return None
-    return _as_float_in_range(v, field, lo, hi)
-
-def _as_int_in_range_or_none(v, field, lo=None, hi=None):
-    if v is None: return None
-    return _as_int_in_range(v, field, lo, hi)
-
-def _as_date_ymd_or_none(s, field):
-    if not s: return None
-    return _as_date_ymd(s, field)
-
-def _norm_apn_item(raw: dict, idx: int):
-    if not isinstance(raw, dict):
-        raise ValueError(f"apn[{idx}] debe ser un objeto")
-    item = {}
-    # requeridos por item
-    item["fecha"] = _as_date_ymd(raw.get("fecha"), f"apn[{idx}].fecha")
-    item["eg_semanas"] = _as_int_in_range(raw.get("eg_semanas"), f"apn[{idx}].eg_semanas", 0, 45)
-    item["peso_kg"] = _as_float_in_range(raw.get("peso_kg"), f"apn[{idx}].peso_kg", _PESO_MIN, _PESO_MAX)
-    item["pa_sis"] = _as_int_in_range(raw.get("pa_sis"), f"apn[{idx}].pa_sis", 60, 250)
-    item["pa_dia"] = _as_int_in_range(raw.get("pa_dia"), f"apn[{idx}].pa_dia", 30, 150)
-    # opcionales
-    if raw.get("altura_uterina_cm") is not None:
-        item["altura_uterina_cm"] = _as_float_in_range(raw.get("altura_uterina_cm"), f"apn[{idx}].altura_uterina_cm", 0, 60)
-    if raw.get("presentacion") is not None:
-        item["presentacion"] = _norm_enum(raw.get("presentacion"), _PRESENTACION, f"apn[{idx}].presentacion")
-    if raw.get("fcf_lpm") is not None:
-        item["fcf_lpm"] = _as_int_in_range(raw.get("fcf_lpm"), f"apn[{idx}].fcf_lpm", 0, 250)
-    if raw.get("mov_fetales") is not None:
-        item["mov_fetales"] = _norm_sino_nc_legacy(raw.get("mov_fetales"), f"apn[{idx}].mov_fetales")
-    if raw.get("proteinuria") is not None:
-        item["proteinuria"] = _norm_enum(raw.get("proteinuria"), _PROTEINURIA, f"apn[{idx}].proteinuria")
-    if raw.get("nota") is not None:
-        item["nota"] = _as_optional_str(raw.get("nota"))
-    if raw.get("iniciales") is not None:
-        item["iniciales"] = _as_optional_str(raw.get("iniciales"))
-    if raw.get("proxima_cita") is not None:
-        item["proxima_cita"] = _as_date_ymd_or_none(raw.get("proxima_cita"), f"apn[{idx}].proxima_cita")
-    return item
+def _con_ids(items):
+    """Cada control APN lleva su apn_id (para editarlo/borrarlo sin reescribir la lista)."""
+    for item in items or []:
+        item.setdefault("apn_id", ObjectId())
+    return items
 
 def _norm_apn_list(lst):
-    if lst is None:
-        return None
-    if not isinstance(lst, list):
-        raise ValueError("apn debe ser una lista")
-    if len(lst) == 0:
-        return []
-    return [_norm_apn_item(x, i) for i, x in enumerate(lst)]
-
-def _require_fields(payload: dict):
-    faltan=[f for f in _REQUIRED_FIELDS if f not in payload]
-    if faltan: raise ValueError("Campos requeridos faltantes: "+", ".join(faltan))
-
-def _ensure_indexes():
-    try: mongo.db.gestacion_actual.create_index("historial_id", name="ix_ga_historial_id")
-    except Exception: pass
-    try: mongo.db.gestacion_actual.create_index("paciente_id", name="ix_ga_paciente_id")
-    except Exception: pass
+    """Lista APN normalizada; los errores de todos los items (apn[i].campo) en un solo ValueError."""
+    return _con_ids(_validar_apn({"apn": lst}, parcial=True).get("apn"))
 
 def _serialize(doc: dict):
     # serializar APN (si existe)
@@ -185,7 +191,8 @@ def _serialize(doc: dict):
         for item in (doc.get("apn") or []):
             apn_ser.append({
                 **({"fecha": item.get("fecha").strftime("%Y-%m-%d")} if isinstance(item.get("fecha"), datetime) else ({"fecha": item.get("fecha")} if item.get("fecha") else {})),
-                **{k: v for k, v in item.items() if k not in ("fecha", "proxima_cita")},
+                **{k: v for k, v in item.items() if k not in ("fecha", "proxima_cita", "apn_id")},
+                **({"apn_id": str(item["apn_id"])} if item.get("apn_id") else {}),
                 **({"proxima_cita": item.get("proxima_cita").strftime("%Y-%m-%d")} if isinstance(item.get("proxima_cita"), datetime) else ({"proxima_cita": item.get("proxima_cita")} if item.get("proxima_cita") else {})),
             })
     except Exception:
@@ -292,129 +299,34 @@ def _serialize(doc: dict):
         "updated_at": doc.get("updated_at"),
     }
 
+def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
+    h_oid = _to_oid(historial_id, "historial_id")
+    datos = _validar(payload)
+    _con_ids(datos.get("apn"))
+    return {
+        "historial_id": h_oid,
+        **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
+           if usuario_actual and usuario_actual.get("usuario_id") else {}),
+        **datos,
+        "imc": round(datos["peso_anterior"] / (datos["talla"] * datos["talla"]), 2),
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+
+
 def crear_gestacion_actual(historial_id: str, payload: dict, session=None, usuario_actual: dict|None=None):
     try:
         if not isinstance(payload, dict): return _fail("JSON inválido", 400)
         if not historial_id: return _fail("historial_id es requerido", 422)
-        _require_fields(payload); _ensure_indexes()
 
         h_oid=_to_oid(historial_id,"historial_id")
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
-        peso = _as_float_in_range(payload["peso_anterior"], "peso_anterior", _PESO_MIN, _PESO_MAX)
-        talla= _as_float_in_range(payload["talla"], "talla", _TALLA_MIN, _TALLA_MAX)
-        imc  = round(peso/(talla*talla), 2)
-
-        doc = {
-            "historial_id": h_oid,
-            **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")} if payload.get("paciente_id") else {}),
-            **({"identificacion_id": _to_oid(payload["identificacion_id"], "identificacion_id")} if payload.get("identificacion_id") else {}),
-            **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
-               if usuario_actual and usuario_actual.get("usuario_id") else {}),
-            # básicos
-            "peso_anterior": peso,
-            "talla": talla,
-            "imc": imc,
-            "fum": _as_date_ymd(payload["fum"], "fum"),
-            "fpp": _as_date_ymd(payload["fpp"], "fpp"),
-            "eg_confiable": _as_bool(payload["eg_confiable"], "eg_confiable"),
-            "eg_confiable_por": _norm_enum(payload.get("eg_confiable_por"), _EG_POR, "eg_confiable_por") if payload.get("eg_confiable_por") else None,
-            # estilos de vida (global)
-            "fumadora_activa": _as_bool(payload["fumadora_activa"], "fumadora_activa"),
-            "fumadora_pasiva": _as_bool(payload["fumadora_pasiva"], "fumadora_pasiva"),
-            "drogas": _as_bool(payload["drogas"], "drogas"),
-            "alcohol": _as_bool(payload["alcohol"], "alcohol"),
-            "violencia": _as_bool(payload["violencia"], "violencia"),
-            # por trimestre (si se envían)
-            **{k: _norm_sino_nc_legacy(payload[k], k) for k in [
-                "fuma_act_t1","fuma_act_t2","fuma_act_t3",
-                "fuma_pas_t1","fuma_pas_t2","fuma_pas_t3",
-                "drogas_t1","drogas_t2","drogas_t3",
-                "alcohol_t1","alcohol_t2","alcohol_t3",
-                "violencia_t1","violencia_t2","violencia_t3",
-            ] if k in payload and payload[k] is not None},
-            # vacunas / exámenes
-            "vacuna_rubeola": _norm_enum(payload["vacuna_rubeola"], _VAC_RUBEOLA, "vacuna_rubeola"),
-            "vacuna_antitetanica": _as_bool(payload["vacuna_antitetanica"], "vacuna_antitetanica"),
-            "antitetanica_dosis": _as_int_in_range(payload.get("antitetanica_dosis"), "antitetanica_dosis", 0, 6) if payload.get("antitetanica_dosis") is not None else None,
-            "antitetanica_mes_gestacion": _as_int_in_range(payload.get("antitetanica_mes_gestacion"), "antitetanica_mes_gestacion", 0, 45) if payload.get("antitetanica_mes_gestacion") is not None else None,
-            "examen_mamas": _as_bool(payload["examen_mamas"], "examen_mamas"),
-            "examen_odonto": _as_bool(payload["examen_odonto"], "examen_odonto"),
-            "cervix_normal": _as_bool(payload["cervix_normal"], "cervix_normal"),
-            "cervix_inspeccion": _norm_tri_nsi_legacy_from_bool(payload.get("cervix_inspeccion"), "cervix_inspeccion") if "cervix_inspeccion" in payload else None,
-            "pap": _norm_tri_nsi_legacy_from_bool(payload.get("pap"), "pap") if "pap" in payload else None,
-            "colposcopia": _norm_tri_nsi_legacy_from_bool(payload.get("colposcopia"), "colposcopia") if "colposcopia" in payload else None,
-            "grupo_sanguineo": _norm_enum(payload["grupo_sanguineo"], _GRUPO_SANG, "grupo_sanguineo"),
-            "rh": _norm_enum(payload["rh"], _RH, "rh"),
-            "inmunizada": _as_bool(payload["inmunizada"], "inmunizada"),
-            **({"gammaglobulina": _as_bool(payload["gammaglobulina"], "gammaglobulina")} if payload.get("gammaglobulina") is not None else {}),
-            "gammaglobulina_estado": _norm_sino_nc_legacy(payload.get("gammaglobulina_estado"), "gammaglobulina_estado") if payload.get("gammaglobulina_estado") is not None else None,
-            # toxoplasmosis (nuevo); compat: aceptar legacy igg/igm si llegan
-            **({"toxoplasmosis_igg": _as_bool(payload["toxoplasmosis_igg"], "toxoplasmosis_igg")} if payload.get("toxoplasmosis_igg") is not None else {}),
-            **({"toxoplasmosis_igm": _as_bool(payload["toxoplasmosis_igm"], "toxoplasmosis_igm")} if payload.get("toxoplasmosis_igm") is not None else {}),
-            "toxoplasmosis_igg_lt20": _norm_tri_sig_legacy_from_bool(payload.get("toxoplasmosis_igg_lt20"), "toxoplasmosis_igg_lt20") if "toxoplasmosis_igg_lt20" in payload else None,
-            "toxoplasmosis_igg_ge20": _norm_tri_sig_legacy_from_bool(payload.get("toxoplasmosis_igg_ge20"), "toxoplasmosis_igg_ge20") if "toxoplasmosis_igg_ge20" in payload else None,
-            "toxoplasmosis_igm_primera": _norm_tri_sig_legacy_from_bool(payload.get("toxoplasmosis_igm_primera"), "toxoplasmosis_igm_primera") if "toxoplasmosis_igm_primera" in payload else None,
-            "hb_lt20": _as_float_in_range(payload["hb_lt20"], "hb_lt20", _HEMO_MIN, _HEMO_MAX) if payload.get("hb_lt20") is not None else None,
-            "hb_ge20": _as_float_in_range(payload["hb_ge20"], "hb_ge20", _HEMO_MIN, _HEMO_MAX) if payload.get("hb_ge20") is not None else None,
-            **({"hierro_acido_folico": _as_bool(payload["hierro_acido_folico"], "hierro_acido_folico")} if payload.get("hierro_acido_folico") is not None else {}),
-            "hierro_indicado": _as_bool(payload["hierro_indicado"], "hierro_indicado"),
-            "acido_folico_indicado": _as_bool(payload["acido_folico_indicado"], "acido_folico_indicado"),
-            "hemoglobina": _as_float_in_range(payload["hemoglobina"], "hemoglobina", _HEMO_MIN, _HEMO_MAX),
-            "anemia": _as_bool(payload["anemia"], "anemia"),
-            # VIH compat legacy
-            **({"vih_solicitado": _as_bool(payload["vih_solicitado"], "vih_solicitado")} if payload.get("vih_solicitado") is not None else {}),
-            **({"vih_resultado": _norm_enum(payload["vih_resultado"], _VIH_RES, "vih_resultado")} if payload.get("vih_resultado") is not None else {}),
-            **({"tratamiento_vih": _as_bool(payload["tratamiento_vih"], "tratamiento_vih")} if payload.get("tratamiento_vih") is not None else {}),
-            **({"tarv": _norm_tarv_legacy(payload.get("tarv"), "tarv")} if payload.get("tarv") is not None else {}),
-            # VIH nueva estructura
-            "vih_solicitada_lt20": _norm_sino_nc_legacy(payload.get("vih_solicitada_lt20"), "vih_solicitada_lt20") if payload.get("vih_solicitada_lt20") is not None else None,
-            "vih_resultado_lt20": _norm_enum(payload.get("vih_resultado_lt20"), _VIH_RES, "vih_resultado_lt20") if payload.get("vih_resultado_lt20") is not None else None,
-            "tarv_emb_lt20": _norm_sino_nc_legacy(payload.get("tarv_emb_lt20"), "tarv_emb_lt20") if payload.get("tarv_emb_lt20") is not None else None,
-            "vih_solicitada_ge20": _norm_sino_nc_legacy(payload.get("vih_solicitada_ge20"), "vih_solicitada_ge20") if payload.get("vih_solicitada_ge20") is not None else None,
-            "vih_resultado_ge20": _norm_enum(payload.get("vih_resultado_ge20"), _VIH_RES, "vih_resultado_ge20") if payload.get("vih_resultado_ge20") is not None else None,
-            "tarv_emb_ge20": _norm_sino_nc_legacy(payload.get("tarv_emb_ge20"), "tarv_emb_ge20") if payload.get("tarv_emb_ge20") is not None else None,
-            **({"sifilis": _norm_enum(payload["sifilis"], _SIFILIS, "sifilis")} if payload.get("sifilis") is not None else {}),
-            "sifilis_no_trep_lt20": _norm_enum(payload.get("sifilis_no_trep_lt20"), _SIFILIS, "sifilis_no_trep_lt20") if payload.get("sifilis_no_trep_lt20") else None,
-            "sifilis_no_trep_ge20": _norm_enum(payload.get("sifilis_no_trep_ge20"), _SIFILIS, "sifilis_no_trep_ge20") if payload.get("sifilis_no_trep_ge20") else None,
-            "sifilis_trep_lt20": _norm_enum(payload.get("sifilis_trep_lt20"), _SIFILIS_TREP, "sifilis_trep_lt20") if payload.get("sifilis_trep_lt20") else None,
-            "sifilis_trep_ge20": _norm_enum(payload.get("sifilis_trep_ge20"), _SIFILIS_TREP, "sifilis_trep_ge20") if payload.get("sifilis_trep_ge20") else None,
-            # sífilis (nueva estructura) + compat
-            **({"sifilis_tratamiento": _as_bool(payload["sifilis_tratamiento"], "sifilis_tratamiento")} if payload.get("sifilis_tratamiento") is not None else {}),
-            **({"pareja_tratada": _as_bool(payload["pareja_tratada"], "pareja_tratada")} if payload.get("pareja_tratada") is not None else {}),
-            "sifilis_tratamiento_lt20": _norm_si_no_sd_nc(payload.get("sifilis_tratamiento_lt20"), "sifilis_tratamiento_lt20") if payload.get("sifilis_tratamiento_lt20") is not None else None,
-            "pareja_tratada_lt20": _norm_si_no_sd_nc(payload.get("pareja_tratada_lt20"), "pareja_tratada_lt20") if payload.get("pareja_tratada_lt20") is not None else None,
-            "sifilis_tratamiento_ge20": _norm_si_no_sd_nc(payload.get("sifilis_tratamiento_ge20"), "sifilis_tratamiento_ge20") if payload.get("sifilis_tratamiento_ge20") is not None else None,
-            "pareja_tratada_ge20": _norm_si_no_sd_nc(payload.get("pareja_tratada_ge20"), "pareja_tratada_ge20") if payload.get("pareja_tratada_ge20") is not None else None,
-            **({"chagas": _as_bool(payload["chagas"], "chagas")} if payload.get("chagas") is not None else {}),
-            **({"malaria": _as_bool(payload["malaria"], "malaria")} if payload.get("malaria") is not None else {}),
-            "bacteriuria": _as_bool(payload["bacteriuria"], "bacteriuria"),
-            "chagas_res": _norm_tri_sig_legacy_from_bool(payload.get("chagas_res"), "chagas_res") if "chagas_res" in payload else None,
-            "malaria_res": _norm_tri_sig_legacy_from_bool(payload.get("malaria_res"), "malaria_res") if "malaria_res" in payload else None,
-            "bacteriuria_res": _norm_tri_nsi_legacy_from_bool(payload.get("bacteriuria_res"), "bacteriuria_res") if "bacteriuria_res" in payload else None,
-            "estreptococo": _as_bool(payload["estreptococo"], "estreptococo"),
-            "estreptococo_res": _norm_tri_sig_legacy_from_bool(payload.get("estreptococo_res"), "estreptococo_res") if "estreptococo_res" in payload else None,
-            "glucemia1": _as_float_in_range(payload["glucemia1"], "glucemia1", _GLU_MIN, None),
-            "glucemia2": _as_float_in_range(payload["glucemia2"], "glucemia2", _GLU_MIN, None),
-            "glucemia_ayunas_ge_92_lt24": _as_bool(payload["glucemia_ayunas_ge_92_lt24"], "glucemia_ayunas_ge_92_lt24"),
-            "glucemia_ayunas_ge_92_ge24": _as_bool(payload["glucemia_ayunas_ge_92_ge24"], "glucemia_ayunas_ge_92_ge24"),
-            # consejería nueva + compat legacy
-            "preparacion_parto": _as_bool(payload["preparacion_parto"], "preparacion_parto"),
-            "consejeria_lactancia_materna": _as_bool(payload["consejeria_lactancia_materna"], "consejeria_lactancia_materna"),
-            "nota_control": payload.get("nota_control"),
-            "iniciales_personal": payload.get("iniciales_personal"),
-            # lista APN si llega
-            **({"apn": _norm_apn_list(payload.get("apn"))} if "apn" in payload else {}),
-            # compat legacy
-            **({"plan_parto": _as_bool(payload["plan_parto"], "plan_parto")} if payload.get("plan_parto") is not None else {}),
-            **({"consejeria_lactancia": _as_bool(payload["consejeria_lactancia"], "consejeria_lactancia")} if payload.get("consejeria_lactancia") is not None else {}),
-            "proxima_cita": _as_date_ymd(payload["proxima_cita"], "proxima_cita") if payload.get("proxima_cita") else None,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
-        }
+        doc = _build_doc(historial_id, payload, usuario_actual)
 
         res = mongo.db.gestacion_actual.insert_one(doc, session=session) if session else mongo.db.gestacion_actual.insert_one(doc)
+        svc_snap.sincronizar_seccion("gestacion_actual", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve: return _fail(str(ve), 422)
@@ -463,21 +375,17 @@ def actualizar_gestacion_actual_por_id(ga_id: str, payload: dict, session=None):
 
         if "historial_id" in upd and upd["historial_id"] is not None:
             h_oid=_to_oid(upd["historial_id"],"historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"]=h_oid
 
-        for k in ("identificacion_id","paciente_id","usuario_id"):
-            if k in upd and upd[k]: upd[k]=_to_oid(upd[k], k)
+        if upd.get("usuario_id"): upd["usuario_id"]=_to_oid(upd["usuario_id"], "usuario_id")
 
-        for f in ("fum","fpp","proxima_cita"):
-            if f in upd and upd[f]: upd[f]=_as_date_ymd(upd[f], f)
-
-        for f in ("peso_anterior","talla","hemoglobina"):
-            if f in upd and upd[f] is not None:
-                if f=="peso_anterior": upd[f]=_as_float_in_range(upd[f], f, _PESO_MIN,_PESO_MAX)
-                elif f=="talla":      upd[f]=_as_float_in_range(upd[f], f, _TALLA_MIN,_TALLA_MAX)
-                else:                 upd[f]=_as_float_in_range(upd[f], f, _HEMO_MIN,_HEMO_MAX)
+        # mismo esquema que al crear; solo los campos enviados (sin exigir requeridos)
+        upd.update(_validar(payload, parcial=True))
+        if "apn" in upd and upd["apn"] is None:
+            upd["apn"] = []
+        _con_ids(upd.get("apn"))
 
         # recalcular IMC si cambió peso/talla
         if ("peso_anterior" in upd or "talla" in upd):
@@ -487,66 +395,15 @@ def actualizar_gestacion_actual_por_id(ga_id: str, payload: dict, session=None):
             if peso is not None and talla is not None:
                 upd["imc"]=round(float(peso)/(float(talla)*float(talla)), 2)
 
-        for f in ("hb_lt20","hb_ge20"):
-            if f in upd and upd[f] is not None:
-                upd[f]=_as_float_in_range(upd[f], f, _HEMO_MIN,_HEMO_MAX)
-        for g in ("glucemia1","glucemia2"):
-            if g in upd and upd[g] is not None:
-                upd[g]=_as_float_in_range(upd[g], g, _GLU_MIN, None)
-        for i in ("antitetanica_dosis","antitetanica_mes_gestacion"):
-            if i in upd and upd[i] is not None:
-                upd[i]=_as_int_in_range(upd[i], i, 0, 6 if i=="antitetanica_dosis" else 45)
-
-        for b in ("eg_confiable","fumadora_activa","fumadora_pasiva","drogas","alcohol","violencia",
-                  "vacuna_antitetanica","examen_mamas","examen_odonto","cervix_normal","inmunizada",
-                  "gammaglobulina","toxoplasmosis_igg","toxoplasmosis_igm","hierro_acido_folico",
-                  "vih_solicitado","tratamiento_vih","sifilis_tratamiento","pareja_tratada",
-                  "chagas","malaria","bacteriuria","estreptococo","plan_parto","consejeria_lactancia"):
-            if b in upd and upd[b] is not None: upd[b]=_as_bool(upd[b], b)
-
-        if "vacuna_rubeola" in upd and upd["vacuna_rubeola"]:
-            upd["vacuna_rubeola"]=_norm_enum(upd["vacuna_rubeola"], _VAC_RUBEOLA,"vacuna_rubeola")
-        if "grupo_sanguineo" in upd and upd["grupo_sanguineo"]:
-            upd["grupo_sanguineo"]=_norm_enum(upd["grupo_sanguineo"], _GRUPO_SANG,"grupo_sanguineo")
-        if "rh" in upd and upd["rh"]:
-            upd["rh"]=_norm_enum(upd["rh"], _RH,"rh")
-        if "vih_resultado" in upd and upd["vih_resultado"]:
-            upd["vih_resultado"]=_norm_enum(upd["vih_resultado"], _VIH_RES,"vih_resultado")
-        if "sifilis" in upd and upd["sifilis"]:
-            upd["sifilis"]=_norm_enum(upd["sifilis"], _SIFILIS,"sifilis")
-        if "eg_confiable_por" in upd and upd["eg_confiable_por"]:
-            upd["eg_confiable_por"]=_norm_enum(upd["eg_confiable_por"], _EG_POR,"eg_confiable_por")
-
-        for tri in ("cervix_inspeccion","pap","colposcopia","bacteriuria_res"):
-            if tri in upd and upd[tri] is not None:
-                upd[tri]=_norm_tri_nsi_legacy_from_bool(upd[tri], tri)
-        for tri in ("chagas_res","malaria_res","estreptococo_res"):
-            if tri in upd and upd[tri] is not None:
-                upd[tri]=_norm_tri_sig_legacy_from_bool(upd[tri], tri)
-
-        if "tarv" in upd and upd["tarv"] is not None:
-            upd["tarv"]=_norm_tarv_legacy(upd["tarv"], "tarv")
-        if "gammaglobulina_estado" in upd and upd["gammaglobulina_estado"] is not None:
-            upd["gammaglobulina_estado"]=_norm_sino_nc_legacy(upd["gammaglobulina_estado"], "gammaglobulina_estado")
-
-        for k in [
-            "fuma_act_t1","fuma_act_t2","fuma_act_t3","fuma_pas_t1","fuma_pas_t2","fuma_pas_t3",
-            "drogas_t1","drogas_t2","drogas_t3","alcohol_t1","alcohol_t2","alcohol_t3",
-            "violencia_t1","violencia_t2","violencia_t3"
-        ]:
-            if k in upd and upd[k] is not None:
-                upd[k]=_norm_sino_nc_legacy(upd[k], k)
-
-        for k in ("sifilis_no_trep_lt20","sifilis_no_trep_ge20"):
-            if k in upd and upd[k]:
-                upd[k]=_norm_enum(upd[k], _SIFILIS, k)
-        for k in ("sifilis_trep_lt20","sifilis_trep_ge20"):
-            if k in upd and upd[k]:
-                upd[k]=_norm_enum(upd[k], _SIFILIS_TREP, k)
-
         upd["updated_at"]=datetime.utcnow()
-        res=mongo.db.gestacion_actual.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count==0: return _fail("No se encontró el documento", 404)
+        actualizado = mongo.db.gestacion_actual.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
+            return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "gestacion_actual", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje":"Gestación actual actualizada"}, 200)
 
     except ValueError as ve: return _fail(str(ve), 422)
@@ -555,8 +412,12 @@ def actualizar_gestacion_actual_por_id(ga_id: str, payload: dict, session=None):
 def eliminar_gestacion_actual_por_id(ga_id: str, session=None):
     try:
         oid=_to_oid(ga_id,"ga_id")
-        res=mongo.db.gestacion_actual.delete_one({"_id": oid}, session=session)
-        if res.deleted_count==0: return _fail("No se encontró el documento", 404)
+        eliminado = mongo.db.gestacion_actual.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
+            return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje":"Gestación actual eliminada"}, 200)
     except ValueError as ve: return _fail(str(ve), 422)
     except Exception: return _fail("Error al eliminar", 400)
@@ -565,7 +426,90 @@ def eliminar_gestacion_actual_por_historial_id(historial_id: str, session=None):
     try:
         oid=_to_oid(historial_id,"historial_id")
         res=mongo.db.gestacion_actual.delete_many({"historial_id": oid}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(historial_id=oid, session=session)
         if res.deleted_count==0: return _fail("No se encontraron documentos para este historial", 404)
         return _ok({"mensaje": f"Se eliminaron {res.deleted_count} registros de gestación actual"}, 200)
     except ValueError as ve: return _fail(str(ve), 422)
     except Exception: return _fail("Error al eliminar", 400)
+
+
+# ---------------- Controles prenatales (APN) uno a uno ----------------
+# Cada control se agrega/edita/borra con un solo update sobre la gestación más
+# reciente del historial ($push / $set con arrayFilters / $pull): se valida solo
+# el control enviado y no se reescribe la lista completa.
+# `ref` es el apn_id del control; los controles previos a apn_id se direccionan
+# por su posición en la lista (0..n-1).
+
+def _ref_control(ref):
+    """apn_id (ObjectId) o posición (int) del control."""
+    ref = str(ref or "").strip()
+    if ref.isdigit():
+        return int(ref)
+    return _to_oid(ref, "apn_id")
+
+def _aplicar_apn(historial_id, filtro_extra: dict, update: dict, session=None, array_filters=None):
+    """Un find_one_and_update sobre la gestación vigente del historial + sync del snapshot."""
+    h_oid = _to_oid(historial_id, "historial_id")
+    update.setdefault("$set", {})["updated_at"] = datetime.utcnow()
+    actualizado = mongo.db.gestacion_actual.find_one_and_update(
+        {"historial_id": h_oid, **filtro_extra}, update,
+        sort=[("created_at", -1)], array_filters=array_filters,
+        return_document=ReturnDocument.AFTER, session=session
+    )
+    if actualizado:
+        svc_snap.sincronizar_seccion_actualizada(
+            "gestacion_actual", actualizado, _serialize(actualizado), session=session
+        )
+    return actualizado
+
+def agregar_control_apn(historial_id: str, payload: dict, session=None):
+    try:
+        if not isinstance(payload, dict): return _fail("JSON inválido", 400)
+        item = _validar_control(payload)
+        item["apn_id"] = ObjectId()
+        # gestaciones guardadas con apn: null (antes de normalizarlo a []): $push falla sobre null
+        mongo.db.gestacion_actual.update_many(
+            {"historial_id": _to_oid(historial_id, "historial_id"), "apn": {"$type": "null"}},
+            {"$set": {"apn": []}}, session=session
+        )
+        if not _aplicar_apn(historial_id, {}, {"$push": {"apn": item}}, session=session):
+            return _fail("No se encontró gestación actual para este historial", 404)
+        return _ok({"apn_id": str(item["apn_id"])}, 201)
+    except ValueError as ve: return _fail(str(ve), 422)
+    except Exception as e:  return _fail(f"Error al agregar control prenatal: {str(e)}", 400)
+
+def actualizar_control_apn(historial_id: str, ref: str, payload: dict, session=None):
+    try:
+        if not isinstance(payload, dict): return _fail("JSON inválido", 400)
+        cambios = _validar_control(payload, parcial=True)
+        cambios.pop("apn_id", None)
+        if not cambios: return _fail("No hay campos para actualizar", 422)
+
+        ref = _ref_control(ref)
+        if isinstance(ref, int):
+            filtro, ruta, array_filters = {f"apn.{ref}": {"$exists": True}}, f"apn.{ref}", None
+        else:
+            filtro, ruta, array_filters = {"apn.apn_id": ref}, "apn.$[c]", [{"c.apn_id": ref}]
+        upd = {"$set": {f"{ruta}.{k}": v for k, v in cambios.items()}}
+        if not _aplicar_apn(historial_id, filtro, upd, session=session, array_filters=array_filters):
+            return _fail("No se encontró el control prenatal", 404)
+        return _ok({"mensaje": "Control prenatal actualizado"}, 200)
+    except ValueError as ve: return _fail(str(ve), 422)
+    except Exception: return _fail("Error al actualizar control prenatal", 400)
+
+def eliminar_control_apn(historial_id: str, ref: str, session=None):
+    try:
+        ref = _ref_control(ref)
+        if isinstance(ref, int):
+            # sin apn_id: se marca la posición y se retira (dos updates, misma sesión)
+            marcado = _aplicar_apn(historial_id, {f"apn.{ref}": {"$exists": True}},
+                                   {"$unset": {f"apn.{ref}": 1}}, session=session)
+            if not marcado:
+                return _fail("No se encontró el control prenatal", 404)
+            _aplicar_apn(historial_id, {"_id": marcado["_id"]}, {"$pull": {"apn": None}}, session=session)
+        elif not _aplicar_apn(historial_id, {"apn.apn_id": ref}, {"$pull": {"apn": {"apn_id": ref}}}, session=session):
+            return _fail("No se encontró el control prenatal", 404)
+        return _ok({"mensaje": "Control prenatal eliminado"}, 200)
+    except ValueError as ve: return _fail(str(ve), 422)
+    except Exception: return _fail("Error al eliminar control prenatal", 400)
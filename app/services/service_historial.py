@@ -1,7 +1,14 @@
 from datetime import datetime
 from bson import ObjectId
 from flask import current_app
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
 from app import mongo
+from app.db import identity_map, series
+from app.services import service_historial_agregado as svc_agg
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.fanout import ejecutar_en_paralelo
+from app.utils import paginacion
 
 # ==== Imports (opcionales) de otros services ====
 # Se intentan cargar para el GET agregado; si no existen, se ignoran sin romper.
@@ -77,44 +84,6 @@ def _validar_numero_gesta(v):
     except Exception:
         raise ValueError("numero_gesta debe ser entero >= 1")
 
-def _ensure_indexes_historiales():
-    """
-    Índices recomendados para historiales:
-    - Único: (paciente_id, numero_gesta)
-    - Búsqueda por paciente_id
-    - Búsqueda por cada referencia
-    - (Opcional) compuesto por created_at + numero_gesta para listados
-    """
-    try:
-        mongo.db.historiales.create_index(
-            [("paciente_id", 1), ("numero_gesta", 1)],
-            unique=True,
-            name="uq_paciente_gesta"
-        )
-    except Exception:
-        pass
-    try:
-        mongo.db.historiales.create_index("paciente_id", name="ix_paciente")
-    except Exception:
-        pass
-    for ref_field in [
-        "identificacion_id", "antecedentes_id", "gestacion_actual_id",
-        "parto_aborto_id", "patologias_id", "recien_nacido_id",
-        "puerperio_id", "egreso_neonatal_id", "egreso_materno_id",
-        "anticoncepcion_id"
-    ]:
-        try:
-            mongo.db.historiales.create_index(ref_field, name=f"ix_{ref_field}")
-        except Exception:
-            pass
-    try:
-        mongo.db.historiales.create_index(
-            [("created_at", -1), ("numero_gesta", -1)],
-            name="ix_created_gesta"
-        )
-    except Exception:
-        pass
-
 def _serialize_historial(doc: dict):
     def _sid(x):  # stringify id
         return str(x) if isinstance(x, ObjectId) else (x if isinstance(x, str) else None)
@@ -140,6 +109,28 @@ def _serialize_historial(doc: dict):
 
 
 # ==== Services: HISTORIALES ====
+def _build_doc(payload: dict):
+    """Documento de 'historiales' validado, sin tocar Mongo (ValueError si algo no cuadra)."""
+    doc = {
+        "paciente_id": _to_oid(payload.get("paciente_id"), "paciente_id"),
+        "numero_gesta": _validar_numero_gesta(payload.get("numero_gesta")),
+        "activo": True,
+        "created_at": payload.get("created_at") or datetime.utcnow(),
+        "updated_at": payload.get("updated_at") or datetime.utcnow(),
+    }
+
+    # Referencias opcionales
+    for ref_field in [
+        "identificacion_id", "antecedentes_id", "gestacion_actual_id",
+        "parto_aborto_id", "patologias_id", "recien_nacido_id",
+        "puerperio_id", "egreso_neonatal_id", "egreso_materno_id",
+        "anticoncepcion_id"
+    ]:
+        if payload.get(ref_field) is not None:
+            doc[ref_field] = _to_oid(payload[ref_field], ref_field)
+    return doc
+
+
 def crear_historial(payload: dict, session=None):
     """
     Crea un historial clínico en 'historiales'.
@@ -151,28 +142,7 @@ def crear_historial(payload: dict, session=None):
         if not isinstance(payload, dict):
             return _fail("JSON inválido", 400)
 
-        _ensure_indexes_historiales()
-
-        paciente_oid = _to_oid(payload.get("paciente_id"), "paciente_id")
-        numero_gesta = _validar_numero_gesta(payload.get("numero_gesta"))
-
-        doc = {
-            "paciente_id": paciente_oid,
-            "numero_gesta": numero_gesta,
-            "activo": True,
-            "created_at": payload.get("created_at") or datetime.utcnow(),
-            "updated_at": payload.get("updated_at") or datetime.utcnow(),
-        }
-
-        # Referencias opcionales
-        for ref_field in [
-            "identificacion_id", "antecedentes_id", "gestacion_actual_id",
-            "parto_aborto_id", "patologias_id", "recien_nacido_id",
-            "puerperio_id", "egreso_neonatal_id", "egreso_materno_id",
-            "anticoncepcion_id"
-        ]:
-            if payload.get(ref_field) is not None:
-                doc[ref_field] = _to_oid(payload[ref_field], ref_field)
+        doc = _build_doc(payload)
 
         try:
             current_app.logger.info(f"[historiales] Insert doc: {doc}")
@@ -181,6 +151,8 @@ def crear_historial(payload: dict, session=None):
 
         res = (mongo.db.historiales.insert_one(doc, session=session)
                if session else mongo.db.historiales.insert_one(doc))
+        identity_map.registrar("historiales", doc)
+        svc_snap.sincronizar_historial(doc, _serialize_historial(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -207,7 +179,7 @@ def actualizar_historial_por_id(historial_id: str, payload: dict, session=None):
             return _fail("JSON inválido", 400)
 
         oid = _to_oid(historial_id, "historial_id")
-        doc_actual = mongo.db.historiales.find_one({"_id": oid})
+        doc_actual = identity_map.obtener_por_id("historiales", oid, session=session)
         if not doc_actual:
             return _fail("Historial no encontrado", 404)
 
@@ -253,9 +225,13 @@ def actualizar_historial_por_id(historial_id: str, payload: dict, session=None):
         if sets:   update_doc["$set"] = sets
         if unsets: update_doc["$unset"] = unsets
 
-        res = mongo.db.historiales.update_one({"_id": oid}, update_doc, session=session)
-        if res.matched_count == 0:
+        doc = mongo.db.historiales.find_one_and_update(
+            {"_id": oid}, update_doc, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not doc:
             return _fail("Historial no encontrado", 404)
+        identity_map.registrar("historiales", doc)
+        svc_snap.sincronizar_historial(doc, _serialize_historial(doc), session=session)
         return _ok({"mensaje": "Historial actualizado"}, 200)
 
     except ValueError as ve:
@@ -264,6 +240,9 @@ def actualizar_historial_por_id(historial_id: str, payload: dict, session=None):
         return _fail("Error al actualizar historial", 400)
 
 
+# Series de tiempo (app.db.series) colgadas del historial: se borran con él (hard).
+_SERIES_HISTORIAL = ("partograma_series", "puerperio_series")
+
 def eliminar_historial_por_id(historial_id: str, hard: bool = False, session=None):
     """
     Elimina un historial.
@@ -276,15 +255,22 @@ def eliminar_historial_por_id(historial_id: str, hard: bool = False, session=Non
             res = mongo.db.historiales.delete_one({"_id": oid}, session=session)
             if res.deleted_count == 0:
                 return _fail("Historial no encontrado", 404)
+            identity_map.invalidar("historiales", oid)
+            svc_snap.invalidar(historial_id=oid, session=session)
+            for coleccion in _SERIES_HISTORIAL:
+                series.eliminar(coleccion, {"historial_id": oid}, session=session)
             return _ok({"mensaje": "Historial eliminado definitivamente"}, 200)
         else:
-            res = mongo.db.historiales.update_one(
+            doc = mongo.db.historiales.find_one_and_update(
                 {"_id": oid},
                 {"$set": {"activo": False, "updated_at": datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER,
                 session=session
             )
-            if res.matched_count == 0:
+            if not doc:
                 return _fail("Historial no encontrado", 404)
+            identity_map.registrar("historiales", doc)
+            svc_snap.sincronizar_historial(doc, _serialize_historial(doc), session=session)
             return _ok({"mensaje": "Historial desactivado"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -292,10 +278,15 @@ def eliminar_historial_por_id(historial_id: str, hard: bool = False, session=Non
         return _fail("Error al eliminar historial", 400)
 
 
-def listar_historiales(paciente_id: str | None = None, page: int = 1, per_page: int = 20):
+_ORDEN_LISTADO = [("created_at", -1), ("numero_gesta", -1)]
+
+def listar_historiales(paciente_id: str | None = None, page: int = 1, per_page: int = 20,
+                       after: str | None = None, count: str | None = None):
     """
     Listado simple. Si se pasa paciente_id, filtra por ese paciente.
-    Orden: created_at desc, numero_gesta desc.
+    Orden: created_at desc, numero_gesta desc (_id desc como desempate).
+    Con after (token next_cursor) pagina por cursor en lugar de skip.
+    count: exact (defecto en page) | estimated | none (defecto en cursor).
     """
     try:
         page = max(int(page or 1), 1)
@@ -305,21 +296,34 @@ def listar_historiales(paciente_id: str | None = None, page: int = 1, per_page:
         if paciente_id:
             filtro["paciente_id"] = _to_oid(paciente_id, "paciente_id")
 
-        total = mongo.db.historiales.count_documents(filtro)
-        cursor = (
-            mongo.db.historiales.find(filtro)
-            .sort([("created_at", -1), ("numero_gesta", -1)])
-            .skip((page - 1) * per_page)
-            .limit(per_page)
+        if after is not None:
+            conteo = paginacion.parsear_conteo(count, default="none")
+            data = paginacion.paginar_keyset(
+                mongo.db.historiales, filtro, _ORDEN_LISTADO, per_page, after,
+                _serialize_historial, conteo=conteo
+            )
+            return _ok(data, 200)
+
+        conteo = paginacion.parsear_conteo(count)
+        data = paginacion.paginar_offset(
+            mongo.db.historiales, filtro, _ORDEN_LISTADO, page, per_page,
+            _serialize_historial, conteo=conteo
         )
-        items = [_serialize_historial(d) for d in cursor]
-        return _ok({"items": items, "page": page, "per_page": per_page, "total": total}, 200)
+        return _ok(data, 200)
 
     except ValueError as ve:
         return _fail(str(ve), 422)
     except Exception:
         return _fail("Error al listar historiales", 400)
 
+def iterar_historiales(paciente_id: str | None = None, batch_size: int = 500):
+    """Mismo filtro y orden que listar_historiales, sin paginar (NDJSON). ValueError si paciente_id no es válido."""
+    filtro = {}
+    if paciente_id:
+        filtro["paciente_id"] = _to_oid(paciente_id, "paciente_id")
+    return paginacion.iterar(mongo.db.historiales, filtro, _ORDEN_LISTADO, _serialize_historial,
+                             batch_size=batch_size)
+
 
 # ==== Helpers de vinculación de segmentos ====
 def vincular_segmento(historial_id: str, campo_ref: str, doc_id: str, session=None):
@@ -327,13 +331,16 @@ def vincular_segmento(historial_id: str, campo_ref: str, doc_id: str, session=No
     try:
         oid = _to_oid(historial_id, "historial_id")
         did = _to_oid(doc_id, "doc_id")
-        res = mongo.db.historiales.update_one(
+        doc = mongo.db.historiales.find_one_and_update(
             {"_id": oid},
             {"$set": {campo_ref: did, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
             session=session
         )
-        if res.matched_count == 0:
+        if not doc:
             return _fail("Historial no encontrado", 404)
+        identity_map.registrar("historiales", doc)
+        svc_snap.sincronizar_historial(doc, _serialize_historial(doc), session=session)
         return _ok({"mensaje": f"{campo_ref} vinculado"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -344,13 +351,16 @@ def desvincular_segmento(historial_id: str, campo_ref: str, session=None):
     """Elimina una referencia *_id del historial (unset real)."""
     try:
         oid = _to_oid(historial_id, "historial_id")
-        res = mongo.db.historiales.update_one(
+        doc = mongo.db.historiales.find_one_and_update(
             {"_id": oid},
             {"$unset": {campo_ref: ""}, "$set": {"updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
             session=session
         )
-        if res.matched_count == 0:
+        if not doc:
             return _fail("Historial no encontrado", 404)
+        identity_map.registrar("historiales", doc)
+        svc_snap.sincronizar_historial(doc, _serialize_historial(doc), session=session)
         return _ok({"mensaje": f"{campo_ref} desvinculado"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -412,99 +422,164 @@ def _segmento(doc_hist, historial_id_str, ref_id_field, svc,
     return None
 
 
-def obtener_historial(historial_id: str):
+def _episodios(doc):
+    """Identificaciones del paciente (opcional, solo si el service lo expone)."""
+    if svc_ident and hasattr(svc_ident, "listar_identificaciones_por_paciente"):
+        try:
+            eps = svc_ident.listar_identificaciones_por_paciente(str(doc["paciente_id"]))
+            if isinstance(eps, tuple) and isinstance(eps[0], dict) and eps[0].get("ok"):
+                return eps[0]["data"]
+            if isinstance(eps, dict) and eps.get("ok"):
+                return eps["data"]
+        except Exception:
+            pass
+    return None
+
+
+def _candidatos(svc, nombre):
+    return dict(
+        svc=svc,
+        by_hist_fn=(f"obtener_{nombre}_por_historial",),
+        by_refid_fns=(f"obtener_{nombre}_por_id",),
+        by_paciente_fns=(f"get_{nombre}_by_id_paciente",),
+    )
+
+# (nombre de sección, campo *_id en historiales, service) para la ruta legacy
+_SEGMENTOS_LEGACY = [
+    ("identificacion",   "identificacion_id",   svc_ident),
+    ("antecedentes",     "antecedentes_id",     svc_ant),
+    ("gestacion_actual", "gestacion_actual_id", svc_ga),
+    ("parto_aborto",     "parto_aborto_id",     svc_pa),
+    ("patologias",       "patologias_id",       svc_pat),
+    ("puerperio",        "puerperio_id",        svc_puer),
+    ("recien_nacido",    "recien_nacido_id",    svc_rn),
+    ("egreso_neonatal",  "egreso_neonatal_id",  svc_en),
+    ("egreso_materno",   "egreso_materno_id",   svc_em),
+    ("anticoncepcion",   "anticoncepcion_id",   svc_antico),
+]
+
+
+def _obtener_historial_por_segmentos(oid, secciones=None, campos=None):
     """
-    GET agregado del historial:
-    - Retorna el historial base.
-    - Enriquecer con segmentos priorizando obtener_*_por_historial(historial_id);
-      si no, por *_id del historial; y por último por paciente_id.
+    Ruta legacy (una consulta por sección). Solo se usa si el servidor
+    rechaza el pipeline de service_historial_agregado.
     """
+    doc = mongo.db.historiales.find_one({"_id": oid})
+    if not doc:
+        return _fail("Historial no encontrado", 404)
+
+    secciones = svc_agg.NOMBRES_SECCIONES if secciones is None else secciones
+    campos = campos or {}
+    out = _serialize_historial(doc)
+    hid = str(doc["_id"])
+    out["episodios"] = _episodios(doc)
+
+    tareas = {
+        nombre: (lambda ref_field=ref_field, svc=svc, nombre=nombre:
+                 _segmento(doc, hid, ref_field, **_candidatos(svc, nombre)))
+        for nombre, ref_field, svc in _SEGMENTOS_LEGACY
+        if nombre in secciones
+    }
+    for nombre, data in ejecutar_en_paralelo(tareas).items():
+        out[nombre] = svc_agg.recortar(data, campos.get(nombre))
+
+    return _ok(out, 200)
+
+
+def _snapshots_activos():
     try:
-        oid = _to_oid(historial_id, "historial_id")
-        doc = mongo.db.historiales.find_one({"_id": oid})
-        if not doc:
-            return _fail("Historial no encontrado", 404)
+        return bool(current_app.config.get("HISTORIAL_SNAPSHOTS", True))
+    except Exception:
+        return False
 
-        out = _serialize_historial(doc)
-        hid = str(doc["_id"])
 
-        # Identificaciones del paciente (opcional, solo si el service lo expone)
-        out["episodios"] = None
-        if svc_ident and hasattr(svc_ident, "listar_identificaciones_por_paciente"):
-            try:
-                eps = svc_ident.listar_identificaciones_por_paciente(str(doc["paciente_id"]))
-                if isinstance(eps, tuple) and isinstance(eps[0], dict) and eps[0].get("ok"):
-                    out["episodios"] = eps[0]["data"]
-                elif isinstance(eps, dict) and eps.get("ok"):
-                    out["episodios"] = eps["data"]
-            except Exception:
-                pass
+def _desde_snapshot(snap, secciones=None, campos=None):
+    """Arma la salida de obtener_historial a partir de un snapshot."""
+    secciones = svc_agg.NOMBRES_SECCIONES if secciones is None else secciones
+    campos = campos or {}
+    out = dict(snap["historial"])
+    out["episodios"] = _episodios(snap)
+    data_secciones = snap.get("secciones") or {}
+    for nombre in secciones:
+        out[nombre] = svc_agg.recortar(data_secciones.get(nombre), campos.get(nombre))
+    out["snapshot"] = svc_snap.meta(snap)
+    return out
 
-        # Segmentos
-        out["antecedentes"] = _segmento(
-            doc, hid, "antecedentes_id", svc_ant,
-            by_hist_fn=("obtener_antecedentes_por_historial",),
-            by_refid_fns=("obtener_antecedentes_por_id",),
-            by_paciente_fns=("get_antecedentes_by_id_paciente",)
-        )
 
-        out["gestacion_actual"] = _segmento(
-            doc, hid, "gestacion_actual_id", svc_ga,
-            by_hist_fn=("obtener_gestacion_actual_por_historial",),
-            by_refid_fns=("obtener_gestacion_actual_por_id",),
-            by_paciente_fns=("get_gestacion_actual_by_id_paciente",)
-        )
+def _obtener_historial_agregado(oid, secciones=None, campos=None):
+    """Lectura en vivo: un $lookup (o la ruta por segmentos si el servidor no lo soporta)."""
+    try:
+        doc, data_secciones = svc_agg.obtener_agregado(oid, secciones, campos)
+    except OperationFailure:
+        try:
+            current_app.logger.warning("[historiales] $lookup no soportado; usando lectura por segmentos")
+        except Exception:
+            pass
+        return _obtener_historial_por_segmentos(oid, secciones, campos)
 
-        out["parto_aborto"] = _segmento(
-            doc, hid, "parto_aborto_id", svc_pa,
-            by_hist_fn=("obtener_parto_aborto_por_historial",),
-            by_refid_fns=("obtener_parto_aborto_por_id",),
-            by_paciente_fns=("get_parto_aborto_by_id_paciente",)
-        )
+    if not doc:
+        return _fail("Historial no encontrado", 404)
 
-        out["patologias"] = _segmento(
-            doc, hid, "patologias_id", svc_pat,
-            by_hist_fn=("obtener_patologias_por_historial",),
-            by_refid_fns=("obtener_patologias_por_id",),
-            by_paciente_fns=("get_patologias_by_id_paciente",)
-        )
+    out = _serialize_historial(doc)
+    out["episodios"] = _episodios(doc)
+    out.update(data_secciones)
+    return _ok(out, 200)
 
-        out["puerperio"] = _segmento(
-            doc, hid, "puerperio_id", svc_puer,
-            by_hist_fn=("obtener_puerperio_por_historial",),
-            by_refid_fns=("obtener_puerperio_por_id",),
-            by_paciente_fns=("get_puerperio_by_id_paciente",)
-        )
 
-        out["recien_nacido"] = _segmento(
-            doc, hid, "recien_nacido_id", svc_rn,
-            by_hist_fn=("obtener_recien_nacido_por_historial",),
-            by_refid_fns=("obtener_recien_nacido_por_id",),
-            by_paciente_fns=("get_recien_nacido_by_id_paciente",)
-        )
+def obtener_historial(historial_id: str, secciones=None, campos=None):
+    """
+    GET agregado del historial:
+    - Se sirve desde historial_snapshots con un find_one por _id.
+    - Si no hay snapshot (o es de otro schema), se lee en vivo con un solo
+      $lookup (service_historial_agregado) y se reconstruye el snapshot.
+    - secciones/campos: ver service_historial_agregado.parsear_seleccion.
+    - Misma prioridad que antes: historial_id, luego *_id del historial
+      y por último paciente_id.
+    """
+    try:
+        oid = _to_oid(historial_id, "historial_id")
+        if not _snapshots_activos():
+            return _obtener_historial_agregado(oid, secciones, campos)
 
-        out["egreso_neonatal"] = _segmento(
-            doc, hid, "egreso_neonatal_id", svc_en,
-            by_hist_fn=("obtener_egreso_neonatal_por_historial",),
-            by_refid_fns=("obtener_egreso_neonatal_por_id",),
-            by_paciente_fns=("get_egreso_neonatal_by_id_paciente",)
-        )
+        snap = svc_snap.obtener(oid, secciones, campos)
+        if not svc_snap.es_valido(snap):
+            try:
+                snap = svc_snap.reconstruir(oid)
+            except OperationFailure:
+                snap = None
+            if not snap:
+                return _obtener_historial_agregado(oid, secciones, campos)
+        return _ok(_desde_snapshot(snap, secciones, campos), 200)
 
-        out["egreso_materno"] = _segmento(
-            doc, hid, "egreso_materno_id", svc_em,
-            by_hist_fn=("obtener_egreso_materno_por_historial",),
-            by_refid_fns=("obtener_egreso_materno_por_id",),
-            by_paciente_fns=("get_egreso_materno_by_id_paciente",)
-        )
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception:
+        return _fail("Error al obtener historial", 400)
 
-        out["anticoncepcion"] = _segmento(
-            doc, hid, "anticoncepcion_id", svc_antico,
-            by_hist_fn=("obtener_anticoncepcion_por_historial",),
-            by_refid_fns=("obtener_anticoncepcion_por_id",),
-            by_paciente_fns=("get_anticoncepcion_by_id_paciente",)
-        )
 
-        return _ok(out, 200)
+def obtener_historial_reciente_por_paciente(paciente_id: str, secciones=None, campos=None):
+    """
+    Agregado del historial más reciente del paciente.
+    El historial se resuelve en `historiales` (índice ix_paciente_created_gesta_id) y
+    su snapshot se lee por _id; si falta o es de otro schema, obtener_historial lo
+    reconstruye o lo lee en vivo con $lookup.
+    """
+    try:
+        pid = _to_oid(paciente_id, "paciente_id")
+        if _snapshots_activos():
+            h_id, snap = svc_snap.obtener_reciente_por_paciente(pid, secciones, campos)
+            if svc_snap.es_valido(snap):
+                return _ok(_desde_snapshot(snap, secciones, campos), 200)
+        else:
+            doc = mongo.db.historiales.find_one(
+                {"paciente_id": pid}, {"_id": 1},
+                sort=[("created_at", -1), ("numero_gesta", -1), ("_id", -1)]
+            )
+            h_id = doc["_id"] if doc else None
+
+        if h_id is None:
+            return _fail("Historial no encontrado para paciente", 404)
+        return obtener_historial(str(h_id), secciones, campos)
 
     except ValueError as ve:
         return _fail(str(ve), 422)
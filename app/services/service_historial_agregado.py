@@ -0,0 +1,169 @@
+from bson import ObjectId
+from app import mongo
+from app.services import (
+    service_identificacion,
+    service_antencedentes,
+    service_gestacion_actual,
+    service_parto_aborto,
+    service_patologias,
+    service_recien_nacido,
+    service_puerperio,
+    service_egreso_neonatal,
+    service_egreso_materno,
+    service_anticoncepcion,
+)
+
+# ---------------- Secciones HCP ----------------
+# (nombre en el agregado, colección, campo *_id en historiales, service con _serialize)
+_SECCIONES = [
+    ("identificacion",   "identificacion",   "identificacion_id",   service_identificacion),
+    ("antecedentes",     "antecedentes",     "antecedentes_id",     service_antencedentes),
+    ("gestacion_actual", "gestacion_actual", "gestacion_actual_id", service_gestacion_actual),
+    ("parto_aborto",     "parto_aborto",     "parto_aborto_id",     service_parto_aborto),
+    ("patologias",       "patologias",       "patologias_id",       service_patologias),
+    ("recien_nacido",    "recien_nacidos",   "recien_nacido_id",    service_recien_nacido),
+    ("puerperio",        "puerperio",        "puerperio_id",        service_puerperio),
+    ("egreso_neonatal",  "egreso_neonatal",  "egreso_neonatal_id",  service_egreso_neonatal),
+    ("egreso_materno",   "egreso_materno",   "egreso_materno_id",   service_egreso_materno),
+    ("anticoncepcion",   "anticoncepcion",   "anticoncepcion_id",   service_anticoncepcion),
+]
+
+NOMBRES_SECCIONES = [s[0] for s in _SECCIONES]
+
+
+# Campos que siempre se proyectan: los necesita el _serialize de cada sección.
+_CAMPOS_BASE = ("_id", "historial_id", "paciente_id", "created_at", "updated_at")
+
+
+# ---------------- Selección (?sections= / ?fields=) ----------------
+def parsear_seleccion(sections=None, fields=None):
+    """
+    Interpreta la selección recibida por query string.
+      sections: "gestacion_actual,parto_aborto"  (None/"" => todas)
+      fields:   "gestacion_actual.fum,parto_aborto.fecha_ingreso"
+    Un campo implica su sección. Los campos se nombran como están guardados en Mongo.
+    Retorna (lista_secciones, {seccion: [campos]}). Lanza ValueError si algo no existe.
+    """
+    secciones = [s.strip() for s in (sections or "").split(",") if s.strip()]
+    campos = {}
+    for f in [f.strip() for f in (fields or "").split(",") if f.strip()]:
+        seccion, _, campo = f.partition(".")
+        if not campo:
+            raise ValueError(f"fields: '{f}' debe tener la forma seccion.campo")
+        campos.setdefault(seccion, [])
+        if campo not in campos[seccion]:
+            campos[seccion].append(campo)
+        if secciones and seccion not in secciones:
+            secciones.append(seccion)
+
+    desconocidas = [s for s in list(secciones) + list(campos) if s not in NOMBRES_SECCIONES]
+    if desconocidas:
+        raise ValueError(f"Secciones no válidas: {', '.join(sorted(set(desconocidas)))}")
+
+    if not secciones:
+        secciones = list(campos) if campos else list(NOMBRES_SECCIONES)
+    # Conserva el orden canónico
+    return [n for n in NOMBRES_SECCIONES if n in secciones], campos
+
+def _proyeccion(campos):
+    if not campos:
+        return None
+    proj = {c: 1 for c in _CAMPOS_BASE}
+    proj.update({c: 1 for c in campos})
+    return proj
+
+def recortar(serializado, campos):
+    """Deja en la salida serializada solo `id` y los campos pedidos (primer nivel)."""
+    if not serializado or not campos:
+        return serializado
+    claves = {"id"} | {c.split(".", 1)[0] for c in campos}
+    return {k: v for k, v in serializado.items() if k in claves}
+
+
+# ---------------- Pipeline ----------------
+def _lookup_mas_reciente(coleccion, campo_fk, variable, alias, proyeccion=None):
+    """$lookup del documento más reciente (created_at desc) cuyo campo_fk == $$variable."""
+    sub = [
+        {"$match": {"$expr": {"$eq": [f"${campo_fk}", "$$v"]}}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": 1},
+    ]
+    if proyeccion:
+        sub.append({"$project": proyeccion})
+    return {
+        "$lookup": {
+            "from": coleccion,
+            "let": {"v": variable},
+            "pipeline": sub,
+            "as": alias,
+        }
+    }
+
+def construir_pipeline(historial_oid: ObjectId, secciones=None, campos=None):
+    """
+    Pipeline de una sola consulta: historial + las secciones HCP pedidas
+    (por defecto las diez). Las secciones no pedidas no generan $lookup y
+    los campos pedidos se proyectan dentro de cada sub-pipeline.
+    Orden de resolución por sección (igual que service_historial._segmento):
+      1) por historial_id
+      2) por *_id guardado en el historial
+      3) fallback por paciente_id (compat/migración)
+    El resultado queda en `_secciones.<nombre>` (documento crudo o null).
+    """
+    secciones = NOMBRES_SECCIONES if secciones is None else secciones
+    campos = campos or {}
+    pipeline = [{"$match": {"_id": historial_oid}}, {"$limit": 1}]
+    elegir, temporales = {}, {}
+
+    for nombre, coleccion, ref_field, _svc in _SECCIONES:
+        if nombre not in secciones:
+            continue
+        proj = _proyeccion(campos.get(nombre))
+        a_hist, a_ref, a_pac = f"_{nombre}_h", f"_{nombre}_r", f"_{nombre}_p"
+        pipeline.append(_lookup_mas_reciente(coleccion, "historial_id", "$_id", a_hist, proj))
+        pipeline.append(_lookup_mas_reciente(coleccion, "_id", f"${ref_field}", a_ref, proj))
+        pipeline.append(_lookup_mas_reciente(coleccion, "paciente_id", "$paciente_id", a_pac, proj))
+
+        elegir[f"_secciones.{nombre}"] = {
+            "$ifNull": [
+                {"$arrayElemAt": [f"${a_hist}", 0]},
+                {"$ifNull": [
+                    {"$arrayElemAt": [f"${a_ref}", 0]},
+                    {"$ifNull": [{"$arrayElemAt": [f"${a_pac}", 0]}, None]},
+                ]},
+            ]
+        }
+        temporales.update({a_hist: 0, a_ref: 0, a_pac: 0})
+
+    if elegir:
+        pipeline.append({"$addFields": elegir})
+        pipeline.append({"$project": temporales})
+    return pipeline
+
+
+# ---------------- Lectura ----------------
+def serializar_secciones(crudas: dict, secciones=None, campos=None):
+    """Aplica el _serialize de cada service a los documentos crudos de `_secciones`."""
+    secciones = NOMBRES_SECCIONES if secciones is None else secciones
+    campos = campos or {}
+    out = {}
+    for nombre, _col, _ref, svc in _SECCIONES:
+        if nombre not in secciones:
+            continue
+        doc = (crudas or {}).get(nombre)
+        out[nombre] = recortar(svc._serialize(doc), campos.get(nombre)) if doc else None
+    return out
+
+def obtener_agregado(historial_oid: ObjectId, secciones=None, campos=None):
+    """
+    Ejecuta el pipeline (un solo round trip a Mongo).
+    Retorna (doc_historial_crudo | None, {seccion: dict serializado | None}).
+    Puede propagar OperationFailure si el servidor no soporta el pipeline.
+    """
+    pipeline = construir_pipeline(historial_oid, secciones, campos)
+    docs = list(mongo.db.historiales.aggregate(pipeline))
+    if not docs:
+        return None, {}
+    doc = docs[0]
+    crudas = doc.pop("_secciones", None) or {}
+    return doc, serializar_secciones(crudas, secciones, campos)
@@ -0,0 +1,219 @@
+from datetime import datetime
+from bson import ObjectId
+from flask import current_app
+from pymongo import InsertOne, UpdateOne, ReplaceOne
+from app import mongo
+from app.db import identity_map
+from app.services import service_historial
+from app.services import service_historial_snapshot as svc_snap
+from app.services import service_paciente
+from app.services.service_historial_agregado import _SECCIONES
+
+# Alta completa de POST /historiales/create en dos fases:
+#   1) planificar(): arma en memoria el historial y cada sección con el _build_doc
+#      de su service (sin tocar Mongo) y junta los errores de todos los bloques.
+#   2) ejecutar(): con el plan ya validado, escribe dentro de la transacción con el
+#      mínimo de viajes:
+#        - numero_gesta del contador del paciente (un find_one_and_update)
+#        - historial + secciones + historial_id del paciente + snapshot en un único
+#          client.bulk_write (MongoDB >= 8.0); en servidores anteriores, una
+#          escritura por colección.
+# Así la transacción solo se abre cuando el cuerpo ya es válido y dura lo justo.
+
+# (bloque, colección, service con _build_doc/_serialize), en el orden del HCP
+SECCIONES_PLAN = [(nombre, coleccion, servicio) for nombre, coleccion, _ref, servicio in _SECCIONES]
+
+_bulk_cliente = None
+
+
+def _log_warn(msg):
+    try:
+        current_app.logger.warning(f"[historial_plan] {msg}")
+    except Exception:
+        pass
+
+def _soporta_bulk_cliente():
+    """client.bulk_write necesita PyMongo >= 4.9 y servidor >= 8.0; se consulta una vez."""
+    global _bulk_cliente
+    if _bulk_cliente is None:
+        try:
+            version = mongo.cx.server_info().get("versionArray") or [0]
+            _bulk_cliente = hasattr(mongo.cx, "bulk_write") and int(version[0]) >= 8
+        except Exception as e:
+            _log_warn(f"no se pudo consultar la versión del servidor: {e}")
+            _bulk_cliente = False
+    return _bulk_cliente
+
+
+# ---------------- Fase 1: validación (sin Mongo) ----------------
+def planificar(body: dict, usuario_actual: dict | None):
+    """
+    Valida el cuerpo completo de /create. Retorna (plan, errores):
+      errores: {bloque: mensaje} con TODOS los bloques inválidos ("datos" = historial)
+      plan:    {"historial": doc, "secciones": [(bloque, coleccion, servicio, doc)], ...}
+    Los _id se generan aquí, así el historial lleva todas sus referencias *_id.
+    numero_gesta se valida si viene; el definitivo lo asigna ejecutar().
+    """
+    errores = {}
+    datos = body.get("datos")
+    if not isinstance(datos, dict):
+        return None, {"datos": "Falta bloque: datos (historial)"}
+
+    historial_oid = ObjectId()
+    secciones = []
+    for nombre, coleccion, servicio in SECCIONES_PLAN:
+        if nombre not in body:
+            continue
+        payload = body[nombre]
+        if payload is None:
+            payload = {}
+        if not isinstance(payload, dict):
+            errores[nombre] = "JSON inválido"
+            continue
+        try:
+            doc = servicio._build_doc(historial_oid, dict(payload), usuario_actual)
+        except ValueError as ve:
+            errores[nombre] = str(ve)
+            continue
+        except Exception as e:
+            errores[nombre] = f"Error al validar {nombre}: {e}"
+            continue
+        doc["_id"] = ObjectId()
+        secciones.append((nombre, coleccion, servicio, doc))
+
+    hist_payload = dict(datos)
+    if not hist_payload.get("paciente_id"):
+        errores["datos"] = "datos.paciente_id es requerido"
+    else:
+        numero_gesta = hist_payload.get("numero_gesta")
+        for nombre, _col, _svc, doc in secciones:
+            hist_payload[f"{nombre}_id"] = doc["_id"]
+        try:
+            # numero_gesta provisional solo para validar el resto del bloque
+            doc_historial = service_historial._build_doc(
+                {**hist_payload, "numero_gesta": numero_gesta if numero_gesta not in (None, "", 0) else 1}
+            )
+            doc_historial["_id"] = historial_oid
+        except ValueError as ve:
+            errores["datos"] = str(ve)
+
+    if errores:
+        return None, errores
+    return {
+        "historial": doc_historial,
+        "numero_gesta": numero_gesta,
+        "secciones": secciones,
+    }, {}
+
+
+# ---------------- Fase 2: escritura ----------------
+def _operaciones(plan: dict, snapshot: dict):
+    """
+    [(tipo, colección, filtro, documento)] en orden: historial, secciones,
+    historial_id del paciente y snapshot completo (ya no se sincroniza sección por sección).
+    """
+    doc_historial = plan["historial"]
+    ops = [("insert", "historiales", None, doc_historial)]
+    ops += [("insert", coleccion, None, doc) for _n, coleccion, _s, doc in plan["secciones"]]
+    ops.append(("update", "paciente", {"_id": doc_historial["paciente_id"]},
+                {"$set": {"historial_id": doc_historial["_id"], "updated_at": datetime.utcnow()}}))
+    ops.append(("replace", "historial_snapshots", {"_id": snapshot["_id"]}, snapshot))
+    return ops
+
+def _escribir_bulk_cliente(ops, session=None):
+    """Un único comando bulkWrite (ordenado) para todas las colecciones. Retorna matched del paciente."""
+    db = mongo.db.name
+    modelos = []
+    for tipo, coleccion, filtro, doc in ops:
+        ns = f"{db}.{coleccion}"
+        if tipo == "insert":
+            modelos.append(InsertOne(doc, namespace=ns))
+        elif tipo == "update":
+            modelos.append(UpdateOne(filtro, doc, namespace=ns))
+        else:
+            modelos.append(ReplaceOne(filtro, doc, upsert=True, namespace=ns))
+    # el snapshot es nuevo (upsert), así que el único match posible es el del paciente
+    return mongo.cx.bulk_write(modelos, ordered=True, session=session).matched_count
+
+def _escribir_por_coleccion(ops, session=None):
+    """Servidores < 8.0: una escritura por colección, en el mismo orden. Retorna matched del paciente."""
+    matched = 0
+    for tipo, coleccion, filtro, doc in ops:
+        col = mongo.db[coleccion]
+        if tipo == "insert":
+            col.insert_one(doc, session=session) if session else col.insert_one(doc)
+        elif tipo == "update":
+            matched = col.update_one(filtro, doc, session=session).matched_count
+        else:
+            col.replace_one(filtro, doc, upsert=True, session=session)
+    return matched
+
+def ejecutar(plan: dict, session=None):
+    """
+    Escribe el plan (dentro de la transacción de `session`, si hay).
+    Retorna el resumen {historial_id, paciente_id, numero_gesta, secciones_creadas}.
+    Lanza LookupError si el paciente no existe y RuntimeError ante otros fallos,
+    para que el llamador aborte la transacción.
+    """
+    doc_historial = plan["historial"]
+    paciente_oid = doc_historial["paciente_id"]
+
+    ges_res, ges_code = service_paciente.asignar_numero_gesta(
+        str(paciente_oid), plan.get("numero_gesta"), session=session
+    )
+    if ges_code == 404:
+        raise LookupError(ges_res.get("error") or "Paciente no encontrado")
+    if ges_code != 200 or not ges_res.get("ok"):
+        raise RuntimeError(ges_res.get("error") or "Error asignando numero_gesta")
+    doc_historial["numero_gesta"] = ges_res["data"]["numero_gesta"]
+
+    snapshot = svc_snap.construir(
+        doc_historial,
+        service_historial._serialize_historial(doc_historial),
+        {nombre: servicio._serialize(doc) for nombre, _c, servicio, doc in plan["secciones"]},
+    )
+    ops = _operaciones(plan, snapshot)
+    if _soporta_bulk_cliente():
+        matched = _escribir_bulk_cliente(ops, session=session)
+    else:
+        matched = _escribir_por_coleccion(ops, session=session)
+    if not matched:
+        raise LookupError("Paciente no encontrado")
+
+    identity_map.registrar("historiales", doc_historial)
+    identity_map.invalidar("paciente", paciente_oid)
+    return {
+        "historial_id": str(doc_historial["_id"]),
+        "paciente_id": str(paciente_oid),
+        "numero_gesta": doc_historial["numero_gesta"],
+        "secciones_creadas": {f"{nombre}_id": str(doc["_id"]) for nombre, _c, _s, doc in plan["secciones"]},
+    }
+
+
+def deshacer(plan: dict):
+    """
+    Sin transacción: borra lo que ejecutar() alcanzó a escribir, por los _id ya
+    asignados en el plan (historial, cada sección y el snapshot), y quita el
+    historial_id del paciente si quedó apuntando a este historial.
+    Cada paso es independiente: un fallo se registra y se sigue con el resto.
+    """
+    doc_historial = plan["historial"]
+    h_id, paciente_oid = doc_historial["_id"], doc_historial["paciente_id"]
+
+    por_coleccion = {"historiales": [h_id], "historial_snapshots": [h_id]}
+    for _n, coleccion, _s, doc in plan["secciones"]:
+        por_coleccion.setdefault(coleccion, []).append(doc["_id"])
+    for coleccion, ids in por_coleccion.items():
+        try:
+            mongo.db[coleccion].delete_many({"_id": {"$in": ids}})
+        except Exception as e:
+            _log_warn(f"no se pudo limpiar {coleccion} de {h_id}: {e}")
+    try:
+        mongo.db.paciente.update_one(
+            {"_id": paciente_oid, "historial_id": h_id},
+            {"$set": {"historial_id": None, "updated_at": datetime.utcnow()}},
+        )
+    except Exception as e:
+        _log_warn(f"no se pudo limpiar historial_id del paciente {paciente_oid}: {e}")
+    identity_map.invalidar("historiales", h_id)
+    identity_map.invalidar("paciente", paciente_oid)
@@ -0,0 +1,220 @@
+from datetime import datetime
+from bson import ObjectId
+from flask import current_app
+from app import mongo
+
+# Documento desnormalizado por historial (colección historial_snapshots):
+# {
+#   _id: <historial_id>, paciente_id, created_at, numero_gesta,
+#   historial: {...serializado...},
+#   secciones: {<seccion>: {...serializado...}},
+#   schema: SNAPSHOT_SCHEMA, version: <int, +1 por escritura>, synced_at
+# }
+# Se mantiene desde los crear_*/actualizar_* de cada service (misma sesión si hay).
+# Los borrados invalidan el snapshot; la siguiente lectura lo reconstruye.
+# Si una escritura del snapshot falla dentro de una transacción, el error se propaga
+# (se aborta junto con la escritura fuente); fuera de una transacción se invalida el
+# snapshot para que no quede sirviendo datos viejos.
+SNAPSHOT_SCHEMA = 1
+
+
+def _col():
+    return mongo.db.historial_snapshots
+
+def _log_warn(msg):
+    try:
+        current_app.logger.warning(f"[snapshots] {msg}")
+    except Exception:
+        pass
+
+def _oid(v):
+    if isinstance(v, ObjectId):
+        return v
+    try:
+        return ObjectId(v)
+    except Exception:
+        return None
+
+def _en_transaccion(session):
+    return session is not None and bool(getattr(session, "in_transaction", False))
+
+def _fallo(msg, error, h_oid=None, session=None):
+    """Error al escribir el snapshot: se propaga en transacción, si no se invalida."""
+    if _en_transaccion(session):
+        raise error
+    _log_warn(f"{msg}: {error}")
+    if h_oid is not None:
+        try:
+            _col().delete_one({"_id": h_oid})
+        except Exception as e:
+            _log_warn(f"no se pudo invalidar {h_oid}: {e}")
+
+def _meta():
+    return {"$set": {"synced_at": datetime.utcnow()}, "$inc": {"version": 1}}
+
+
+# ---------------- Escrituras ----------------
+def sincronizar_historial(doc_historial: dict, serializado: dict, session=None):
+    """Crea/actualiza la parte `historial` del snapshot (crear/actualizar/vincular historial)."""
+    try:
+        upd = _meta()
+        upd["$set"].update({
+            "paciente_id": doc_historial.get("paciente_id"),
+            "created_at": doc_historial.get("created_at"),
+            "numero_gesta": doc_historial.get("numero_gesta"),
+            "historial": serializado,
+        })
+        upd["$setOnInsert"] = {"schema": SNAPSHOT_SCHEMA, "secciones": {}}
+        _col().update_one({"_id": doc_historial["_id"]}, upd, upsert=True, session=session)
+    except Exception as e:
+        _fallo(f"no se pudo sincronizar historial {doc_historial.get('_id')}", e,
+               doc_historial.get("_id"), session)
+
+def sincronizar_seccion(nombre: str, historial_id, data: dict, solo_si_vigente=False, session=None):
+    """
+    Guarda la sección serializada `data` en el snapshot del historial.
+    - Al crear (solo_si_vigente=False): el documento nuevo es el más reciente; se escribe siempre.
+    - Al actualizar (solo_si_vigente=True): solo si el snapshot ya apunta a ese documento
+      (o la sección está vacía), para no pisar la versión más reciente con una antigua.
+    """
+    h_oid = _oid(historial_id)
+    if not h_oid or not data:
+        return
+    try:
+        filtro = {"_id": h_oid}
+        if solo_si_vigente:
+            filtro["$or"] = [{f"secciones.{nombre}.id": data.get("id")}, {f"secciones.{nombre}": None}]
+        upd = _meta()
+        upd["$set"][f"secciones.{nombre}"] = data
+        upd["$setOnInsert"] = {"schema": SNAPSHOT_SCHEMA}
+        _col().update_one(filtro, upd, upsert=not solo_si_vigente, session=session)
+    except Exception as e:
+        _fallo(f"no se pudo sincronizar {nombre} en {h_oid}", e, h_oid, session)
+
+def sincronizar_seccion_actualizada(nombre: str, doc: dict, data: dict, movido=False, session=None):
+    """
+    Tras un actualizar_*_por_id. Si el documento cambió de historial (`movido`),
+    se invalidan los snapshots que aún lo referencian.
+    """
+    if movido:
+        try:
+            _col().delete_many(
+                {f"secciones.{nombre}.id": data.get("id"), "_id": {"$ne": doc.get("historial_id")}},
+                session=session
+            )
+        except Exception as e:
+            _fallo(f"no se pudo invalidar {nombre} movido", e, session=session)
+    sincronizar_seccion(nombre, doc.get("historial_id"), data, solo_si_vigente=True, session=session)
+
+def invalidar(historial_id=None, paciente_id=None, session=None):
+    """Borra el/los snapshots afectados; la próxima lectura los reconstruye."""
+    try:
+        if historial_id is not None:
+            h_oid = _oid(historial_id)
+            if h_oid:
+                _col().delete_one({"_id": h_oid}, session=session)
+        if paciente_id is not None:
+            p_oid = _oid(paciente_id)
+            if p_oid:
+                _col().delete_many({"paciente_id": p_oid}, session=session)
+    except Exception as e:
+        _fallo(f"no se pudo invalidar ({historial_id}, {paciente_id})", e, session=session)
+
+
+# ---------------- Reconstrucción ----------------
+def construir(doc_historial: dict, serializado: dict, secciones: dict, version: int = 1):
+    """Snapshot completo a partir del historial y sus secciones ya serializadas (sin I/O)."""
+    return {
+        "_id": doc_historial["_id"],
+        "paciente_id": doc_historial.get("paciente_id"),
+        "created_at": doc_historial.get("created_at"),
+        "numero_gesta": doc_historial.get("numero_gesta"),
+        "historial": serializado,
+        "secciones": {k: v for k, v in secciones.items() if v is not None},
+        "schema": SNAPSHOT_SCHEMA,
+        "version": version,
+        "synced_at": datetime.utcnow(),
+    }
+
+def reconstruir(historial_id, session=None):
+    """
+    Rehace el snapshot completo desde las colecciones fuente (un $lookup).
+    Retorna el snapshot escrito, o None si el historial no existe.
+    """
+    # import diferido: service_historial_agregado importa los services de sección,
+    # que a su vez importan este módulo.
+    from app.services import service_historial_agregado as svc_agg
+    from app.services.service_historial import _serialize_historial
+
+    h_oid = _oid(historial_id)
+    if not h_oid:
+        return None
+    doc, secciones = svc_agg.obtener_agregado(h_oid)
+    if not doc:
+        invalidar(historial_id=h_oid, session=session)
+        return None
+
+    actual = _col().find_one({"_id": h_oid}, {"version": 1}, session=session) or {}
+    snap = construir(doc, _serialize_historial(doc), secciones, int(actual.get("version") or 0) + 1)
+    _col().replace_one({"_id": h_oid}, snap, upsert=True, session=session)
+    return snap
+
+def reconstruir_todos(lote: int = 200, desde_id=None, on_progress=None):
+    """Recorre historiales por _id y rehace sus snapshots. Retorna cuántos procesó."""
+    filtro = {"_id": {"$gt": _oid(desde_id)}} if desde_id else {}
+    n = 0
+    for h in mongo.db.historiales.find(filtro, {"_id": 1}).sort("_id", 1).batch_size(lote):
+        reconstruir(h["_id"])
+        n += 1
+        if on_progress and n % lote == 0:
+            on_progress(n, h["_id"])
+    return n
+
+
+# ---------------- Lectura ----------------
+def es_valido(snap: dict | None):
+    return bool(snap) and snap.get("schema") == SNAPSHOT_SCHEMA and bool(snap.get("historial"))
+
+def _proyeccion(secciones=None, campos=None):
+    if secciones is None and not campos:
+        return None
+    proj = {"paciente_id": 1, "historial": 1, "schema": 1, "version": 1, "synced_at": 1}
+    campos = campos or {}
+    for nombre in (secciones or []):
+        if campos.get(nombre):
+            proj[f"secciones.{nombre}.id"] = 1
+            for c in campos[nombre]:
+                proj[f"secciones.{nombre}.{c}"] = 1
+        else:
+            proj[f"secciones.{nombre}"] = 1
+    return proj
+
+def obtener(historial_id, secciones=None, campos=None):
+    """Un find_one por _id. Retorna el snapshot (proyectado) o None."""
+    h_oid = _oid(historial_id)
+    if not h_oid:
+        return None
+    return _col().find_one({"_id": h_oid}, _proyeccion(secciones, campos))
+
+def obtener_reciente_por_paciente(paciente_id, secciones=None, campos=None):
+    """
+    Snapshot del historial más reciente del paciente. El historial se resuelve en
+    `historiales` (find_one indexado, mismo orden que listar_historiales) y el
+    snapshot se lee por _id: un snapshot faltante o atrasado no hace que se sirva
+    otro historial. Retorna (historial_id, snapshot o None); (None, None) si el
+    paciente no tiene historiales.
+    """
+    p_oid = _oid(paciente_id)
+    if not p_oid:
+        return None, None
+    h = mongo.db.historiales.find_one(
+        {"paciente_id": p_oid}, {"_id": 1},
+        sort=[("created_at", -1), ("numero_gesta", -1), ("_id", -1)],
+    )
+    if not h:
+        return None, None
+    return h["_id"], obtener(h["_id"], secciones, campos)
+
+def meta(snap: dict):
+    """Datos de versión/staleness expuestos a los clientes."""
+    return {"version": snap.get("version"), "synced_at": snap.get("synced_at")}
@@ -1,6 +1,10 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import compilar, campo, booleano, entero, fecha_ymd, opcion, texto, object_id
 
 # ================== Helpers de respuesta ==================
 def _ok(data, code=200):
@@ -14,13 +18,26 @@ _ETNIA = {"blanca", "indigena", "mestiza", "negra", "otros"}
 _NIVEL = {"ninguno", "primaria", "secundaria", "universitaria"}
 _ESTADO_CIVIL = {"soltera", "casada", "union_estable", "divorciada", "viuda", "otro"}
 
-_REQUIRED = [
-    "nombres", "apellidos", "cedula",
-    "fecha_nacimiento", "edad", "etnia", "alfabeta",
-    "nivel_estudios", "anio_estudios", "estado_civil", "vive_sola",
-    "domicilio", "telefono", "localidad",
-    "establecimiento_salud", "lugar_parto",
-]
+# Esquema compilado una vez; lo comparten crear y actualizar (parcial=True).
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),   # apoyo/migración
+    campo("nombres", texto(), requerido=True),
+    campo("apellidos", texto(), requerido=True),
+    campo("cedula", texto(), requerido=True),
+    campo("fecha_nacimiento", fecha_ymd(), requerido=True),
+    campo("edad", entero(0), requerido=True),
+    campo("etnia", opcion(_ETNIA), requerido=True),
+    campo("alfabeta", booleano(), requerido=True),
+    campo("nivel_estudios", opcion(_NIVEL), requerido=True),
+    campo("anio_estudios", entero(0), requerido=True),
+    campo("estado_civil", opcion(_ESTADO_CIVIL), requerido=True),
+    campo("vive_sola", booleano(), requerido=True),
+    campo("domicilio", texto(), requerido=True),
+    campo("telefono", texto(), requerido=True),
+    campo("localidad", texto(), requerido=True),
+    campo("establecimiento_salud", texto(), requerido=True),
+    campo("lugar_parto", texto(), requerido=True),
+])
 
 # ================== Utilidades ==================
 def _to_oid(val, field):
@@ -29,52 +46,6 @@ def _to_oid(val, field):
     except Exception:
         raise ValueError(f"{field} no es un ObjectId válido")
 
-def _as_int(val, field, min_v=None, max_v=None):
-    try:
-        iv = int(val)
-    except Exception:
-        raise ValueError(f"{field} debe ser entero")
-    if (min_v is not None and iv < min_v) or (max_v is not None and iv > max_v):
-        raise ValueError(f"{field} fuera de rango")
-    return iv
-
-def _as_bool(val, field):
-    if isinstance(val, bool):
-        return val
-    if isinstance(val, (int, float)) and val in (0, 1):
-        return bool(val)
-    if isinstance(val, str) and val.lower() in ("true", "false"):
-        return val.lower() == "true"
-    raise ValueError(f"{field} debe ser booleano")
-
-def _as_date_ymd(s, field):
-    if not isinstance(s, str):
-        raise ValueError(f"{field} debe ser string (YYYY-MM-DD)")
-    try:
-        return datetime.strptime(s.strip(), "%Y-%m-%d")
-    except Exception:
-        raise ValueError(f"{field} debe tener formato YYYY-MM-DD")
-
-def _norm_enum(s, allowed, field):
-    if isinstance(s, str) and s.strip() in allowed:
-        return s.strip()
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(allowed))}")
-
-def _require(payload):
-    faltan = [k for k in _REQUIRED if k not in payload]
-    if faltan:
-        raise ValueError("Campos requeridos faltantes: " + ", ".join(faltan))
-
-def _ensure_indexes():
-    try:
-        mongo.db.identificacion.create_index("historial_id", name="ix_ident_historial")
-    except Exception:
-        pass
-    try:
-        mongo.db.identificacion.create_index("paciente_id", name="ix_ident_paciente")  # apoyo/migración
-    except Exception:
-        pass
-
 def _serialize(doc: dict):
     return {
         "id": str(doc["_id"]),
@@ -101,6 +72,19 @@ def _serialize(doc: dict):
         "updated_at": doc.get("updated_at"),
     }
 
+def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
+    if not usuario_actual or not usuario_actual.get("usuario_id"):
+        raise ValueError("usuario_actual.usuario_id es requerido")
+    h_oid = _to_oid(historial_id, "historial_id")
+    return {
+        "historial_id": h_oid,
+        "usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id"),
+        **_validar(payload),
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+
+
 # ================== Services (CRUD) ==================
 def crear_identificacion(
     historial_id: str,
@@ -110,7 +94,8 @@ def crear_identificacion(
 ):
     """
     Crea Identificación orquestada por historial_id (FK principal).
-    Requiere: historial_id (firma), usuario_actual.usuario_id y todos los campos en _REQUIRED.
+    Requiere: historial_id (firma), usuario_actual.usuario_id y el payload validado con
+    el esquema compilado `_validar` (todos los errores juntos en un 422).
     Opcional: paciente_id para apoyo/migración.
     """
     try:
@@ -118,43 +103,16 @@ def crear_identificacion(
             return _fail("JSON inválido", 400)
         if not historial_id:
             return _fail("historial_id es requerido", 422)
-        if not usuario_actual or not usuario_actual.get("usuario_id"):
-            return _fail("usuario_actual.usuario_id es requerido", 422)
-
-        _require(payload)
-        _ensure_indexes()
 
         h_oid = _to_oid(historial_id, "historial_id")
         # valida existencia del historial
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
-        doc = {
-            "historial_id": h_oid,
-            **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-               if payload.get("paciente_id") else {}),
-            "usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id"),
-            "nombres": str(payload["nombres"]).strip(),
-            "apellidos": str(payload["apellidos"]).strip(),
-            "cedula": str(payload["cedula"]).strip(),
-            "fecha_nacimiento": _as_date_ymd(payload["fecha_nacimiento"], "fecha_nacimiento"),
-            "edad": _as_int(payload["edad"], "edad", min_v=0),
-            "etnia": _norm_enum(payload["etnia"], _ETNIA, "etnia"),
-            "alfabeta": _as_bool(payload["alfabeta"], "alfabeta"),
-            "nivel_estudios": _norm_enum(payload["nivel_estudios"], _NIVEL, "nivel_estudios"),
-            "anio_estudios": _as_int(payload["anio_estudios"], "anio_estudios", min_v=0),
-            "estado_civil": _norm_enum(payload["estado_civil"], _ESTADO_CIVIL, "estado_civil"),
-            "vive_sola": _as_bool(payload["vive_sola"], "vive_sola"),
-            "domicilio": str(payload["domicilio"]).strip(),
-            "telefono": str(payload["telefono"]).strip(),
-            "localidad": str(payload["localidad"]).strip(),
-            "establecimiento_salud": str(payload["establecimiento_salud"]).strip(),
-            "lugar_parto": str(payload["lugar_parto"]).strip(),
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
-        }
+        doc = _build_doc(historial_id, payload, usuario_actual)
 
         res = mongo.db.identificacion.insert_one(doc, session=session) if session else mongo.db.identificacion.insert_one(doc)
+        svc_snap.sincronizar_seccion("identificacion", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -218,40 +176,26 @@ def actualizar_identificacion_por_id(ident_id: str, payload: dict, session=None)
         # FK principal: historial_id (validar si se cambia)
         if "historial_id" in upd and upd["historial_id"] is not None:
             h_oid = _to_oid(upd["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
 
-        # ids auxiliares
-        if "paciente_id" in upd and upd["paciente_id"]:
-            upd["paciente_id"] = _to_oid(upd["paciente_id"], "paciente_id")
         if "usuario_id" in upd and upd["usuario_id"]:
             upd["usuario_id"] = _to_oid(upd["usuario_id"], "usuario_id")
 
-        # fechas
-        if "fecha_nacimiento" in upd and upd["fecha_nacimiento"]:
-            upd["fecha_nacimiento"] = _as_date_ymd(upd["fecha_nacimiento"], "fecha_nacimiento")
-
-        # ints/bools
-        if "edad" in upd and upd["edad"] is not None:
-            upd["edad"] = _as_int(upd["edad"], "edad", min_v=0)
-        for b in ("alfabeta", "vive_sola"):
-            if b in upd and upd[b] is not None:
-                upd[b] = _as_bool(upd[b], b)
-
-        # enums
-        if "etnia" in upd and upd["etnia"]:
-            upd["etnia"] = _norm_enum(upd["etnia"], _ETNIA, "etnia")
-        if "nivel_estudios" in upd and upd["nivel_estudios"]:
-            upd["nivel_estudios"] = _norm_enum(upd["nivel_estudios"], _NIVEL, "nivel_estudios")
-        if "estado_civil" in upd and upd["estado_civil"]:
-            upd["estado_civil"] = _norm_enum(upd["estado_civil"], _ESTADO_CIVIL, "estado_civil")
+        # mismo esquema que al crear, solo con los campos enviados
+        upd.update(_validar(payload, parcial=True))
 
         upd["updated_at"] = datetime.utcnow()
 
-        res = mongo.db.identificacion.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.identificacion.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("Identificación no encontrada", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "identificacion", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Identificación actualizada"}, 200)
 
     except ValueError as ve:
@@ -270,25 +214,18 @@ def actualizar_identificacion_por_paciente(paciente_id: str, payload: dict, sess
 
         if "usuario_id" in upd and upd["usuario_id"]:
             upd["usuario_id"] = _to_oid(upd["usuario_id"], "usuario_id")
-        if "fecha_nacimiento" in upd and upd["fecha_nacimiento"]:
-            upd["fecha_nacimiento"] = _as_date_ymd(upd["fecha_nacimiento"], "fecha_nacimiento")
-        if "edad" in upd and upd["edad"] is not None:
-            upd["edad"] = _as_int(upd["edad"], "edad", min_v=0)
-        for b in ("alfabeta", "vive_sola"):
-            if b in upd and upd[b] is not None:
-                upd[b] = _as_bool(upd[b], b)
-        if "etnia" in upd and upd["etnia"]:
-            upd["etnia"] = _norm_enum(upd["etnia"], _ETNIA, "etnia")
-        if "nivel_estudios" in upd and upd["nivel_estudios"]:
-            upd["nivel_estudios"] = _norm_enum(upd["nivel_estudios"], _NIVEL, "nivel_estudios")
-        if "estado_civil" in upd and upd["estado_civil"]:
-            upd["estado_civil"] = _norm_enum(upd["estado_civil"], _ESTADO_CIVIL, "estado_civil")
+        upd.update(_validar(payload, parcial=True))
 
         upd["updated_at"] = datetime.utcnow()
 
-        res = mongo.db.identificacion.update_one(filtro, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.identificacion.find_one_and_update(
+            filtro, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("Identificación no encontrada para este paciente", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "identificacion", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Identificación actualizada"}, 200)
 
     except ValueError as ve:
@@ -300,9 +237,12 @@ def eliminar_identificacion_por_id(ident_id: str, session=None):
     """DELETE por _id."""
     try:
         oid = _to_oid(ident_id, "ident_id")
-        res = mongo.db.identificacion.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.identificacion.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("Identificación no encontrada", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Identificación eliminada"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -317,6 +257,8 @@ def eliminar_identificacion_por_historial(historial_id: str, session=None):
         if not doc:
             return _fail("Identificación no encontrada para este historial", 404)
         res = mongo.db.identificacion.delete_one({"_id": doc["_id"]}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(historial_id=doc.get("historial_id"), session=session)
         if res.deleted_count == 0:
             return _fail("No se pudo eliminar la identificación", 400)
         return _ok({"mensaje": "Identificación eliminada"}, 200)
@@ -330,6 +272,8 @@ def eliminar_identificacion_por_paciente(paciente_id: str, session=None):
     try:
         oid = _to_oid(paciente_id, "paciente_id")
         res = mongo.db.identificacion.delete_one({"paciente_id": oid}, session=session)
+        if res.deleted_count:
+            svc_snap.invalidar(paciente_id=oid, session=session)
         if res.deleted_count == 0:
             return _fail("Identificación no encontrada para este paciente", 404)
         return _ok({"mensaje": "Identificación eliminada"}, 200)
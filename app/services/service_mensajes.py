@@ -3,6 +3,7 @@ from typing import Optional, Tuple, Any, Dict
 
 from bson import ObjectId
 from app import mongo
+from app.utils import paginacion
 
 
 def _now() -> datetime:
@@ -100,25 +101,48 @@ def crear_mensaje(data: Dict[str, Any], *, session=None) -> Tuple[dict, int]:
     return {"ok": True, "data": {"id": str(res.inserted_id)} , "error": None}, 201
 
 
-def listar_mensajes(*, paciente_id: Optional[str] = None, page: int = 1, per_page: int = 20) -> Tuple[dict, int]:
+_ORDEN_LISTADO = [("created_at", -1), ("_id", -1)]
+
+
+def listar_mensajes(*, paciente_id: Optional[str] = None, page: int = 1, per_page: int = 20,
+                    after: Optional[str] = None, count: Optional[str] = None) -> Tuple[dict, int]:
     page = max(1, int(page or 1))
     per_page = max(1, min(100, int(per_page or 20)))
-    q: Dict[str, Any] = {"deleted": {"$ne": True}}
+    base: Dict[str, Any] = {"deleted": {"$ne": True}}
+    q: Dict[str, Any] = dict(base)
     if paciente_id:
         oid = _oid(paciente_id)
         if not oid:
             return {"ok": False, "data": None, "error": "paciente_id invalido"}, 422
         q["paciente_id"] = oid
 
-    cursor = mongo.db.mensajes.find(q).sort("created_at", -1).skip((page - 1) * per_page).limit(per_page)
-    items = [
-        _serialize(doc) for doc in cursor
-    ]
-    total = mongo.db.mensajes.count_documents(q)
-    data = {"items": items, "page": page, "per_page": per_page, "total": total}
+    try:
+        # Modo cursor: ?after=<next_cursor> (sin skip; sin count salvo que se pida)
+        if after is not None:
+            conteo = paginacion.parsear_conteo(count, default="none")
+            data = paginacion.paginar_keyset(mongo.db.mensajes, q, _ORDEN_LISTADO, per_page, after,
+                                             _serialize, conteo=conteo, base=base)
+        else:
+            conteo = paginacion.parsear_conteo(count)
+            data = paginacion.paginar_offset(mongo.db.mensajes, q, _ORDEN_LISTADO, page, per_page,
+                                             _serialize, conteo=conteo, base=base)
+    except ValueError as ve:
+        return {"ok": False, "data": None, "error": str(ve)}, 422
     return {"ok": True, "data": data, "error": None}, 200
 
 
+def iterar_mensajes(*, paciente_id: Optional[str] = None, batch_size: int = 500):
+    """Mismo filtro y orden que listar_mensajes, sin paginar (NDJSON). ValueError si paciente_id no es válido."""
+    base: Dict[str, Any] = {"deleted": {"$ne": True}}
+    q: Dict[str, Any] = dict(base)
+    if paciente_id:
+        oid = _oid(paciente_id)
+        if not oid:
+            raise ValueError("paciente_id invalido")
+        q["paciente_id"] = oid
+    return paginacion.iterar(mongo.db.mensajes, q, _ORDEN_LISTADO, _serialize, batch_size=batch_size)
+
+
 def marcar_leido(mensaje_id: str, *, session=None) -> Tuple[dict, int]:
     oid = _oid(mensaje_id)
     if not oid:
@@ -1,8 +1,12 @@
 from datetime import datetime
+import difflib
 import re
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
 from flask import current_app
 from app import mongo
+from app.db import identity_map, counters
+from app.utils import paginacion, busqueda
 
 # (opcional) importación del servicio de historiales para agregados
 try:
@@ -46,21 +50,6 @@ def _parse_date_ymd(s, field):
 def _norm_upper(s):
     return s.strip().upper() if isinstance(s, str) else s
 
-def _ensure_indexes():
-    try:
-        mongo.db.paciente.create_index([("tipo_identificacion", 1), ("numero_identificacion", 1)], unique=True, name="uq_tipo_num_identificacion")
-    except Exception:
-        pass
-    try:
-        mongo.db.paciente.create_index("codigo_expediente", unique=True, name="uq_codigo_expediente")
-    except Exception:
-        pass
-    try:
-        mongo.db.paciente.create_index("historial_id", name="ix_historial_id")  # no-único, opcional
-    except Exception:
-        pass
-
-
 def _validar_tipo_identificacion(tipo):
     if not isinstance(tipo, str):
         raise ValueError("tipo_identificacion es requerido")
@@ -177,6 +166,38 @@ def _generar_codigo_expediente(nombre, apellido, fecha_nac_dt: datetime,
         raise ValueError("No se pudo formar codigo_expediente válido")
     return codigo
 
+def _prefijo_expediente(nombre, apellido, fecha_nac_dt: datetime,
+                        sexo: str | None = None, municipio_codigo: str | None = None) -> str:
+    """MMM + IIII + S + DDMMAA (el código sin los 2 dígitos de control)."""
+    return _generar_codigo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo, 0)[:-2]
+
+def _asignar_codigo_expediente(nombre, apellido, fecha_nac_dt: datetime,
+                               sexo: str | None = None, municipio_codigo: str | None = None) -> str | None:
+    """
+    Asigna el siguiente dígito de control libre del prefijo con un $inc atómico
+    en counters (clave expediente:<prefijo>). La primera vez que se usa un prefijo
+    el contador se siembra con el mayor control ya existente en paciente.
+    Va fuera de la transacción del alta (sin session): dentro, dos altas concurrentes
+    del mismo prefijo chocan en el contador (write conflict) y una aborta. Si el alta
+    falla después, ese control queda sin usar (un hueco, no un duplicado).
+    Retorna None si el prefijo agotó sus 100 controles.
+    """
+    prefijo = _prefijo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo)
+
+    def _semilla():
+        # regex anclado: recorre solo el rango del prefijo en uq_codigo_expediente
+        ultimo = mongo.db.paciente.find_one(
+            {"codigo_expediente": {"$regex": f"^{prefijo}\\d{{2}}$"}},
+            {"codigo_expediente": 1},
+            sort=[("codigo_expediente", -1)],
+        )
+        return int(ultimo["codigo_expediente"][-2:]) + 1 if ultimo else 0
+
+    control = counters.siguiente(f"expediente:{prefijo}", semilla=_semilla) - 1
+    if control > 99:
+        return None
+    return _generar_codigo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo, control)
+
 def _serialize(doc: dict):
     return {
         "id": str(doc["_id"]),
@@ -198,6 +219,25 @@ def _serialize(doc: dict):
         "updated_at": (doc.get("updated_at").isoformat() if isinstance(doc.get("updated_at"), datetime) else doc.get("updated_at")),
     }
 
+# ---------------- Búsqueda ----------------
+# Campos que alimentan busqueda_claves (ver app.utils.busqueda)
+_CAMPOS_BUSQUEDA = ("nombre", "apellido", "numero_identificacion", "codigo_expediente")
+_BUSQUEDA_CANDIDATOS = 200   # tope de documentos que se rankean por consulta
+
+def _claves_busqueda(doc: dict) -> list:
+    nombre_completo = f"{doc.get('nombre') or ''} {doc.get('apellido') or ''}"
+    claves = busqueda.claves_nombre(nombre_completo, _ARTICULOS)
+    claves |= busqueda.claves_identificador(doc.get("numero_identificacion"))
+    claves |= busqueda.claves_identificador(doc.get("codigo_expediente"))
+    return sorted(claves)
+
+def _filtro_busqueda(q: str):
+    """{"busqueda_claves": {"$all": [...]}}, las claves exactas para rankear, o (None, None)."""
+    requeridas, exactas = busqueda.consulta(q, _ARTICULOS)
+    if not requeridas:
+        return None, None
+    return {"busqueda_claves": {"$all": requeridas}}, exactas
+
 # ---------------- Services ----------------
 def buscar_paciente_por_identificacion(tipo_identificacion: str, numero_identificacion: str):
     try:
@@ -227,8 +267,6 @@ def crear_paciente(payload: dict, session=None):
         if not isinstance(payload, dict):
             return _fail("JSON inválido", 400)
 
-        _ensure_indexes()
-
         nombre   = _validar_min_nonempty(payload.get("nombre"), "nombre")
         apellido = _validar_min_nonempty(payload.get("apellido"), "apellido")
         tipo_identificacion = _validar_tipo_identificacion(payload.get("tipo_identificacion"))
@@ -248,14 +286,9 @@ def crear_paciente(payload: dict, session=None):
         municipio_codigo = payload.get("municipio_codigo")
         sexo = (payload.get("sexo") or "F").upper()
 
-        # Generar codigo_expediente único
-        control = 0
-        while control <= 99:
-            codigo = _generar_codigo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo, control)
-            if not mongo.db.paciente.find_one({"codigo_expediente": codigo}):
-                break
-            control += 1
-        if control > 99:
+        # Generar codigo_expediente único (contador atómico por prefijo)
+        codigo = _asignar_codigo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo)
+        if not codigo:
             return _fail("No se pudo generar un codigo_expediente único (CC agotado)", 400)
 
         # historial_id opcional
@@ -263,7 +296,7 @@ def crear_paciente(payload: dict, session=None):
         if payload.get("historial_id") not in (None, "",):
             historial_oid = _to_oid(payload.get("historial_id"), "historial_id")
             # Validar existencia del historial (FK suave)
-            if not mongo.db.historiales.find_one({"_id": historial_oid}):
+            if not identity_map.obtener_por_id("historiales", historial_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
 
         doc = {
@@ -278,12 +311,14 @@ def crear_paciente(payload: dict, session=None):
             "bairro": bairro,
             "gesta_actual": gesta_actual,
             "activo": True,
+            "gesta_seq": 0,  # contador de numero_gesta (ver asignar_numero_gesta)
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow(),
         }
 
         if historial_oid is not None:
             doc["historial_id"] = historial_oid  # solo guardar si existe
+        doc["busqueda_claves"] = _claves_busqueda(doc)
 
         ce = payload.get("contacto_emergencia")
         if isinstance(ce, dict):
@@ -298,6 +333,7 @@ def crear_paciente(payload: dict, session=None):
 
         res = (mongo.db.paciente.insert_one(doc, session=session)
                if session else mongo.db.paciente.insert_one(doc))
+        identity_map.registrar("paciente", doc)
         return _ok({"id": str(res.inserted_id), "codigo_expediente": codigo}, 201)
 
     except ValueError as ve:
@@ -329,7 +365,7 @@ def actualizar_paciente_por_id(paciente_id: str, payload: dict, session=None):
         def _obtener_doc_actual():
             nonlocal doc_actual
             if doc_actual is None:
-                doc_actual = mongo.db.paciente.find_one({"_id": oid})
+                doc_actual = identity_map.obtener_por_id("paciente", oid, session=session)
             return doc_actual
 
         if "historial_id" in payload:
@@ -338,7 +374,7 @@ def actualizar_paciente_por_id(paciente_id: str, payload: dict, session=None):
                 upd["historial_id"] = None
             else:
                 h_oid = _to_oid(h, "historial_id")
-                if not mongo.db.historiales.find_one({"_id": h_oid}):
+                if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                     return _fail("historial_id no encontrado en historiales", 404)
                 upd["historial_id"] = h_oid
 
@@ -407,24 +443,33 @@ def actualizar_paciente_por_id(paciente_id: str, payload: dict, session=None):
             sexo = (payload.get("sexo") or "F").upper()
             municipio_codigo = payload.get("municipio_codigo") or "800"
 
-            control = 0
-            while control <= 99:
-                codigo = _generar_codigo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo, control)
-                existe = mongo.db.paciente.find_one({"codigo_expediente": codigo, "_id": {"$ne": oid}})
-                if not existe:
-                    upd["codigo_expediente"] = codigo
-                    break
-                control += 1
-            if "codigo_expediente" not in upd:
-                return _fail("No se pudo generar un codigo_expediente único", 400)
+            prefijo = _prefijo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo)
+            codigo_actual = doc_actual.get("codigo_expediente") or ""
+            if codigo_actual.startswith(prefijo) and _RE_EXPED.match(codigo_actual):
+                pass  # el código vigente ya corresponde a estos datos
+            else:
+                codigo = _asignar_codigo_expediente(nombre, apellido, fecha_nac_dt, sexo, municipio_codigo)
+                if not codigo:
+                    return _fail("No se pudo generar un codigo_expediente único", 400)
+                upd["codigo_expediente"] = codigo
 
         if not upd:
             return _ok({"mensaje": "Nada para actualizar"}, 200)
 
+        if any(k in upd for k in _CAMPOS_BUSQUEDA):
+            base = _obtener_doc_actual()
+            if not base:
+                return _fail("Paciente no encontrado", 404)
+            upd["busqueda_claves"] = _claves_busqueda({**base, **upd})
+
         upd["updated_at"] = datetime.utcnow()
-        res = mongo.db.paciente.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        doc = mongo.db.paciente.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not doc:
+            identity_map.invalidar("paciente", oid)
             return _fail("Paciente no encontrado", 404)
+        identity_map.registrar("paciente", doc)
         return _ok({"mensaje": "Paciente actualizado"}, 200)
 
     except ValueError as ve:
@@ -435,9 +480,73 @@ def actualizar_paciente_por_id(paciente_id: str, payload: dict, session=None):
         return _fail("Error al actualizar paciente", 400)
 
 
+def asignar_numero_gesta(paciente_id: str, numero_gesta=None, session=None):
+    """
+    numero_gesta para un historial nuevo, desde el contador `gesta_seq` del paciente:
+    un $inc atómico dentro de la transacción de creación, sin leer historiales.
+      - numero_gesta explícito: se respeta y el contador sube a ese valor ($max).
+      - Pacientes anteriores al contador se siembran una vez con el mayor
+        numero_gesta existente en historiales.
+    """
+    try:
+        oid = _to_oid(paciente_id, "paciente_id")
+
+        def _sembrar():
+            ultimo = mongo.db.historiales.find_one(
+                {"paciente_id": oid}, {"numero_gesta": 1},
+                sort=[("numero_gesta", -1)], session=session
+            )
+            try:
+                maximo = int((ultimo or {}).get("numero_gesta") or 0)
+            except Exception:
+                maximo = 0
+            res = mongo.db.paciente.update_one(
+                {"_id": oid, "gesta_seq": {"$exists": False}},
+                {"$set": {"gesta_seq": maximo}}, session=session
+            )
+            if res.matched_count == 0 and not mongo.db.paciente.find_one({"_id": oid}, {"_id": 1}, session=session):
+                raise LookupError("Paciente no encontrado")
+
+        if numero_gesta not in (None, "", 0):
+            try:
+                n = int(numero_gesta)
+            except Exception:
+                n = 0
+            if n < 1:
+                raise ValueError("numero_gesta debe ser entero >= 1")
+            if not mongo.db.paciente.find_one({"_id": oid, "gesta_seq": {"$exists": True}}, {"_id": 1}, session=session):
+                _sembrar()
+            mongo.db.paciente.update_one({"_id": oid}, {"$max": {"gesta_seq": n}}, session=session)
+            identity_map.invalidar("paciente", oid)
+            return _ok({"numero_gesta": n}, 200)
+
+        doc = None
+        for _ in range(2):
+            doc = mongo.db.paciente.find_one_and_update(
+                {"_id": oid, "gesta_seq": {"$exists": True}},
+                {"$inc": {"gesta_seq": 1}},
+                projection={"gesta_seq": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            if doc:
+                break
+            _sembrar()
+        identity_map.invalidar("paciente", oid)
+        return _ok({"numero_gesta": int(doc["gesta_seq"])}, 200)
+
+    except LookupError as le:
+        return _fail(str(le), 404)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception:
+        return _fail("Error al asignar numero_gesta", 400)
+
+
 def eliminar_paciente_por_id(paciente_id: str, hard: bool = False, session=None):
     try:
         oid = _to_oid(paciente_id, "paciente_id")
+        identity_map.invalidar("paciente", oid)
         if hard:
             res = mongo.db.paciente.delete_one({"_id": oid}, session=session)
             if res.deleted_count == 0:
@@ -453,35 +562,191 @@ def eliminar_paciente_por_id(paciente_id: str, hard: bool = False, session=None)
     except Exception:
         return _fail("Error al eliminar paciente", 400)
 
-def listar_pacientes(q: str | None = None, page: int = 1, per_page: int = 20, solo_activos: bool = True):
+_ORDEN_LISTADO = [("created_at", -1)]
+_SIN_CLAVES = {"busqueda_claves": 0}
+
+def listar_pacientes(q: str | None = None, page: int = 1, per_page: int = 20, solo_activos: bool = True,
+                     after: str | None = None, count: str | None = None):
+    """
+    Listado ordenado por created_at desc (_id desc como desempate).
+    - Modo page/per_page (compat): skip + total.
+    - Modo cursor (after no None): ?after=<next_cursor> de la respuesta anterior, sin skip.
+    - q: prefijos de nombre/apellido o identificación/expediente (índice busqueda_claves);
+      para resultados rankeados usar buscar_pacientes.
+    - count: exact (defecto en page) | estimated | none (defecto en cursor).
+    """
     try:
         page = max(int(page or 1), 1)
         per_page = max(min(int(per_page or 20), 100), 1)
 
-        filtro = {}
-        if solo_activos:
-            filtro["activo"] = True
+        base = {"activo": True} if solo_activos else {}
+        filtro = dict(base)
 
         if q and isinstance(q, str) and q.strip():
-            rx = {"$regex": re.escape(q.strip()), "$options": "i"}
-            filtro["$or"] = [
-                {"nombre": rx},
-                {"apellido": rx},
-                {"numero_identificacion": rx},
-                {"codigo_expediente": rx},
-            ]
-
-        total = mongo.db.paciente.count_documents(filtro)
-        cursor = (mongo.db.paciente.find(filtro)
-                  .sort("created_at", -1)
-                  .skip((page - 1) * per_page)
-                  .limit(per_page))
-        items = [_serialize(d) for d in cursor]
-        return _ok({"items": items, "page": page, "per_page": per_page, "total": total}, 200)
+            filtro_q, _ = _filtro_busqueda(q)
+            if filtro_q is None:
+                return _ok({"items": [], "page": page, "per_page": per_page, "total": 0,
+                            "has_more": False, "next_cursor": None}, 200)
+            filtro.update(filtro_q)
+
+        if after is not None:
+            conteo = paginacion.parsear_conteo(count, default="none")
+            data = paginacion.paginar_keyset(mongo.db.paciente, filtro, _ORDEN_LISTADO, per_page, after,
+                                             _serialize, proyeccion=_SIN_CLAVES, conteo=conteo, base=base)
+            return _ok(data, 200)
+
+        conteo = paginacion.parsear_conteo(count)
+        data = paginacion.paginar_offset(mongo.db.paciente, filtro, _ORDEN_LISTADO, page, per_page,
+                                         _serialize, conteo=conteo, proyeccion=_SIN_CLAVES, base=base)
+        return _ok(data, 200)
 
+    except ValueError as ve:
+        return _fail(str(ve), 422)
     except Exception:
         return _fail("Error al listar pacientes", 400)
 
+def iterar_pacientes(q: str | None = None, solo_activos: bool = True, batch_size: int = 500):
+    """
+    Mismo filtro y orden que listar_pacientes, sin paginar (NDJSON). Lanza ValueError
+    si q no es válido; retorna un iterable perezoso de pacientes serializados.
+    """
+    filtro = {}
+    if solo_activos:
+        filtro["activo"] = True
+    if q and isinstance(q, str) and q.strip():
+        filtro_q, _ = _filtro_busqueda(q)
+        if filtro_q is None:
+            return iter(())
+        filtro.update(filtro_q)
+    return paginacion.iterar(mongo.db.paciente, filtro, _ORDEN_LISTADO, _serialize,
+                             proyeccion=_SIN_CLAVES, batch_size=batch_size)
+
+def buscar_pacientes(q: str, limit: int = 10, solo_activos: bool = True):
+    """
+    Búsqueda rankeada para recepción. Filtra por busqueda_claves ($all de prefijos,
+    con índice), puntúa TODOS los que coinciden y ordena por:
+      nº de tokens que coinciden completos (o identificador exacto) desc, apellido, nombre.
+    El $sort seguido de $limit se resuelve como top-k (memoria acotada a `limit`):
+    cortar antes de puntuar dejaba fuera coincidencias exactas cuando el prefijo es común.
+    Cada item lleva "score".
+    """
+    try:
+        limit = max(min(int(limit or 10), 50), 1)
+        if not isinstance(q, str) or not q.strip():
+            raise ValueError("q es requerido")
+
+        filtro, exactas = _filtro_busqueda(q)
+        if filtro is None:
+            return _ok({"items": [], "q": q}, 200)
+        if solo_activos:
+            filtro["activo"] = True
+
+        pipeline = [
+            {"$match": filtro},
+            {"$addFields": {"_score": {"$size": {"$setIntersection": ["$busqueda_claves", exactas]}}}},
+            {"$sort": {"_score": -1, "apellido": 1, "nombre": 1, "_id": 1}},
+            {"$limit": limit},
+            {"$project": {"busqueda_claves": 0}},
+        ]
+        items = []
+        for d in mongo.db.paciente.aggregate(pipeline):
+            item = _serialize(d)
+            item["score"] = d.get("_score", 0)
+            items.append(item)
+        return _ok({"items": items, "q": q}, 200)
+
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception:
+        return _fail("Error al buscar pacientes", 400)
+
+def buscar_pacientes_fonetico(q: str, limit: int = 10, solo_activos: bool = True):
+    """
+    Búsqueda tolerante a tildes y errores de tipeo por nombre/apellido usando las
+    claves F:<código fonético> de busqueda_claves (índice multikey, sin scans).
+    Los que contienen ALGUNA clave fonética de la consulta se puntúan en Mongo
+    (claves fonéticas coincidentes, luego tokens exactos) y solo los mejores
+    _BUSQUEDA_CANDIDATOS pasan a rankearse por claves coincidentes y similitud del
+    texto normalizado (difflib).
+    """
+    try:
+        limit = max(min(int(limit or 10), 50), 1)
+        if not isinstance(q, str) or not q.strip():
+            raise ValueError("q es requerido")
+
+        claves_q = sorted(busqueda.claves_foneticas(q, _ARTICULOS))
+        if not claves_q:
+            return _ok({"items": [], "q": q}, 200)
+
+        filtro = {"busqueda_claves": {"$in": claves_q}}
+        if solo_activos:
+            filtro["activo"] = True
+        exactas = [f"T:{t}" for t in busqueda.tokens(q, _ARTICULOS)]
+        # puntuar en Mongo ANTES de cortar: los que tienen todas las claves fonéticas
+        # (y luego más tokens exactos) entran primero a los candidatos
+        pipeline = [
+            {"$match": filtro},
+            {"$addFields": {
+                "_hits": {"$size": {"$setIntersection": ["$busqueda_claves", claves_q]}},
+                "_exactas": {"$size": {"$setIntersection": ["$busqueda_claves", exactas]}},
+            }},
+            {"$sort": {"_hits": -1, "_exactas": -1, "apellido": 1, "nombre": 1, "_id": 1}},
+            {"$limit": _BUSQUEDA_CANDIDATOS},
+            {"$project": {"busqueda_claves": 0}},
+        ]
+        candidatos = list(mongo.db.paciente.aggregate(pipeline))
+
+        q_norm = " ".join(busqueda.tokens(q, _ARTICULOS))
+        puntuados = []
+        for d in candidatos:
+            hits = d.pop("_hits", 0)
+            d.pop("_exactas", None)
+            nombre = " ".join(busqueda.tokens(f"{d.get('nombre') or ''} {d.get('apellido') or ''}", _ARTICULOS))
+            similitud = difflib.SequenceMatcher(None, q_norm, nombre).ratio()
+            puntuados.append((hits, similitud, d))
+        puntuados.sort(key=lambda x: (-x[0], -x[1], str(x[2].get("apellido") or "")))
+
+        items = []
+        for hits, similitud, d in puntuados[:limit]:
+            item = _serialize(d)
+            item["score"] = round(hits / len(claves_q) * 0.6 + similitud * 0.4, 3)
+            items.append(item)
+        return _ok({"items": items, "q": q}, 200)
+
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception:
+        return _fail("Error al buscar pacientes", 400)
+
+def reindexar_busqueda(lote: int = 500, on_progress=None, solo_faltantes: bool = False):
+    """
+    Recalcula busqueda_claves de todos los pacientes. Retorna cuántos.
+    solo_faltantes=True: solo los que aún no la tienen (pacientes anteriores a la
+    búsqueda indexada, que si no, no aparecen en listar/buscar ni en los hints de
+    mensajes). Es lo que corre create_app al arrancar (BUSQUEDA_BACKFILL_ON_STARTUP);
+    una vez completo, la consulta no devuelve nada y no cuesta.
+    """
+    n = 0
+    ops = []
+    campos = {c: 1 for c in _CAMPOS_BUSQUEDA}
+    if solo_faltantes:
+        # sin sort: el planner recorre solo los faltantes por ix_busqueda_claves
+        cursor = mongo.db.paciente.find({"busqueda_claves": {"$exists": False}}, campos)
+    else:
+        cursor = mongo.db.paciente.find({}, campos).sort("_id", 1)
+    for d in cursor.batch_size(lote):
+        ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {"busqueda_claves": _claves_busqueda(d)}}))
+        if len(ops) >= lote:
+            mongo.db.paciente.bulk_write(ops, ordered=False)
+            n += len(ops)
+            ops = []
+            if on_progress:
+                on_progress(n)
+    if ops:
+        mongo.db.paciente.bulk_write(ops, ordered=False)
+        n += len(ops)
+    return n
+
 def obtener_paciente(paciente_id: str):
     """
     Retorna el paciente y, si está disponible `service_historial`,
@@ -489,7 +754,7 @@ def obtener_paciente(paciente_id: str):
     """
     try:
         oid = _to_oid(paciente_id, "paciente_id")
-        doc = mongo.db.paciente.find_one({"_id": oid})
+        doc = identity_map.obtener_por_id("paciente", oid)
         if not doc:
             return _fail("Paciente no encontrado", 404)
 
@@ -1,6 +1,13 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map, series
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import (
+    ErrorValidacion, compilar, campo, booleano, entero, fecha_ymd, fecha_hora, opcion, texto,
+    object_id, objeto, lista, lista_de,
+)
 
 # ================== helpers de respuesta ==================
 def _ok(data, code=200):   return {"ok": True,  "data": data, "error": None}, code
@@ -40,51 +47,6 @@ def _as_int(v, field, lo=None, hi=None):
         raise ValueError(f"{field} fuera de rango [{lo}, {hi}]")
     return x
 
-def _as_bool(v, field):
-    if isinstance(v, bool):
-        return v
-    if isinstance(v, str) and v in _SI_NO:
-        return v == "Si"
-    if isinstance(v, (int, float)) and v in (0, 1):
-        return bool(v)
-    raise ValueError(f"{field} debe ser booleano o 'Si'/'No'")
-
-def _norm_enum(v, allowed, field):
-    if isinstance(v, str) and v in allowed:
-        return v
-    raise ValueError(f"{field} inválido. Use uno de: {', '.join(sorted(allowed))}")
-
-def _as_datetime_iso(s, field, fmt="%Y-%m-%dT%H:%M"):
-    if not isinstance(s, str):
-        raise ValueError(f"{field} debe ser string con formato {fmt}")
-    try:
-        return datetime.strptime(s, fmt)
-    except Exception:
-        raise ValueError(f"{field} debe tener formato {fmt}")
-
-def _as_date_ymd(s, field):
-    if not isinstance(s, str):
-        raise ValueError(f"{field} debe ser string 'YYYY-MM-DD'")
-    try:
-        return datetime.strptime(s, "%Y-%m-%d")
-    except Exception:
-        raise ValueError(f"{field} debe tener formato YYYY-MM-DD")
-
-def _require(payload, fields):
-    faltan = [k for k in fields if k not in payload]
-    if faltan:
-        raise ValueError("Campos requeridos faltantes: " + ", ".join(faltan))
-
-def _ensure_indexes():
-    try:
-        mongo.db.parto_aborto.create_index("historial_id", name="ix_pa_historial")
-    except Exception:
-        pass
-    try:
-        mongo.db.parto_aborto.create_index("paciente_id", name="ix_pa_paciente")  # compat
-    except Exception:
-        pass
-
 def _serialize(doc):
     return {
         "id": str(doc["_id"]),
@@ -127,134 +89,136 @@ def _serialize(doc):
         "updated_at": doc.get("updated_at"),
     }
 
-# ================== construcción del documento ==================
-_REQ_TOP = [
-    "tipo_evento","fecha_ingreso","carne_perinatal","consultas_prenatales","lugar_parto",
-    "hospitalizacion_embarazo","corticoides_antenatales","inicio_parto","ruptura_membrana",
-    "edad_gestacional_parto","presentacion","tamano_fetal_acorde","acompanante",
-    "acompanamiento_solicitado_usuaria","nacimiento","fecha_hora_nacimiento",
-    "nacimiento_multiple","orden_nacimiento","terminacion_parto","posicion_parto","episiotomia",
-    "desgarros","oxitocicos_pre","oxitocicos_post","placenta_expulsada","ligadura_cordon",
-    "medicacion_recibida","indicacion_principal_induccion_operacion","induccion","operacion",
-    "partograma_usado"
-]
+# ================== esquema (compilado una vez al importar) ==================
+# Compartido por crear (validar(payload)) y actualizar (validar(payload, parcial=True)).
+_FORMATO_FECHA_HORA = ("%Y-%m-%dT%H:%M",)
+_booleano = booleano()
 
-def _build_rpm(rpm: dict):
-    _require(rpm, ["hubo"])
-    dto = {"hubo": _norm_enum(rpm["hubo"], _SI_NO, "ruptura_membrana.hubo")}
-    if dto["hubo"] == "Si":
-        _require(rpm, ["fecha_inicio", "hora_inicio"])
-        fi = rpm["fecha_inicio"]; hi = rpm["hora_inicio"]
-        _require(fi, ["dia","mes","anio"]); _require(hi, ["hora","minuto"])
-        dto.update({
-            "fecha_inicio": {
-                "dia": _as_int(fi["dia"], "ruptura_membrana.fecha_inicio.dia", 1, 31),
-                "mes": _as_int(fi["mes"], "ruptura_membrana.fecha_inicio.mes", 1, 12),
-                "anio": _as_int(fi["anio"], "ruptura_membrana.fecha_inicio.anio", 1900),
-            },
-            "hora_inicio": {
-                "hora": _as_int(hi["hora"], "ruptura_membrana.hora_inicio.hora", 0, 23),
-                "minuto": _as_int(hi["minuto"], "ruptura_membrana.hora_inicio.minuto", 0, 59),
-            },
-            "antes_37_semanas": _as_bool(rpm.get("antes_37_semanas", False), "ruptura_membrana.antes_37_semanas"),
-            "duracion_ruptura_18h_omas": _as_bool(rpm.get("duracion_ruptura_18h_omas", False), "ruptura_membrana.duracion_ruptura_18h_omas"),
-            "temperatura_mayor_38": _as_bool(rpm.get("temperatura_mayor_38", False), "ruptura_membrana.temperatura_mayor_38"),
-        })
-    return dto
-
-def _build_medicacion(med: dict):
-    def _opt(name):
-        v = med.get(name, "No")
-        return _norm_enum(v, _SI_NO, f"medicacion_recibida.{name}")
-    return {
-        "oxitocicos": _opt("oxitocicos"),
-        "antibiotico": _opt("antibiotico"),
-        "analgesia": _opt("analgesia"),
-        "anestesia_local": _opt("anestesia_local"),
-        "anestesia_general": _opt("anestesia_general"),
-        "anestesia_regional": _opt("anestesia_regional"),
-        "transfusion": _opt("transfusion"),
-        "otros": str(med.get("otros", "")).strip() if med.get("otros") else "",
-    }
+def _bool_si_no(v):
+    """Booleano o 'Si'/'No' como en el formulario."""
+    if isinstance(v, str) and v in _SI_NO:
+        return v == "Si"
+    try:
+        return _booleano(v)
+    except ValueError:
+        raise ValueError("debe ser booleano o 'Si'/'No'")
+
+_ruptura_base = objeto([
+    campo("hubo", opcion(_SI_NO), requerido=True),
+    campo("fecha_inicio", objeto([
+        campo("dia", entero(1, 31), requerido=True),
+        campo("mes", entero(1, 12), requerido=True),
+        campo("anio", entero(1900), requerido=True),
+    ])),
+    campo("hora_inicio", objeto([
+        campo("hora", entero(0, 23), requerido=True),
+        campo("minuto", entero(0, 59), requerido=True),
+    ])),
+    campo("antes_37_semanas", _bool_si_no, ausente=False),
+    campo("duracion_ruptura_18h_omas", _bool_si_no, ausente=False),
+    campo("temperatura_mayor_38", _bool_si_no, ausente=False),
+])
+
+def _ruptura_membrana(v):
+    """Con hubo = 'Si' exige fecha_inicio y hora_inicio; si no, solo guarda hubo."""
+    rpm = _ruptura_base(v)
+    if rpm["hubo"] != "Si":
+        return {"hubo": rpm["hubo"]}
+    faltan = [c for c in ("fecha_inicio", "hora_inicio") if c not in rpm]
+    if faltan:
+        raise ErrorValidacion([(f".{c}", None) for c in faltan])
+    return rpm
+
+_desgarros_base = objeto([
+    campo("hubo", opcion(_SI_NO), requerido=True),
+    campo("grado", entero(1, 4)),
+])
+
+def _desgarros(v):
+    """grado (1-4) obligatorio solo con hubo = 'Si'; si no, None."""
+    dg = _desgarros_base(v)
+    if dg["hubo"] != "Si":
+        return {"hubo": dg["hubo"], "grado": None}
+    if "grado" not in dg:
+        raise ErrorValidacion([(".grado", None)])
+    return dg
+
+_ESQUEMA_PARTOGRAMA = [
+    campo("hora", entero(0, 23), requerido=True),
+    campo("minuto", entero(0, 59), requerido=True),
+    campo("posicion_madre", texto(strip=False), requerido=True),
+    campo("pa", texto(strip=False), requerido=True),
+    campo("pulso", entero(0), requerido=True),
+    campo("contracciones", entero(0), requerido=True),
+    campo("dilatacion", texto(strip=False), requerido=True),
+    campo("altura_presentacion", texto(strip=False), requerido=True),
+    campo("variedad_posicion", texto(strip=False), requerido=True),
+    campo("meconio", _bool_si_no, requerido=True),
+    campo("fcf_dips", _bool_si_no, requerido=True),
+]
 
-def _build_partograma(items):
-    if not items:
-        return []
-    out = []
-    for i, it in enumerate(items):
-        _require(it, ["hora","minuto","posicion_madre","pa","pulso","contracciones",
-                      "dilatacion","altura_presentacion","variedad_posicion","meconio","fcf_dips"])
-        out.append({
-            "hora": _as_int(it["hora"], f"partograma_detalle[{i}].hora", 0, 23),
-            "minuto": _as_int(it["minuto"], f"partograma_detalle[{i}].minuto", 0, 59),
-            "posicion_madre": str(it["posicion_madre"]),
-            "pa": str(it["pa"]),
-            "pulso": _as_int(it["pulso"], f"partograma_detalle[{i}].pulso", 0),
-            "contracciones": _as_int(it["contracciones"], f"partograma_detalle[{i}].contracciones", 0),
-            "dilatacion": str(it["dilatacion"]),
-            "altura_presentacion": str(it["altura_presentacion"]),
-            "variedad_posicion": str(it["variedad_posicion"]),
-            "meconio": _as_bool(it["meconio"], f"partograma_detalle[{i}].meconio"),
-            "fcf_dips": _as_bool(it["fcf_dips"], f"partograma_detalle[{i}].fcf_dips"),
-        })
-    return out
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),          # compat
+    campo("tipo_evento", opcion(_TIPO_EVENTO), requerido=True),
+    campo("fecha_ingreso", fecha_ymd(), requerido=True),
+    campo("carne_perinatal", opcion(_SI_NO), requerido=True),
+    campo("consultas_prenatales", entero(0), requerido=True),
+    campo("lugar_parto", opcion(_LUGAR_PARTO), requerido=True),
+    campo("hospitalizacion_embarazo", objeto([
+        campo("hubo", opcion(_SI_NO), requerido=True),
+        campo("dias", entero(0), requerido=True),
+    ]), requerido=True),
+    campo("corticoides_antenatales", objeto([
+        campo("estado", opcion(_CORTICOIDES_ESTADO), requerido=True),
+        campo("semana_inicio", entero(0), requerido=True),
+    ]), requerido=True),
+    campo("inicio_parto", opcion(_INICIO_PARTO), requerido=True),
+    campo("ruptura_membrana", _ruptura_membrana, requerido=True),
+    campo("edad_gestacional_parto", objeto([
+        campo("semanas", entero(0), requerido=True),
+        campo("dias", entero(0, 6), requerido=True),
+        campo("metodo", opcion(_EDAD_GEST_METODO), requerido=True),
+    ]), requerido=True),
+    campo("presentacion", opcion(_PRESENTACION), requerido=True),
+    campo("tamano_fetal_acorde", opcion(_SI_NO), requerido=True),
+    campo("acompanante", opcion(_ACOMPANANTE), requerido=True),
+    campo("acompanamiento_solicitado_usuaria", opcion(_SI_NO), requerido=True),
+    campo("nacimiento", opcion(_NACIMIENTO), requerido=True),
+    campo("fecha_hora_nacimiento", fecha_hora(_FORMATO_FECHA_HORA), requerido=True),
+    campo("nacimiento_multiple", opcion(_SI_NO), requerido=True),
+    campo("orden_nacimiento", entero(0), requerido=True),
+    campo("terminacion_parto", opcion(_TERMINACION), requerido=True),
+    campo("posicion_parto", opcion(_POSICION), requerido=True),
+    campo("episiotomia", opcion(_EPI), requerido=True),
+    campo("desgarros", _desgarros, requerido=True),
+    campo("oxitocicos_pre", opcion(_SI_NO), requerido=True),
+    campo("oxitocicos_post", opcion(_SI_NO), requerido=True),
+    campo("placenta_expulsada", opcion(_SI_NO), requerido=True),
+    campo("ligadura_cordon", opcion(_LIGADURA), requerido=True),
+    campo("medicacion_recibida", objeto([
+        *(campo(k, opcion(_SI_NO), ausente="No") for k in (
+            "oxitocicos", "antibiotico", "analgesia", "anestesia_local",
+            "anestesia_general", "anestesia_regional", "transfusion",
+        )),
+        campo("otros", texto(), ausente=""),
+    ]), requerido=True),
+    campo("indicacion_principal_induccion_operacion", texto(), requerido=True),
+    campo("induccion", lista_de(texto(strip=False)), requerido=True),
+    campo("operacion", lista_de(texto(strip=False)), requerido=True),
+    campo("partograma_usado", _bool_si_no, requerido=True),
+    campo("partograma_detalle", lista(_ESQUEMA_PARTOGRAMA), si="presente"),
+])
 
 def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
-    _require(payload, _REQ_TOP)
-    return {
+    doc = {
         "historial_id": _to_oid(historial_id, "historial_id"),
-        # compat (opcional): permitir guardar paciente_id si viene
-        **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-           if payload.get("paciente_id") else {}),
         "usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id") if (usuario_actual and usuario_actual.get("usuario_id")) else None,
-        "tipo_evento": _norm_enum(payload["tipo_evento"], _TIPO_EVENTO, "tipo_evento"),
-        "fecha_ingreso": _as_date_ymd(payload["fecha_ingreso"], "fecha_ingreso"),
-        "carne_perinatal": _norm_enum(payload["carne_perinatal"], _SI_NO, "carne_perinatal"),
-        "consultas_prenatales": _as_int(payload["consultas_prenatales"], "consultas_prenatales", 0),
-        "lugar_parto": _norm_enum(payload["lugar_parto"], _LUGAR_PARTO, "lugar_parto"),
-        "hospitalizacion_embarazo": {
-            "hubo": _norm_enum(payload["hospitalizacion_embarazo"]["hubo"], _SI_NO, "hospitalizacion_embarazo.hubo"),
-            "dias": _as_int(payload["hospitalizacion_embarazo"]["dias"], "hospitalizacion_embarazo.dias", 0),
-        },
-        "corticoides_antenatales": {
-            "estado": _norm_enum(payload["corticoides_antenatales"]["estado"], _CORTICOIDES_ESTADO, "corticoides_antenatales.estado"),
-            "semana_inicio": _as_int(payload["corticoides_antenatales"]["semana_inicio"], "corticoides_antenatales.semana_inicio", 0),
-        },
-        "inicio_parto": _norm_enum(payload["inicio_parto"], _INICIO_PARTO, "inicio_parto"),
-        "ruptura_membrana": _build_rpm(payload["ruptura_membrana"]),
-        "edad_gestacional_parto": {
-            "semanas": _as_int(payload["edad_gestacional_parto"]["semanas"], "edad_gestacional_parto.semanas", 0),
-            "dias": _as_int(payload["edad_gestacional_parto"]["dias"], "edad_gestacional_parto.dias", 0, 6),
-            "metodo": _norm_enum(payload["edad_gestacional_parto"]["metodo"], _EDAD_GEST_METODO, "edad_gestacional_parto.metodo"),
-        },
-        "presentacion": _norm_enum(payload["presentacion"], _PRESENTACION, "presentacion"),
-        "tamano_fetal_acorde": _norm_enum(payload["tamano_fetal_acorde"], _SI_NO, "tamano_fetal_acorde"),
-        "acompanante": _norm_enum(payload["acompanante"], _ACOMPANANTE, "acompanante"),
-        "acompanamiento_solicitado_usuaria": _norm_enum(payload["acompanamiento_solicitado_usuaria"], _SI_NO, "acompanamiento_solicitado_usuaria"),
-        "nacimiento": _norm_enum(payload["nacimiento"], _NACIMIENTO, "nacimiento"),
-        "fecha_hora_nacimiento": _as_datetime_iso(payload["fecha_hora_nacimiento"], "fecha_hora_nacimiento"),
-        "nacimiento_multiple": _norm_enum(payload["nacimiento_multiple"], _SI_NO, "nacimiento_multiple"),
-        "orden_nacimiento": _as_int(payload["orden_nacimiento"], "orden_nacimiento", 0),
-        "terminacion_parto": _norm_enum(payload["terminacion_parto"], _TERMINACION, "terminacion_parto"),
-        "posicion_parto": _norm_enum(payload["posicion_parto"], _POSICION, "posicion_parto"),
-        "episiotomia": _norm_enum(payload["episiotomia"], _EPI, "episiotomia"),
-        "desgarros": {
-            "hubo": _norm_enum(payload["desgarros"]["hubo"], _SI_NO, "desgarros.hubo"),
-            **({"grado": _as_int(payload["desgarros"]["grado"], "desgarros.grado", 1, 4)} if payload["desgarros"]["hubo"] == "Si" else {"grado": None}),
-        },
-        "oxitocicos_pre": _norm_enum(payload["oxitocicos_pre"], _SI_NO, "oxitocicos_pre"),
-        "oxitocicos_post": _norm_enum(payload["oxitocicos_post"], _SI_NO, "oxitocicos_post"),
-        "placenta_expulsada": _norm_enum(payload["placenta_expulsada"], _SI_NO, "placenta_expulsada"),
-        "ligadura_cordon": _norm_enum(payload["ligadura_cordon"], _LIGADURA, "ligadura_cordon"),
-        "medicacion_recibida": _build_medicacion(payload.get("medicacion_recibida", {})),
-        "indicacion_principal_induccion_operacion": str(payload["indicacion_principal_induccion_operacion"]).strip(),
-        "induccion": [str(x) for x in payload.get("induccion", [])],
-        "operacion": [str(x) for x in payload.get("operacion", [])],
-        "partograma_usado": _as_bool(payload["partograma_usado"], "partograma_usado"),
-        "partograma_detalle": _build_partograma(payload.get("partograma_detalle")),
+        **_validar(payload),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
     }
+    doc["partograma_detalle"] = doc.get("partograma_detalle") or []
+    return doc
 
 # ================== services ==================
 def crear_parto_aborto(historial_id: str, payload: dict, session=None, usuario_actual: dict | None = None):
@@ -265,16 +229,15 @@ def crear_parto_aborto(historial_id: str, payload: dict, session=None, usuario_a
         if not historial_id:
             return _fail("historial_id es requerido", 422)
 
-        _ensure_indexes()
-
         # validar que exista el historial
         h_oid = _to_oid(historial_id, "historial_id")
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
         doc = _build_doc(historial_id, payload, usuario_actual)
         res = (mongo.db.parto_aborto.insert_one(doc, session=session)
                if session else mongo.db.parto_aborto.insert_one(doc))
+        svc_snap.sincronizar_seccion("parto_aborto", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
     except ValueError as ve:
         return _fail(str(ve), 422)
@@ -332,100 +295,29 @@ def actualizar_parto_aborto_por_id(pa_id: str, payload: dict, session=None):
         # FK principal: historial_id (si viene, validar)
         if "historial_id" in payload and payload["historial_id"] is not None:
             h_oid = _to_oid(payload["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
 
-        # compat: permitir mover a otro paciente si viene
-        if "paciente_id" in payload and payload["paciente_id"]:
-            upd["paciente_id"] = _to_oid(payload["paciente_id"], "paciente_id")
         if "usuario_id" in payload and payload["usuario_id"]:
             upd["usuario_id"] = _to_oid(payload["usuario_id"], "usuario_id")
 
-        # enums simples
-        for f, enum in [
-            ("tipo_evento", _TIPO_EVENTO),
-            ("carne_perinatal", _SI_NO),
-            ("lugar_parto", _LUGAR_PARTO),
-            ("inicio_parto", _INICIO_PARTO),
-            ("presentacion", _PRESENTACION),
-            ("tamano_fetal_acorde", _SI_NO),
-            ("acompanante", _ACOMPANANTE),
-            ("acompanamiento_solicitado_usuaria", _SI_NO),
-            ("nacimiento", _NACIMIENTO),
-            ("nacimiento_multiple", _SI_NO),
-            ("terminacion_parto", _TERMINACION),
-            ("posicion_parto", _POSICION),
-            ("episiotomia", _EPI),
-            ("ligadura_cordon", _LIGADURA),
-        ]:
-            if f in payload and payload[f] is not None:
-                upd[f] = _norm_enum(payload[f], enum, f)
-
-        # fechas / números
-        if "fecha_ingreso" in payload and payload["fecha_ingreso"]:
-            upd["fecha_ingreso"] = _as_date_ymd(payload["fecha_ingreso"], "fecha_ingreso")
-        if "consultas_prenatales" in payload and payload["consultas_prenatales"] is not None:
-            upd["consultas_prenatales"] = _as_int(payload["consultas_prenatales"], "consultas_prenatales", 0)
-        if "fecha_hora_nacimiento" in payload and payload["fecha_hora_nacimiento"]:
-            upd["fecha_hora_nacimiento"] = _as_datetime_iso(payload["fecha_hora_nacimiento"], "fecha_hora_nacimiento")
-        if "orden_nacimiento" in payload and payload["orden_nacimiento"] is not None:
-            upd["orden_nacimiento"] = _as_int(payload["orden_nacimiento"], "orden_nacimiento", 0)
-
-        # objetos anidados
-        if "hospitalizacion_embarazo" in payload and payload["hospitalizacion_embarazo"]:
-            he = payload["hospitalizacion_embarazo"]
-            upd["hospitalizacion_embarazo"] = {
-                "hubo": _norm_enum(he["hubo"], _SI_NO, "hospitalizacion_embarazo.hubo"),
-                "dias": _as_int(he["dias"], "hospitalizacion_embarazo.dias", 0),
-            }
-
-        if "corticoides_antenatales" in payload and payload["corticoides_antenatales"]:
-            ca = payload["corticoides_antenatales"]
-            upd["corticoides_antenatales"] = {
-                "estado": _norm_enum(ca["estado"], _CORTICOIDES_ESTADO, "corticoides_antenatales.estado"),
-                "semana_inicio": _as_int(ca["semana_inicio"], "corticoides_antenatales.semana_inicio", 0),
-            }
-
-        if "ruptura_membrana" in payload and payload["ruptura_membrana"]:
-            upd["ruptura_membrana"] = _build_rpm(payload["ruptura_membrana"])
-
-        if "edad_gestacional_parto" in payload and payload["edad_gestacional_parto"]:
-            eg = payload["edad_gestacional_parto"]
-            upd["edad_gestacional_parto"] = {
-                "semanas": _as_int(eg["semanas"], "edad_gestacional_parto.semanas", 0),
-                "dias": _as_int(eg["dias"], "edad_gestacional_parto.dias", 0, 6),
-                "metodo": _norm_enum(eg["metodo"], _EDAD_GEST_METODO, "edad_gestacional_parto.metodo"),
-            }
-
-        if "desgarros" in payload and payload["desgarros"]:
-            dg = payload["desgarros"]
-            upd["desgarros"] = {
-                "hubo": _norm_enum(dg["hubo"], _SI_NO, "desgarros.hubo"),
-                **({"grado": _as_int(dg["grado"], "desgarros.grado", 1, 4)} if dg.get("hubo") == "Si" else {"grado": None})
-            }
-
-        if "medicacion_recibida" in payload and payload["medicacion_recibida"]:
-            upd["medicacion_recibida"] = _build_medicacion(payload["medicacion_recibida"])
-
-        if "induccion" in payload and payload["induccion"] is not None:
-            upd["induccion"] = [str(x) for x in payload["induccion"]]
-        if "operacion" in payload and payload["operacion"] is not None:
-            upd["operacion"] = [str(x) for x in payload["operacion"]]
-
-        if "partograma_usado" in payload and payload["partograma_usado"] is not None:
-            upd["partograma_usado"] = _as_bool(payload["partograma_usado"], "partograma_usado")
-        if "partograma_detalle" in payload:
-            upd["partograma_detalle"] = _build_partograma(payload["partograma_detalle"])
-
-        if "indicacion_principal_induccion_operacion" in payload and payload["indicacion_principal_induccion_operacion"] is not None:
-            upd["indicacion_principal_induccion_operacion"] = str(payload["indicacion_principal_induccion_operacion"]).strip()
+        # mismo esquema que al crear, solo con los campos enviados
+        upd.update(_validar(payload, parcial=True))
+        # parcial no toca los null; partograma_detalle: null vacía la lista, como siempre
+        if "partograma_detalle" in payload and payload["partograma_detalle"] is None:
+            upd["partograma_detalle"] = []
 
         upd["updated_at"] = datetime.utcnow()
 
-        res = mongo.db.parto_aborto.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.parto_aborto.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "parto_aborto", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Registro actualizado"}, 200)
 
     except ValueError as ve:
@@ -436,11 +328,95 @@ def actualizar_parto_aborto_por_id(pa_id: str, payload: dict, session=None):
 def eliminar_parto_aborto_por_id(pa_id: str, session=None):
     try:
         oid = _to_oid(pa_id, "pa_id")
-        res = mongo.db.parto_aborto.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.parto_aborto.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Registro eliminado"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
     except Exception:
         return _fail("Error al eliminar registro", 400)
+
+
+# ================== partograma en curso (serie por historial) ==================
+# Durante el trabajo de parto cada control (cada 15–30 min) se agrega solo a la
+# colección partograma_series, en buckets de una hora (app.db.series), sin tocar
+# el documento de parto_aborto ni revalidar partograma_detalle completo.
+# La serie se indexa por historial_id: el partograma empieza antes de que exista
+# el registro de parto/aborto.
+_PARTOGRAMA_COL = "partograma_series"
+_PARTOGRAMA_MINUTOS = 60
+_PARTOGRAMA_MAX = 12   # 1 h cada 5 min como máximo; si no, otro bucket de la misma hora
+
+_validar_control = compilar(_ESQUEMA_PARTOGRAMA)
+_validar_fecha_control = compilar([
+    campo("fecha_hora", fecha_hora(_FORMATO_FECHA_HORA), requerido=True),
+    campo("hora", entero(0)),
+    campo("minuto", entero(0)),
+])
+
+def _fecha_hora_control(payload):
+    """
+    fecha_hora 'YYYY-MM-DDTHH:MM' (hora clínica local) obligatoria: con solo hora/minuto
+    no se sabe a qué día pertenece un control cargado cerca de la medianoche.
+    """
+    datos = _validar_fecha_control(payload)
+    ts = datos["fecha_hora"]
+    if datos.get("hora", ts.hour) != ts.hour or datos.get("minuto", ts.minute) != ts.minute:
+        raise ValueError("fecha_hora no coincide con hora/minuto")
+    return ts
+
+def _serialize_control(it):
+    return {
+        "id": str(it["_id"]),
+        **{k: v for k, v in it.items() if k not in ("_id", "ts", "registrado", "usuario_id", "seq")},
+        "fecha_hora": it["ts"].strftime("%Y-%m-%dT%H:%M"),
+        "usuario_id": str(it["usuario_id"]) if it.get("usuario_id") else None,
+        "registrado": it["registrado"].isoformat(),
+    }
+
+def agregar_control_partograma(historial_id: str, payload: dict, usuario_actual: dict | None = None, session=None):
+    """Valida solo este control y lo agrega a su bucket (un update con upsert)."""
+    try:
+        if not isinstance(payload, dict):
+            return _fail("JSON inválido", 400)
+        h_oid = _to_oid(historial_id, "historial_id")
+        ts = _fecha_hora_control(payload)
+        item = _validar_control({**payload, "hora": ts.hour, "minuto": ts.minute})
+        item["ts"] = ts
+        if usuario_actual and usuario_actual.get("usuario_id"):
+            item["usuario_id"] = _to_oid(usuario_actual["usuario_id"], "usuario_id")
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
+            return _fail("historial_id no encontrado en historiales", 404)
+
+        guardado = series.agregar(
+            _PARTOGRAMA_COL, {"historial_id": h_oid}, item,
+            minutos=_PARTOGRAMA_MINUTOS, max_items=_PARTOGRAMA_MAX,
+            secuencia=f"partograma:{h_oid}", session=session,
+        )
+        return _ok(_serialize_control(guardado), 201)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception as e:
+        return _fail(f"Error al guardar control de partograma: {str(e)}", 400)
+
+def obtener_partograma(historial_id: str, since: str | None = None):
+    """
+    Controles del partograma en orden de hora. Con `since` (el `cursor` de la
+    respuesta anterior, un entero) solo devuelve lo registrado después: sondeo barato.
+    """
+    try:
+        h_oid = _to_oid(historial_id, "historial_id")
+        desde_seq = _as_int(since, "since", 0) if since not in (None, "") else None
+        res = series.leer(_PARTOGRAMA_COL, {"historial_id": h_oid}, since=desde_seq)
+        return _ok({
+            "items": [_serialize_control(it) for it in res["items"]],
+            "cursor": res["cursor"],
+        }, 200)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception:
+        return _fail("Error al obtener partograma", 400)
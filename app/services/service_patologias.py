@@ -1,6 +1,10 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import compilar, campo, booleano, opcion, texto, object_id, objeto, lista_de
 
 # ---------------- Respuestas estándar ----------------
 def _ok(data, code=200):   return {"ok": True, "data": data, "error": None}, code
@@ -20,6 +24,30 @@ _ENF_KEYS = [
     "rotura_premembranas", "anemia", "otra_cond_grave"
 ]
 
+# ---------------- Esquema (compilado una vez al importar) ----------------
+# Compartido por crear (validar(payload)) y actualizar (validar(payload, parcial=True)).
+# Cada bloque anidado se valida completo: al actualizar reemplaza el bloque.
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),          # compat
+    campo("identificacion_id", object_id(), si="valor"),
+    campo("enfermedades", objeto([campo(k, opcion(_SI_NO_MIN), requerido=True) for k in _ENF_KEYS]),
+          requerido=True),
+    campo("resumen", objeto([
+        campo("ninguna", booleano(), requerido=True),
+        campo("uno_o_mas", booleano(), requerido=True),
+    ]), requerido=True),
+    campo("hemorragia", objeto([
+        campo("hemorragia_ocurrio", opcion(_SI_NO_MIN), requerido=True),
+        campo("trimestre", opcion(_HEM_TRIM), requerido=True),
+        campo("codigo", lista_de(texto(strip=False), max_items=3), requerido=True),
+    ]), requerido=True),
+    campo("tdp", objeto([
+        campo("prueba_sifilis", opcion(_RES_SIF_VIH), requerido=True),
+        campo("prueba_vih", opcion(_RES_SIF_VIH), requerido=True),
+        campo("tarv", opcion(_TARV), requerido=True),
+    ]), requerido=True),
+])
+
 # ---------------- Utils ----------------
 def _to_oid(v, field):
     try:
@@ -27,36 +55,6 @@ def _to_oid(v, field):
     except Exception:
         raise ValueError(f"{field} no es un ObjectId válido")
 
-def _require(payload: dict, fields: list[str], where: str = ""):
-    faltan = [f for f in fields if f not in payload]
-    if faltan:
-        pref = f"{where}: " if where else ""
-        raise ValueError(pref + "Campos requeridos faltantes: " + ", ".join(faltan))
-
-def _norm_enum(v, opts: set[str], field: str):
-    if isinstance(v, str) and (vv := v.strip()) in opts:
-        return vv
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(opts))}")
-
-def _as_bool(v, field: str):
-    if isinstance(v, bool):
-        return v
-    if isinstance(v, (int, float)) and v in (0, 1):
-        return bool(v)
-    if isinstance(v, str) and v.lower() in ("true", "false"):
-        return v.lower() == "true"
-    raise ValueError(f"{field} debe ser booleano")
-
-def _ensure_indexes():
-    try:
-        mongo.db.patologias.create_index("historial_id", name="ix_pat_historial")
-    except Exception:
-        pass
-    try:
-        mongo.db.patologias.create_index("paciente_id", name="ix_pat_paciente")  # compat
-    except Exception:
-        pass
-
 def _serialize(doc: dict):
     """Convierte ObjectIds/fechas a string para respuesta."""
     return {
@@ -74,52 +72,11 @@ def _serialize(doc: dict):
     }
 
 # ---------------- Builders ----------------
-def _build_enfermedades(enf: dict) -> dict:
-    _require(enf, _ENF_KEYS, "enfermedades")
-    return {k: _norm_enum(enf[k], _SI_NO_MIN, f"enfermedades.{k}") for k in _ENF_KEYS}
-
-def _build_resumen(res: dict) -> dict:
-    _require(res, ["ninguna", "uno_o_mas"], "resumen")
-    return {
-        "ninguna": _as_bool(res["ninguna"], "resumen.ninguna"),
-        "uno_o_mas": _as_bool(res["uno_o_mas"], "resumen.uno_o_mas"),
-    }
-
-def _build_hemorragia(he: dict) -> dict:
-    _require(he, ["hemorragia_ocurrio", "trimestre", "codigo"], "hemorragia")
-    if not isinstance(he.get("codigo"), list):
-        raise ValueError("hemorragia.codigo debe ser arreglo de strings (máx 3)")
-    if len(he["codigo"]) > 3:
-        raise ValueError("hemorragia.codigo admite hasta 3 códigos")
-    return {
-        "hemorragia_ocurrio": _norm_enum(he["hemorragia_ocurrio"], _SI_NO_MIN, "hemorragia.hemorragia_ocurrio"),
-        "trimestre": _norm_enum(he["trimestre"], _HEM_TRIM, "hemorragia.trimestre"),
-        "codigo": [str(x) for x in he["codigo"]],
-    }
-
-def _build_tdp(tdp: dict) -> dict:
-    _require(tdp, ["prueba_sifilis", "prueba_vih", "tarv"], "tdp")
-    return {
-        "prueba_sifilis": _norm_enum(tdp["prueba_sifilis"], _RES_SIF_VIH, "tdp.prueba_sifilis"),
-        "prueba_vih": _norm_enum(tdp["prueba_vih"], _RES_SIF_VIH, "tdp.prueba_vih"),
-        "tarv": _norm_enum(tdp["tarv"], _TARV, "tdp.tarv"),
-    }
-
 def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
-    _require(payload, ["enfermedades", "resumen", "hemorragia", "tdp"])
     return {
         "historial_id": _to_oid(historial_id, "historial_id"),
-        # compat: permitir guardar paciente_id si viene
-        **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-           if payload.get("paciente_id") else {}),
-        # identificacion_id opcional
-        **({"identificacion_id": _to_oid(payload["identificacion_id"], "identificacion_id")}
-           if payload.get("identificacion_id") else {}),
         "usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id") if (usuario_actual and usuario_actual.get("usuario_id")) else None,
-        "enfermedades": _build_enfermedades(payload["enfermedades"]),
-        "resumen": _build_resumen(payload["resumen"]),
-        "hemorragia": _build_hemorragia(payload["hemorragia"]),
-        "tdp": _build_tdp(payload["tdp"]),
+        **_validar(payload),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
     }
@@ -133,15 +90,14 @@ def crear_patologias(historial_id: str, payload: dict, session=None, usuario_act
         if not historial_id:
             return _fail("historial_id es requerido", 422)
 
-        _ensure_indexes()
-
         # validar existencia del historial
         h_oid = _to_oid(historial_id, "historial_id")
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
         doc = _build_doc(historial_id, payload, usuario_actual)
         res = mongo.db.patologias.insert_one(doc, session=session) if session else mongo.db.patologias.insert_one(doc)
+        svc_snap.sincronizar_seccion("patologias", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -200,36 +156,29 @@ def actualizar_patologias_por_id(pat_id: str, payload: dict, session=None):
         # FK principal: historial_id (si viene, validar)
         if "historial_id" in payload and payload["historial_id"] is not None:
             h_oid = _to_oid(payload["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
 
-        # compat (opcional)
-        if "paciente_id" in payload and payload["paciente_id"]:
-            upd["paciente_id"] = _to_oid(payload["paciente_id"], "paciente_id")
-        if "identificacion_id" in payload and payload["identificacion_id"]:
-            upd["identificacion_id"] = _to_oid(payload["identificacion_id"], "identificacion_id")
         if "usuario_id" in payload and payload["usuario_id"]:
             upd["usuario_id"] = _to_oid(payload["usuario_id"], "usuario_id")
 
-        # bloques anidados
-        if "enfermedades" in payload and payload["enfermedades"]:
-            upd["enfermedades"] = _build_enfermedades(payload["enfermedades"])
-        if "resumen" in payload and payload["resumen"]:
-            upd["resumen"] = _build_resumen(payload["resumen"])
-        if "hemorragia" in payload and payload["hemorragia"]:
-            upd["hemorragia"] = _build_hemorragia(payload["hemorragia"])
-        if "tdp" in payload and payload["tdp"]:
-            upd["tdp"] = _build_tdp(payload["tdp"])
+        # mismo esquema que al crear, solo con los campos enviados
+        upd.update(_validar(payload, parcial=True))
 
         if not upd:
             return _fail("Nada para actualizar", 422)
 
         upd["updated_at"] = datetime.utcnow()
 
-        res = mongo.db.patologias.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.patologias.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "patologias", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Patologías actualizadas"}, 200)
 
     except ValueError as ve:
@@ -240,9 +189,12 @@ def actualizar_patologias_por_id(pat_id: str, payload: dict, session=None):
 def eliminar_patologias_por_id(pat_id: str, session=None):
     try:
         oid = _to_oid(pat_id, "pat_id")
-        res = mongo.db.patologias.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.patologias.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Patologías eliminadas"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
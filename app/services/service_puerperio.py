@@ -1,6 +1,10 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map, series
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import compilar, campo, entero, decimal, fecha_hora, opcion, texto, object_id, objeto, lista
 
 # ---------------- Respuestas estándar ----------------
 def _ok(data, code=200):   return {"ok": True, "data": data, "error": None}, code
@@ -15,6 +19,32 @@ _SIS_MIN, _SIS_MAX   = 50, 250      # mmHg
 _DIA_MIN, _DIA_MAX   = 30, 150      # mmHg
 _PUL_MIN, _PUL_MAX   = 30, 220      # lpm
 
+_FORMATOS_DIA_HORA = ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+
+# ---------------- Esquemas (compilados una vez al importar) ----------------
+# Un registro de puerperio inmediato: items de puerperio_inmediato[] y de la serie.
+_ESQUEMA_REGISTRO = [
+    campo("dia_hora", fecha_hora(_FORMATOS_DIA_HORA), requerido=True),
+    campo("temperatura", decimal(_TEMP_MIN, _TEMP_MAX), requerido=True),
+    campo("presion_arterial", objeto([
+        campo("sistolica", entero(_SIS_MIN, _SIS_MAX), requerido=True),
+        campo("diastolica", entero(_DIA_MIN, _DIA_MAX), requerido=True),
+    ]), requerido=True),
+    campo("pulso", entero(_PUL_MIN, _PUL_MAX), requerido=True),
+    campo("involucion_uterina", opcion(_INVOL_UTER), requerido=True),
+    campo("loquios", texto(strip=False), requerido=True),
+]
+_validar_registro = compilar(_ESQUEMA_REGISTRO)
+
+# Documento completo; lo comparten crear y actualizar (parcial=True).
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),          # compat
+    campo("identificacion_id", object_id(), si="valor"),
+    campo("puerperio_inmediato", lista(_ESQUEMA_REGISTRO), requerido=True),
+    campo("antirrubeola_postparto", opcion(_SI_NO_NC), requerido=True),
+    campo("gammaglobulina_anti_d", opcion(_SI_NO_NC), requerido=True),
+])
+
 # ---------------- Utils ----------------
 def _to_oid(v, field):
     try:
@@ -22,40 +52,6 @@ def _to_oid(v, field):
     except Exception:
         raise ValueError(f"{field} no es un ObjectId válido")
 
-def _ensure_indexes():
-    try:
-        mongo.db.puerperio.create_index("historial_id", name="ix_puer_historial")
-    except Exception:
-        pass
-    # compat
-    try:
-        mongo.db.puerperio.create_index("paciente_id", name="ix_puer_paciente")
-    except Exception:
-        pass
-
-def _require(payload: dict, fields: list[str], where: str = ""):
-    faltan = [f for f in fields if f not in payload]
-    if faltan:
-        pref = f"{where}: " if where else ""
-        raise ValueError(pref + "Campos requeridos faltantes: " + ", ".join(faltan))
-
-def _norm_enum(v, opts: set[str], field: str):
-    if isinstance(v, str) and v.strip() in opts:
-        return v.strip()
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(opts))}")
-
-def _as_float(v, field):
-    try:
-        return float(v)
-    except Exception:
-        raise ValueError(f"{field} debe ser numérico")
-
-def _as_float_in_range(v, field, lo=None, hi=None):
-    x = _as_float(v, field)
-    if (lo is not None and x < lo) or (hi is not None and x > hi):
-        raise ValueError(f"{field} fuera de rango permitido [{lo}, {hi}]")
-    return x
-
 def _as_int_in_range(v, field, lo=None, hi=None):
     try:
         x = int(v)
@@ -70,7 +66,7 @@ def _as_datetime(s, field):
         return s
     if not isinstance(s, str):
         raise ValueError(f"{field} debe ser string con fecha/hora")
-    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"):
+    for fmt in _FORMATOS_DIA_HORA:
         try:
             return datetime.strptime(s.strip(), fmt)
         except Exception:
@@ -101,46 +97,12 @@ def _serialize(doc: dict):
     }
 
 # ---------------- Builders ----------------
-def _build_registro_puerperio(r: dict) -> dict:
-    _require(
-        r,
-        ["dia_hora", "temperatura", "presion_arterial", "pulso", "involucion_uterina", "loquios"],
-        "puerperio_inmediato[]"
-    )
-    pa = r["presion_arterial"]
-    if not isinstance(pa, dict):
-        raise ValueError("presion_arterial debe ser objeto {sistolica, diastolica}")
-    _require(pa, ["sistolica", "diastolica"], "presion_arterial")
-
-    return {
-        "dia_hora": _as_datetime(r["dia_hora"], "dia_hora"),
-        "temperatura": _as_float_in_range(r["temperatura"], "temperatura", _TEMP_MIN, _TEMP_MAX),
-        "presion_arterial": {
-            "sistolica": _as_int_in_range(pa["sistolica"], "presion_arterial.sistolica", _SIS_MIN, _SIS_MAX),
-            "diastolica": _as_int_in_range(pa["diastolica"], "presion_arterial.diastolica", _DIA_MIN, _DIA_MAX),
-        },
-        "pulso": _as_int_in_range(r["pulso"], "pulso", _PUL_MIN, _PUL_MAX),
-        "involucion_uterina": _norm_enum(r["involucion_uterina"], _INVOL_UTER, "involucion_uterina"),
-        "loquios": str(r["loquios"]),
-    }
-
 def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
-    _require(payload, ["puerperio_inmediato", "antirrubeola_postparto", "gammaglobulina_anti_d"])
-    if not isinstance(payload["puerperio_inmediato"], list):
-        raise ValueError("puerperio_inmediato debe ser un arreglo de registros")
-
     return {
         "historial_id": _to_oid(historial_id, "historial_id"),
-        # compat: permitir guardar paciente_id si viene
-        **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-           if payload.get("paciente_id") else {}),
-        **({"identificacion_id": _to_oid(payload["identificacion_id"], "identificacion_id")}
-           if payload.get("identificacion_id") else {}),
         **({"usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id")}
            if usuario_actual and usuario_actual.get("usuario_id") else {}),
-        "puerperio_inmediato": [_build_registro_puerperio(x) for x in payload["puerperio_inmediato"]],
-        "antirrubeola_postparto": _norm_enum(payload["antirrubeola_postparto"], _SI_NO_NC, "antirrubeola_postparto"),
-        "gammaglobulina_anti_d": _norm_enum(payload["gammaglobulina_anti_d"], _SI_NO_NC, "gammaglobulina_anti_d"),
+        **_validar(payload),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
     }
@@ -154,15 +116,14 @@ def crear_puerperio(historial_id: str, payload: dict, session=None, usuario_actu
         if not historial_id:
             return _fail("historial_id es requerido", 422)
 
-        _ensure_indexes()
-
         # validar existencia del historial
         h_oid = _to_oid(historial_id, "historial_id")
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
         doc = _build_doc(historial_id, payload, usuario_actual)
         res = mongo.db.puerperio.insert_one(doc, session=session) if session else mongo.db.puerperio.insert_one(doc)
+        svc_snap.sincronizar_seccion("puerperio", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -221,38 +182,28 @@ def actualizar_puerperio_por_id(pue_id: str, payload: dict, session=None):
         # FK principal: historial_id (si viene, validar)
         if "historial_id" in payload and payload["historial_id"] is not None:
             h_oid = _to_oid(payload["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
 
-        # Re-vínculos opcionales (compat)
-        if "paciente_id" in payload and payload["paciente_id"]:
-            upd["paciente_id"] = _to_oid(payload["paciente_id"], "paciente_id")
-        if "identificacion_id" in payload and payload["identificacion_id"]:
-            upd["identificacion_id"] = _to_oid(payload["identificacion_id"], "identificacion_id")
         if "usuario_id" in payload and payload["usuario_id"]:
             upd["usuario_id"] = _to_oid(payload["usuario_id"], "usuario_id")
 
-        # Bloques
-        if "puerperio_inmediato" in payload and payload["puerperio_inmediato"] is not None:
-            if not isinstance(payload["puerperio_inmediato"], list):
-                return _fail("puerperio_inmediato debe ser arreglo", 422)
-            upd["puerperio_inmediato"] = [_build_registro_puerperio(x) for x in payload["puerperio_inmediato"]]
-
-        for f, enum in [
-            ("antirrubeola_postparto", _SI_NO_NC),
-            ("gammaglobulina_anti_d", _SI_NO_NC),
-        ]:
-            if f in payload and payload[f] is not None:
-                upd[f] = _norm_enum(payload[f], enum, f)
+        # mismo esquema que al crear, solo con los campos enviados
+        upd.update(_validar(payload, parcial=True))
 
         if not upd:
             return _fail("Nada para actualizar", 422)
 
         upd["updated_at"] = datetime.utcnow()
-        res = mongo.db.puerperio.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.puerperio.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "puerperio", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Puerperio actualizado"}, 200)
 
     except ValueError as ve:
@@ -263,11 +214,144 @@ def actualizar_puerperio_por_id(pue_id: str, payload: dict, session=None):
 def eliminar_puerperio_por_id(pue_id: str, session=None):
     try:
         oid = _to_oid(pue_id, "pue_id")
-        res = mongo.db.puerperio.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.puerperio.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Puerperio eliminado"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
     except Exception:
         return _fail("Error al eliminar", 400)
+
+
+# ---------------- Signos vitales como serie (buckets por historial) ----------------
+# Cada registro de puerperio inmediato se agrega solo a puerperio_series (buckets de
+# 6 h por historial, app.db.series) sin reescribir el documento de puerperio.
+# El tablero de sala lee las últimas N horas de TODAS las pacientes con una sola
+# consulta por rango sobre el índice (inicio).
+_SERIE_COL = "puerperio_series"
+_SERIE_MINUTOS = 360
+_SERIE_MAX = 96
+_CADA_PERMITIDO = (15, 30, 60, 120, 240, 360)
+
+def _serialize_registro(it):
+    return {
+        "id": str(it["_id"]),
+        "dia_hora": it["ts"].isoformat(),
+        "temperatura": it.get("temperatura"),
+        "presion_arterial": it.get("presion_arterial"),
+        "pulso": it.get("pulso"),
+        "involucion_uterina": it.get("involucion_uterina"),
+        "loquios": it.get("loquios"),
+        "usuario_id": str(it["usuario_id"]) if it.get("usuario_id") else None,
+    }
+
+def _vitales(it):
+    pa = it.get("presion_arterial") or {}
+    return {
+        "temperatura": it.get("temperatura"),
+        "pulso": it.get("pulso"),
+        "sistolica": pa.get("sistolica"),
+        "diastolica": pa.get("diastolica"),
+    }
+
+def _serialize_resumen(puntos):
+    return [{**p, "ts": p["ts"].isoformat()} for p in puntos]
+
+def _parse_rango(desde, hasta, horas_defecto=24):
+    """desde/hasta (fecha/hora) opcionales; sin desde, las últimas `horas_defecto` h."""
+    hasta_dt = _as_datetime(hasta, "hasta") if hasta else None
+    if desde:
+        desde_dt = _as_datetime(desde, "desde")
+    else:
+        desde_dt = (hasta_dt or series.ahora_clinica()) - timedelta(hours=horas_defecto)
+    if hasta_dt and hasta_dt < desde_dt:
+        raise ValueError("hasta debe ser posterior a desde")
+    return desde_dt, hasta_dt
+
+def _parse_cada(cada):
+    if cada in (None, ""):
+        return None
+    c = _as_int_in_range(cada, "cada", 1, None)
+    if c not in _CADA_PERMITIDO:
+        raise ValueError(f"cada debe ser uno de: {', '.join(map(str, _CADA_PERMITIDO))} (minutos)")
+    return c
+
+def agregar_registro_serie(historial_id: str, payload: dict, usuario_actual: dict | None = None, session=None):
+    """Valida solo este registro (mismas reglas que puerperio_inmediato[]) y lo agrega a su bucket."""
+    try:
+        if not isinstance(payload, dict):
+            return _fail("JSON inválido", 400)
+        h_oid = _to_oid(historial_id, "historial_id")
+        item = _validar_registro(payload)
+        item["ts"] = item.pop("dia_hora")
+        if usuario_actual and usuario_actual.get("usuario_id"):
+            item["usuario_id"] = _to_oid(usuario_actual["usuario_id"], "usuario_id")
+        hist = identity_map.obtener_por_id("historiales", h_oid, session=session)
+        if not hist:
+            return _fail("historial_id no encontrado en historiales", 404)
+
+        clave = {"historial_id": h_oid, "paciente_id": hist.get("paciente_id")}
+        guardado = series.agregar(_SERIE_COL, clave, item, minutos=_SERIE_MINUTOS,
+                                  max_items=_SERIE_MAX, session=session)
+        return _ok(_serialize_registro(guardado), 201)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception as e:
+        return _fail(f"Error al guardar registro de puerperio: {str(e)}", 400)
+
+def obtener_serie(historial_id: str, desde=None, hasta=None, cada=None):
+    """
+    Registros del historial en [desde, hasta] (por defecto las últimas 24 h).
+    Con `cada` (minutos) devuelve el resumen por ventana (min/max/prom/último)
+    en vez de cada registro.
+    """
+    try:
+        h_oid = _to_oid(historial_id, "historial_id")
+        desde_dt, hasta_dt = _parse_rango(desde, hasta)
+        cada_min = _parse_cada(cada)
+        items = series.leer(_SERIE_COL, {"historial_id": h_oid}, desde=desde_dt, hasta=hasta_dt,
+                            minutos=_SERIE_MINUTOS)["items"]
+        data = {"desde": desde_dt.isoformat(), "hasta": hasta_dt.isoformat() if hasta_dt else None}
+        if cada_min:
+            data["cada"] = cada_min
+            data["puntos"] = _serialize_resumen(series.resumir(items, cada_min, _vitales))
+        else:
+            data["items"] = [_serialize_registro(it) for it in items]
+        return _ok(data, 200)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception:
+        return _fail("Error al obtener signos vitales", 400)
+
+def tablero_signos_vitales(horas=24, cada=60):
+    """
+    Últimas `horas` de signos vitales de todas las pacientes con registros en ese
+    rango, resumidas cada `cada` minutos. Una sola consulta (índice inicio).
+    """
+    try:
+        horas = _as_int_in_range(horas if horas not in (None, "") else 24, "horas", 1, 72)
+        cada_min = _parse_cada(cada if cada not in (None, "") else 60)
+        desde_dt = series.ahora_clinica() - timedelta(hours=horas)
+        grupos = series.leer_por_clave(_SERIE_COL, "historial_id", desde_dt, minutos=_SERIE_MINUTOS,
+                                       extra=("paciente_id",))
+        return _ok({
+            "desde": desde_dt.isoformat(),
+            "cada": cada_min,
+            "pacientes": [
+                {
+                    "historial_id": str(h),
+                    "paciente_id": str(g["paciente_id"]) if g.get("paciente_id") else None,
+                    "ultimo": _serialize_registro(g["items"][-1]),
+                    "puntos": _serialize_resumen(series.resumir(g["items"], cada_min, _vitales)),
+                }
+                for h, g in grupos.items()
+            ],
+        }, 200)
+    except ValueError as ve:
+        return _fail(str(ve), 422)
+    except Exception:
+        return _fail("Error al obtener tablero de signos vitales", 400)
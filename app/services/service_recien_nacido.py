@@ -1,6 +1,12 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app import mongo
+from app.db import identity_map
+from app.services import service_historial_snapshot as svc_snap
+from app.utils.validacion import (
+    compilar, campo, booleano, entero, decimal, opcion, texto, object_id, objeto, lista_de,
+)
 
 # ---------------- Respuestas estándar ----------------
 def _ok(data, code=200):   return {"ok": True, "data": data, "error": None}, code
@@ -24,6 +30,59 @@ _TAMIZAJE_RES = {"positivo", "negativo", "no_se_hizo"}
 # ---------------- Rangos numéricos ----------------
 _MIN0 = 0.0
 
+# ---------------- Esquema (compilado una vez al importar) ----------------
+# Compartido por crear (validar(payload)) y actualizar (validar(payload, parcial=True)).
+# Cada subdocumento se valida completo: al actualizar reemplaza el subdocumento.
+_validar = compilar([
+    campo("paciente_id", object_id(), si="valor"),          # compat
+    campo("identificacion_id", object_id(), si="valor"),
+    campo("tipo_nacimiento", opcion(_TIPO_NAC), requerido=True),
+    campo("sexo", opcion(_SEXO), requerido=True),
+    campo("peso_nacer", decimal(_MIN0), requerido=True),
+    campo("perimetro_cefalico", decimal(_MIN0), requerido=True),
+    campo("longitud", decimal(_MIN0), requerido=True),
+    campo("edad_gestacional", objeto([
+        campo("semanas", entero(0), requerido=True),
+        campo("dias", entero(0), requerido=True),
+        campo("metodo", opcion(_EG_METODO), requerido=True),
+        campo("estimada", booleano(), requerido=True),
+    ]), requerido=True),
+    campo("peso_edad_gestacional", opcion(_PESO_EG), requerido=True),
+    campo("cuidados_inmediatos", objeto([
+        campo(k, opcion(_SI_NO), requerido=True) for k in ("vitamina_k", "profilaxis_ocular", "apego_precoz")
+    ]), requerido=True),
+    campo("apgar", objeto([
+        campo("min_1", entero(0, 10), requerido=True),
+        campo("min_5", entero(0, 10), requerido=True),
+    ]), requerido=True),
+    campo("reanimacion", lista_de(opcion(_REANIM)), requerido=True),
+    campo("fallece_sala_parto", opcion(_FALLECE_SALA), requerido=True),
+    campo("referido", opcion(_REFERIDO), requerido=True),
+    campo("atendio", objeto([
+        campo("parto", opcion(_ATENDIO), requerido=True),
+        campo("neonato", opcion(_ATENDIO), requerido=True),
+    ]), requerido=True),
+    campo("defectos_congenitos", objeto([
+        campo("presenta", opcion(_SI_NO), requerido=True),
+        campo("tipo_malformacion", opcion(_DEFECTO_TIPO), requerido=True),
+        campo("codigo", texto(strip=False), requerido=True),
+        campo("detalle", texto(strip=False), requerido=True),
+    ]), requerido=True),
+    campo("enfermedades", objeto([
+        campo("codigos", lista_de(texto(strip=False), max_items=3), requerido=True),
+        campo("ninguna", booleano(), requerido=True),
+        campo("uno_o_mas", booleano(), requerido=True),
+    ]), requerido=True),
+    campo("vih_rn", objeto([
+        campo("exposicion", opcion(_VIH_EXP), requerido=True),
+        campo("tratamiento", opcion(_VIH_TTO), requerido=True),
+    ]), requerido=True),
+    campo("tamizaje_neonatal", objeto([
+        campo(k, opcion(_TAMIZAJE_RES), requerido=True) for k in ("vdrl", "tsh", "hbpatia", "bilirrubina", "toxo_igm")
+    ]), requerido=True),
+    campo("meconio", opcion(_SI_NO), requerido=True),
+])
+
 # ---------------- Utils ----------------
 def _to_oid(v, field):
     try:
@@ -31,46 +90,6 @@ def _to_oid(v, field):
     except Exception:
         raise ValueError(f"{field} no es un ObjectId válido")
 
-def _ensure_indexes():
-    try:
-        mongo.db.recien_nacidos.create_index("historial_id", name="ix_rn_historial")
-    except Exception:
-        pass
-    # compat
-    try:
-        mongo.db.recien_nacidos.create_index("paciente_id", name="ix_rn_paciente")
-    except Exception:
-        pass
-
-def _require(payload: dict, fields: list[str], where: str = ""):
-    faltan = [f for f in fields if f not in payload]
-    if faltan:
-        pref = f"{where}: " if where else ""
-        raise ValueError(pref + "Campos requeridos faltantes: " + ", ".join(faltan))
-
-def _norm_enum(v, opts: set[str], field: str):
-    if isinstance(v, str) and v.strip() in opts:
-        return v.strip()
-    raise ValueError(f"{field} inválido; use uno de: {', '.join(sorted(opts))}")
-
-def _as_float_ge0(v, field):
-    try:
-        x = float(v)
-    except Exception:
-        raise ValueError(f"{field} debe ser numérico")
-    if x < 0:
-        raise ValueError(f"{field} no puede ser negativo")
-    return x
-
-def _as_int_ge0(v, field):
-    try:
-        x = int(v)
-    except Exception:
-        raise ValueError(f"{field} debe ser entero")
-    if x < 0:
-        raise ValueError(f"{field} no puede ser negativo")
-    return x
-
 def _serialize(doc: dict):
     return {
         "id": str(doc["_id"]),
@@ -101,118 +120,14 @@ def _serialize(doc: dict):
     }
 
 # ---------------- Builders ----------------
-def _build_edad_gestacional(eg: dict) -> dict:
-    _require(eg, ["semanas", "dias", "metodo", "estimada"], "edad_gestacional")
-    return {
-        "semanas": _as_int_ge0(eg["semanas"], "edad_gestacional.semanas"),
-        "dias": _as_int_ge0(eg["dias"], "edad_gestacional.dias"),
-        "metodo": _norm_enum(eg["metodo"], _EG_METODO, "edad_gestacional.metodo"),
-        "estimada": bool(eg["estimada"]),
-    }
-
-def _build_cuidados(ci: dict) -> dict:
-    _require(ci, ["vitamina_k", "profilaxis_ocular", "apego_precoz"], "cuidados_inmediatos")
-    return {
-        "vitamina_k": _norm_enum(ci["vitamina_k"], _SI_NO, "cuidados_inmediatos.vitamina_k"),
-        "profilaxis_ocular": _norm_enum(ci["profilaxis_ocular"], _SI_NO, "cuidados_inmediatos.profilaxis_ocular"),
-        "apego_precoz": _norm_enum(ci["apego_precoz"], _SI_NO, "cuidados_inmediatos.apego_precoz"),
-    }
-
-def _build_apgar(ap: dict) -> dict:
-    _require(ap, ["min_1", "min_5"], "apgar")
-    m1 = _as_int_ge0(ap["min_1"], "apgar.min_1")
-    m5 = _as_int_ge0(ap["min_5"], "apgar.min_5")
-    if not (0 <= m1 <= 10) or not (0 <= m5 <= 10):
-        raise ValueError("apgar.min_1 y apgar.min_5 deben estar en [0,10]")
-    return {"min_1": m1, "min_5": m5}
-
-def _build_atendio(at: dict) -> dict:
-    _require(at, ["parto", "neonato"], "atendio")
-    return {
-        "parto": _norm_enum(at["parto"], _ATENDIO, "atendio.parto"),
-        "neonato": _norm_enum(at["neonato"], _ATENDIO, "atendio.neonato"),
-    }
-
-def _build_defectos(dc: dict) -> dict:
-    _require(dc, ["presenta", "tipo_malformacion", "codigo", "detalle"], "defectos_congenitos")
-    return {
-        "presenta": _norm_enum(dc["presenta"], _SI_NO, "defectos_congenitos.presenta"),
-        "tipo_malformacion": _norm_enum(dc["tipo_malformacion"], _DEFECTO_TIPO, "defectos_congenitos.tipo_malformacion"),
-        "codigo": str(dc["codigo"]),
-        "detalle": str(dc["detalle"]),
-    }
-
-def _build_enfermedades(enf: dict) -> dict:
-    _require(enf, ["codigos", "ninguna", "uno_o_mas"], "enfermedades")
-    if not isinstance(enf["codigos"], list):
-        raise ValueError("enfermedades.codigos debe ser arreglo")
-    if len(enf["codigos"]) > 3:
-        raise ValueError("enfermedades.codigos admite máximo 3 códigos")
-    return {
-        "codigos": [str(x) for x in enf["codigos"]],
-        "ninguna": bool(enf["ninguna"]),
-        "uno_o_mas": bool(enf["uno_o_mas"]),
-    }
-
-def _build_vih_rn(vih: dict) -> dict:
-    _require(vih, ["exposicion", "tratamiento"], "vih_rn")
-    return {
-        "exposicion": _norm_enum(vih["exposicion"], _VIH_EXP, "vih_rn.exposicion"),
-        "tratamiento": _norm_enum(vih["tratamiento"], _VIH_TTO, "vih_rn.tratamiento"),
-    }
-
-def _build_tamizaje(tz: dict) -> dict:
-    _require(tz, ["vdrl", "tsh", "hbpatia", "bilirrubina", "toxo_igm"], "tamizaje_neonatal")
-    return {
-        "vdrl": _norm_enum(tz["vdrl"], _TAMIZAJE_RES, "tamizaje_neonatal.vdrl"),
-        "tsh": _norm_enum(tz["tsh"], _TAMIZAJE_RES, "tamizaje_neonatal.tsh"),
-        "hbpatia": _norm_enum(tz["hbpatia"], _TAMIZAJE_RES, "tamizaje_neonatal.hbpatia"),
-        "bilirrubina": _norm_enum(tz["bilirrubina"], _TAMIZAJE_RES, "tamizaje_neonatal.bilirrubina"),
-        "toxo_igm": _norm_enum(tz["toxo_igm"], _TAMIZAJE_RES, "tamizaje_neonatal.toxo_igm"),
-    }
-
 def _build_doc(historial_id: str, payload: dict, usuario_actual: dict | None):
-    _require(payload, [
-        "tipo_nacimiento","sexo","peso_nacer","perimetro_cefalico","longitud",
-        "edad_gestacional","peso_edad_gestacional","cuidados_inmediatos","apgar",
-        "reanimacion","fallece_sala_parto","referido","atendio","defectos_congenitos",
-        "enfermedades","vih_rn","tamizaje_neonatal","meconio"
-    ])
-
-    # reanimación
-    if not isinstance(payload["reanimacion"], list):
-        raise ValueError("reanimacion debe ser arreglo")
-    reanim = [_norm_enum(x, _REANIM, "reanimacion[]") for x in payload["reanimacion"]]
-
     if not usuario_actual or not usuario_actual.get("usuario_id"):
         raise ValueError("usuario_actual.usuario_id es requerido")
 
     return {
         "historial_id": _to_oid(historial_id, "historial_id"),
-        # compat (migración): aceptar paciente_id si viene
-        **({"paciente_id": _to_oid(payload["paciente_id"], "paciente_id")}
-           if payload.get("paciente_id") else {}),
-        **({"identificacion_id": _to_oid(payload["identificacion_id"], "identificacion_id")}
-           if payload.get("identificacion_id") else {}),
         "usuario_id": _to_oid(usuario_actual["usuario_id"], "usuario_id"),
-        "tipo_nacimiento": _norm_enum(payload["tipo_nacimiento"], _TIPO_NAC, "tipo_nacimiento"),
-        "sexo": _norm_enum(payload["sexo"], _SEXO, "sexo"),
-        "peso_nacer": _as_float_ge0(payload["peso_nacer"], "peso_nacer"),
-        "perimetro_cefalico": _as_float_ge0(payload["perimetro_cefalico"], "perimetro_cefalico"),
-        "longitud": _as_float_ge0(payload["longitud"], "longitud"),
-        "edad_gestacional": _build_edad_gestacional(payload["edad_gestacional"]),
-        "peso_edad_gestacional": _norm_enum(payload["peso_edad_gestacional"], _PESO_EG, "peso_edad_gestacional"),
-        "cuidados_inmediatos": _build_cuidados(payload["cuidados_inmediatos"]),
-        "apgar": _build_apgar(payload["apgar"]),
-        "reanimacion": reanim,
-        "fallece_sala_parto": _norm_enum(payload["fallece_sala_parto"], _FALLECE_SALA, "fallece_sala_parto"),
-        "referido": _norm_enum(payload["referido"], _REFERIDO, "referido"),
-        "atendio": _build_atendio(payload["atendio"]),
-        "defectos_congenitos": _build_defectos(payload["defectos_congenitos"]),
-        "enfermedades": _build_enfermedades(payload["enfermedades"]),
-        "vih_rn": _build_vih_rn(payload["vih_rn"]),
-        "tamizaje_neonatal": _build_tamizaje(payload["tamizaje_neonatal"]),
-        "meconio": _norm_enum(payload["meconio"], _SI_NO, "meconio"),
+        **_validar(payload),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
     }
@@ -226,16 +141,15 @@ def crear_recien_nacido(historial_id: str, payload: dict, session=None, usuario_
         if not historial_id:
             return _fail("historial_id es requerido", 422)
 
-        _ensure_indexes()
-
         # validar existencia del historial
         h_oid = _to_oid(historial_id, "historial_id")
-        if not mongo.db.historiales.find_one({"_id": h_oid}):
+        if not identity_map.obtener_por_id("historiales", h_oid, session=session):
             return _fail("historial_id no encontrado en historiales", 404)
 
         doc = _build_doc(historial_id, payload, usuario_actual)
         res = (mongo.db.recien_nacidos.insert_one(doc, session=session)
                if session else mongo.db.recien_nacidos.insert_one(doc))
+        svc_snap.sincronizar_seccion("recien_nacido", doc.get("historial_id"), _serialize(doc), session=session)
         return _ok({"id": str(res.inserted_id)}, 201)
 
     except ValueError as ve:
@@ -294,71 +208,28 @@ def actualizar_recien_nacido_por_id(rn_id: str, payload: dict, session=None):
         # FK principal: historial_id
         if "historial_id" in payload and payload["historial_id"] is not None:
             h_oid = _to_oid(payload["historial_id"], "historial_id")
-            if not mongo.db.historiales.find_one({"_id": h_oid}):
+            if not identity_map.obtener_por_id("historiales", h_oid, session=session):
                 return _fail("historial_id no encontrado en historiales", 404)
             upd["historial_id"] = h_oid
 
-        # Reasignaciones opcionales (compat)
-        if "paciente_id" in payload and payload["paciente_id"]:
-            upd["paciente_id"] = _to_oid(payload["paciente_id"], "paciente_id")
-        if "identificacion_id" in payload and payload["identificacion_id"]:
-            upd["identificacion_id"] = _to_oid(payload["identificacion_id"], "identificacion_id")
         if "usuario_id" in payload and payload["usuario_id"]:
             upd["usuario_id"] = _to_oid(payload["usuario_id"], "usuario_id")
 
-        # Campos simples/enums
-        for f, enum in [
-            ("tipo_nacimiento", _TIPO_NAC),
-            ("sexo", _SEXO),
-            ("peso_edad_gestacional", _PESO_EG),
-            ("fallece_sala_parto", _FALLECE_SALA),
-            ("referido", _REFERIDO),
-            ("meconio", _SI_NO),
-        ]:
-            if f in payload and payload[f] is not None:
-                upd[f] = _norm_enum(payload[f], enum, f)
-
-        for f in ("peso_nacer", "perimetro_cefalico", "longitud"):
-            if f in payload and payload[f] is not None:
-                upd[f] = _as_float_ge0(payload[f], f)
-
-        # Subdocumentos
-        if "edad_gestacional" in payload and payload["edad_gestacional"] is not None:
-            upd["edad_gestacional"] = _build_edad_gestacional(payload["edad_gestacional"])
-
-        if "cuidados_inmediatos" in payload and payload["cuidados_inmediatos"] is not None:
-            upd["cuidados_inmediatos"] = _build_cuidados(payload["cuidados_inmediatos"])
-
-        if "apgar" in payload and payload["apgar"] is not None:
-            upd["apgar"] = _build_apgar(payload["apgar"])
-
-        if "reanimacion" in payload and payload["reanimacion"] is not None:
-            if not isinstance(payload["reanimacion"], list):
-                return _fail("reanimacion debe ser arreglo", 422)
-            upd["reanimacion"] = [_norm_enum(x, _REANIM, "reanimacion[]") for x in payload["reanimacion"]]
-
-        if "atendio" in payload and payload["atendio"] is not None:
-            upd["atendio"] = _build_atendio(payload["atendio"])
-
-        if "defectos_congenitos" in payload and payload["defectos_congenitos"] is not None:
-            upd["defectos_congenitos"] = _build_defectos(payload["defectos_congenitos"])
-
-        if "enfermedades" in payload and payload["enfermedades"] is not None:
-            upd["enfermedades"] = _build_enfermedades(payload["enfermedades"])
-
-        if "vih_rn" in payload and payload["vih_rn"] is not None:
-            upd["vih_rn"] = _build_vih_rn(payload["vih_rn"])
-
-        if "tamizaje_neonatal" in payload and payload["tamizaje_neonatal"] is not None:
-            upd["tamizaje_neonatal"] = _build_tamizaje(payload["tamizaje_neonatal"])
+        # mismo esquema que al crear, solo con los campos enviados
+        upd.update(_validar(payload, parcial=True))
 
         if not upd:
             return _fail("Nada para actualizar", 422)
 
         upd["updated_at"] = datetime.utcnow()
-        res = mongo.db.recien_nacidos.update_one({"_id": oid}, {"$set": upd}, session=session)
-        if res.matched_count == 0:
+        actualizado = mongo.db.recien_nacidos.find_one_and_update(
+            {"_id": oid}, {"$set": upd}, return_document=ReturnDocument.AFTER, session=session
+        )
+        if not actualizado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.sincronizar_seccion_actualizada(
+            "recien_nacido", actualizado, _serialize(actualizado), movido="historial_id" in upd, session=session
+        )
         return _ok({"mensaje": "Recién nacido actualizado"}, 200)
 
     except ValueError as ve:
@@ -369,9 +240,12 @@ def actualizar_recien_nacido_por_id(rn_id: str, payload: dict, session=None):
 def eliminar_recien_nacido_por_id(rn_id: str, session=None):
     try:
         oid = _to_oid(rn_id, "rn_id")
-        res = mongo.db.recien_nacidos.delete_one({"_id": oid}, session=session)
-        if res.deleted_count == 0:
+        eliminado = mongo.db.recien_nacidos.find_one_and_delete(
+            {"_id": oid}, projection={"historial_id": 1}, session=session
+        )
+        if not eliminado:
             return _fail("No se encontró el documento", 404)
+        svc_snap.invalidar(historial_id=eliminado.get("historial_id"), session=session)
         return _ok({"mensaje": "Recién nacido eliminado"}, 200)
     except ValueError as ve:
         return _fail(str(ve), 422)
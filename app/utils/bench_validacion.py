@@ -0,0 +1,180 @@
+import copy
+import time
+from bson import ObjectId
+
+# Micro-benchmark del costo de validar un payload por sección: _build_doc de cada
+# service (sin Mongo), con un payload válido y otro con varios errores.
+#   flask bench validacion --n 5000
+#
+# Línea base (services anteriores a app.utils.validacion, donde no existe el comando
+# `flask bench`): este módulo solo usa _build_doc(historial_id, payload, usuario), que
+# tiene la misma firma antes y después, así que se copia a un checkout previo y se
+# corre como script:
+#   antes=$(git log --diff-filter=A --format=%h -- app/utils/validacion.py)^
+#   git worktree add /tmp/hcp-antes "$antes"
+#   cp app/utils/bench_validacion.py /tmp/hcp-antes/app/utils/
+#   (cd /tmp/hcp-antes && python -m app.utils.bench_validacion --n 5000)
+#   python -m app.utils.bench_validacion --n 5000
+# Los números dependen de la máquina: comparar solo corridas hechas en la misma.
+
+_GESTACION_VALIDA = {
+    "peso_anterior": 60, "talla": 1.6, "fum": "2026-01-01", "fpp": "2026-10-08", "eg_confiable": True,
+    "fumadora_activa": False, "fumadora_pasiva": "false", "drogas": 0, "alcohol": False, "violencia": False,
+    "vacuna_rubeola": "previa", "vacuna_antitetanica": True, "examen_mamas": True, "examen_odonto": True,
+    "cervix_normal": True, "grupo_sanguineo": "O", "rh": "+", "inmunizada": False,
+    "hemoglobina": 12.5, "anemia": False, "hierro_indicado": True, "acido_folico_indicado": True,
+    "glucemia1": 85, "glucemia_ayunas_ge_92_lt24": False, "glucemia2": 88, "glucemia_ayunas_ge_92_ge24": False,
+    "bacteriuria": False, "estreptococo": False, "chagas_res": "-", "malaria_res": "-",
+    "vih_solicitada_lt20": "si", "vih_resultado_lt20": "-", "tarv_emb_lt20": "nc",
+    "vih_solicitada_ge20": "si", "vih_resultado_ge20": "-", "tarv_emb_ge20": "nc",
+    "sifilis_no_trep_lt20": "-", "sifilis_trep_lt20": "-", "sifilis_tratamiento_lt20": "nc", "pareja_tratada_lt20": "nc",
+    "sifilis_no_trep_ge20": "-", "sifilis_trep_ge20": "-", "sifilis_tratamiento_ge20": "nc", "pareja_tratada_ge20": "nc",
+    "preparacion_parto": True, "consejeria_lactancia_materna": True,
+    "fuma_act_t1": "no", "fuma_act_t2": "no", "fuma_act_t3": "no",
+    "pap": "normal", "cervix_inspeccion": "normal", "proxima_cita": "2026-02-01",
+    "apn": [
+        {"fecha": f"2026-0{m}-10", "eg_semanas": 4 * m + 2, "peso_kg": 60 + m, "pa_sis": 110, "pa_dia": 70,
+         "altura_uterina_cm": 4 * m, "presentacion": "cef", "fcf_lpm": 140, "mov_fetales": "si"}
+        for m in range(1, 7)
+    ],
+}
+_GESTACION_INVALIDA = {
+    **_GESTACION_VALIDA,
+    "talla": "x", "rh": "?", "fum": "01/01/2026", "eg_confiable": "quizas",
+    "apn": [{"fecha": "x", "eg_semanas": 99}, 3],
+}
+
+_IDENTIFICACION_VALIDA = {
+    "nombres": "María José", "apellidos": "López Pérez", "cedula": "001-120390-1000A",
+    "fecha_nacimiento": "1990-03-12", "edad": 36, "etnia": "mestiza", "alfabeta": True,
+    "nivel_estudios": "secundaria", "anio_estudios": 5, "estado_civil": "union_estable", "vive_sola": False,
+    "domicilio": "Barrio Central", "telefono": "88888888", "localidad": "León",
+    "establecimiento_salud": "Centro de Salud", "lugar_parto": "Hospital",
+}
+_IDENTIFICACION_INVALIDA = {**_IDENTIFICACION_VALIDA, "edad": -1, "etnia": "x", "fecha_nacimiento": "12/03/1990"}
+
+_ANTECEDENTES_VALIDO = {
+    "antecedentes_familiares": {"diabetes": True, "hipertension": "false"},
+    "antecedentes_personales": {"tbc": False, "diabetes": False, "peso_ultimo_previo": "normal/n/c"},
+    "gesta_previa": 2, "partos": 1, "cesareas": 0, "vaginales": 1, "abortos": 1,
+    "nacidos_vivos": 1, "nacidos_muertos": 0, "embarazo_ectopico": 0, "hijos_vivos": 1,
+    "muertos_primera_semana": 0, "muertos_despues_semana": 0,
+    "fecha_fin_ultimo_embarazo": "2023-05-10", "embarazo_planeado": "si", "fracaso_metodo_anticonceptivo": "no_usaba",
+}
+_ANTECEDENTES_INVALIDO = {
+    **_ANTECEDENTES_VALIDO,
+    "antecedentes_personales": {"diabetes": "quizas", "diabetes_tipo": "x"},
+    "partos": -1, "fecha_fin_ultimo_embarazo": "10-05-2023", "embarazo_planeado": "talvez",
+}
+
+_PARTO_ABORTO_VALIDO = {
+    "tipo_evento": "Parto", "fecha_ingreso": "2026-09-30", "carne_perinatal": "Si", "consultas_prenatales": 6,
+    "lugar_parto": "Institucional", "hospitalizacion_embarazo": {"hubo": "No", "dias": 0},
+    "corticoides_antenatales": {"estado": "N/C", "semana_inicio": 0}, "inicio_parto": "Espontáneo",
+    "ruptura_membrana": {"hubo": "Si", "fecha_inicio": {"dia": 30, "mes": 9, "anio": 2026},
+                         "hora_inicio": {"hora": 8, "minuto": 15}},
+    "edad_gestacional_parto": {"semanas": 39, "dias": 2, "metodo": "FUM"}, "presentacion": "Cefálica",
+    "tamano_fetal_acorde": "Si", "acompanante": "Pareja", "acompanamiento_solicitado_usuaria": "Si",
+    "nacimiento": "Vivo", "fecha_hora_nacimiento": "2026-09-30T14:05", "nacimiento_multiple": "No",
+    "orden_nacimiento": 1, "terminacion_parto": "Espontánea", "posicion_parto": "Acostada", "episiotomia": "No",
+    "desgarros": {"hubo": "Si", "grado": 1}, "oxitocicos_pre": "No", "oxitocicos_post": "Si",
+    "placenta_expulsada": "Si", "ligadura_cordon": "Tardía", "medicacion_recibida": {"oxitocicos": "Si"},
+    "indicacion_principal_induccion_operacion": "", "induccion": [], "operacion": [], "partograma_usado": "Si",
+    "partograma_detalle": [
+        {"hora": 8 + h, "minuto": 0, "posicion_madre": "L", "pa": "110/70", "pulso": 80, "contracciones": 3,
+         "dilatacion": str(4 + h), "altura_presentacion": "-1", "variedad_posicion": "OIA",
+         "meconio": False, "fcf_dips": "No"}
+        for h in range(6)
+    ],
+}
+_PARTO_ABORTO_INVALIDO = {
+    **_PARTO_ABORTO_VALIDO,
+    "tipo_evento": "x", "ruptura_membrana": {"hubo": "Si"}, "desgarros": {"hubo": "Si", "grado": 9},
+    "partograma_detalle": [{"hora": 25}],
+}
+
+_RECIEN_NACIDO_VALIDO = {
+    "tipo_nacimiento": "vivo", "sexo": "Femenino", "peso_nacer": 3200, "perimetro_cefalico": 34, "longitud": 50,
+    "edad_gestacional": {"semanas": 39, "dias": 2, "metodo": "FUM", "estimada": False},
+    "peso_edad_gestacional": "Adecuado",
+    "cuidados_inmediatos": {"vitamina_k": "si", "profilaxis_ocular": "si", "apego_precoz": "si"},
+    "apgar": {"min_1": 8, "min_5": 9}, "reanimacion": ["aspiración"], "fallece_sala_parto": "no",
+    "referido": "aloj_conjunto", "atendio": {"parto": "medico", "neonato": "enfermera"},
+    "defectos_congenitos": {"presenta": "no", "tipo_malformacion": "ninguna", "codigo": "", "detalle": ""},
+    "enfermedades": {"codigos": [], "ninguna": True, "uno_o_mas": False},
+    "vih_rn": {"exposicion": "no", "tratamiento": "n/c"},
+    "tamizaje_neonatal": {k: "negativo" for k in ("vdrl", "tsh", "hbpatia", "bilirrubina", "toxo_igm")},
+    "meconio": "no",
+}
+_RECIEN_NACIDO_INVALIDO = {
+    **_RECIEN_NACIDO_VALIDO,
+    "peso_nacer": -1, "apgar": {"min_1": 11}, "reanimacion": ["x"], "enfermedades": {"codigos": [1, 2, 3, 4]},
+}
+
+
+def _casos():
+    # import diferido: los services importan app (y con ello la config de Flask)
+    from app.services import (
+        service_antencedentes, service_gestacion_actual, service_identificacion,
+        service_parto_aborto, service_recien_nacido,
+    )
+    return {
+        "identificacion": (service_identificacion, _IDENTIFICACION_VALIDA, _IDENTIFICACION_INVALIDA),
+        "antecedentes": (service_antencedentes, _ANTECEDENTES_VALIDO, _ANTECEDENTES_INVALIDO),
+        "gestacion_actual": (service_gestacion_actual, _GESTACION_VALIDA, _GESTACION_INVALIDA),
+        "parto_aborto": (service_parto_aborto, _PARTO_ABORTO_VALIDO, _PARTO_ABORTO_INVALIDO),
+        "recien_nacido": (service_recien_nacido, _RECIEN_NACIDO_VALIDO, _RECIEN_NACIDO_INVALIDO),
+    }
+
+def _tiempo(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n
+
+def medir(n: int = 2000, secciones=None, repeticiones: int = 3):
+    """
+    [{seccion, caso, us, error}] con el mejor de `repeticiones` (µs por payload).
+    `error` es el mensaje del payload inválido (para ver cuántos errores junta).
+    """
+    historial_id, usuario = ObjectId(), {"usuario_id": str(ObjectId())}
+    out = []
+    for seccion, (servicio, valido, invalido) in _casos().items():
+        if secciones and seccion not in secciones:
+            continue
+        for caso, payload in (("valido", valido), ("invalido", invalido)):
+            payload = copy.deepcopy(payload)
+            error = None
+            try:
+                servicio._build_doc(historial_id, payload, usuario)
+            except ValueError as ve:
+                error = str(ve)
+
+            def _una():
+                try:
+                    servicio._build_doc(historial_id, payload, usuario)
+                except ValueError:
+                    pass
+
+            us = min(_tiempo(_una, n) for _ in range(repeticiones)) * 1e6
+            out.append({"seccion": seccion, "caso": caso, "us": round(us, 1), "error": error})
+    return out
+
+
+def lineas(resultados):
+    """Salida en texto (la usan `flask bench validacion` y el modo script)."""
+    for r in resultados:
+        yield f"{r['seccion']:<18} {r['caso']:<9} {r['us']:>8.1f} µs/payload"
+        if r["error"]:
+            yield f"  -> {r['error']}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Costo de validar un payload (_build_doc) por sección.")
+    parser.add_argument("--n", type=int, default=2000, help="Payloads por medición.")
+    parser.add_argument("--seccion", dest="secciones", action="append", help="Limitar a estas secciones.")
+    args = parser.parse_args()
+    for linea in lineas(medir(n=args.n, secciones=args.secciones)):
+        print(linea)
@@ -0,0 +1,120 @@
+import re
+import unicodedata
+
+# Claves de búsqueda precalculadas al escribir (campo array con índice multikey).
+# Cada clave lleva un prefijo de tipo para compartir un único índice:
+#   T:<token>    token completo del nombre/apellido ("MARIA", "LOPEZ")
+#   P:<prefijo>  prefijos de cada token, de PREFIJO_MIN a PREFIJO_MAX letras ("MA", "MAR", ...)
+#   I:<prefijo>  identificación/expediente compactado (sin separadores), desde ID_MIN caracteres
+#   IX:<valor>   identificación/expediente compactado completo (solo para el ranking)
+#   F:<código>   clave fonética de cada token (ver fonetica()), para búsqueda tolerante
+# Así una búsqueda "mar lop" es {claves: {$all: ["P:MAR", "P:LOP"]}} y usa el índice.
+PREFIJO_MIN = 2
+PREFIJO_MAX = 10
+ID_MIN = 4
+
+_RE_NO_ALNUM = re.compile(r"[^0-9A-Z]+")
+
+
+def normalizar(texto) -> str:
+    """Mayúsculas sin tildes ni signos: "María José-López" -> "MARIA JOSE LOPEZ"."""
+    if not isinstance(texto, str):
+        return ""
+    sin_tildes = "".join(
+        c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c)
+    )
+    return _RE_NO_ALNUM.sub(" ", sin_tildes.upper()).strip()
+
+def compactar(texto) -> str:
+    """Solo letras y dígitos: "001-120390-1000A" -> "0011203901000A"."""
+    return normalizar(texto).replace(" ", "")
+
+def tokens(texto, stopwords=()) -> list:
+    """Tokens normalizados, sin repetir y sin artículos/preposiciones."""
+    out = []
+    for t in normalizar(texto).split():
+        if t not in stopwords and t not in out:
+            out.append(t)
+    return out
+
+
+# ---------------- Fonética (español) ----------------
+# Reglas de _REEMPLAZOS en orden: dígrafos primero, luego letras que suenan igual
+# en el español de la región (seseo, b/v, y/ll, h muda).
+_REEMPLAZOS = [
+    ("CH", "X"), ("LL", "Y"), ("QU", "K"),
+    ("GE", "JE"), ("GI", "JI"), ("GUE", "GE"), ("GUI", "GI"),   # g suave antes que gu+e/i
+    ("CE", "SE"), ("CI", "SI"),
+    ("C", "K"), ("Z", "S"), ("V", "B"), ("W", "B"), ("H", ""),
+]
+_VOCALES = set("AEIOUY")
+
+
+def fonetica(token: str) -> str:
+    """
+    Código fonético de un token: primera letra (tras las reglas) + esqueleto de
+    consonantes sin repeticiones. "LÓPEZ"/"LOPES" -> "LPS", "GERARDO"/"JERARDO" -> "JRD",
+    "YOVANA"/"LLOBANA" -> "YBN". Vacío si el token no tiene letras.
+    """
+    t = compactar(token)
+    t = "".join(ch for ch in t if ch.isalpha())
+    if not t:
+        return ""
+    for origen, destino in _REEMPLAZOS:
+        t = t.replace(origen, destino)
+    if not t:
+        return ""
+    if t.endswith("Y"):
+        t = t[:-1] + "I"
+    codigo = t[0]
+    for ch in t[1:]:
+        if ch in _VOCALES:
+            continue
+        if ch != codigo[-1]:
+            codigo += ch
+    return codigo
+
+def claves_foneticas(texto, stopwords=()) -> set:
+    return {f"F:{c}" for c in (fonetica(t) for t in tokens(texto, stopwords)) if c}
+
+
+def claves_nombre(texto, stopwords=()) -> set:
+    claves = set()
+    for t in tokens(texto, stopwords):
+        claves.add(f"T:{t}")
+        f = fonetica(t)
+        if f:
+            claves.add(f"F:{f}")
+        for n in range(PREFIJO_MIN, min(len(t), PREFIJO_MAX) + 1):
+            claves.add(f"P:{t[:n]}")
+    return claves
+
+def claves_identificador(texto) -> set:
+    c = compactar(texto)
+    if not c:
+        return set()
+    claves = {f"I:{c[:n]}" for n in range(min(ID_MIN, len(c)), len(c) + 1)}
+    claves.add(f"IX:{c}")
+    return claves
+
+
+def consulta(q: str, stopwords=()):
+    """
+    Traduce el texto libre a (claves_requeridas, claves_exactas):
+    - requeridas: una por token (P:<prefijo recortado a PREFIJO_MAX>) -> filtro $all
+    - exactas: T:<token> e IX:<compactado>, que suman al ranking
+    Si el texto parece un identificador (tiene dígitos) se busca por I:.
+    Retorna ([], []) si no hay nada que buscar.
+    """
+    compacto = compactar(q)
+    if not compacto:
+        return [], []
+    if any(ch.isdigit() for ch in compacto):
+        if len(compacto) < ID_MIN:
+            return [], []
+        return [f"I:{compacto}"], [f"IX:{compacto}"]
+
+    toks = [t for t in tokens(q, stopwords) if len(t) >= PREFIJO_MIN]
+    requeridas = [f"P:{t[:PREFIJO_MAX]}" for t in toks]
+    exactas = [f"T:{t}" for t in toks]
+    return requeridas, exactas
@@ -0,0 +1,101 @@
+import threading
+from contextvars import ContextVar
+from flask import current_app
+from pymongo import monitoring
+
+# Contador de comandos Mongo por request. Vive en un ContextVar; las tareas de
+# app.utils.fanout corren con su propio contador y lo suman al del request al
+# terminar (exportar/fusionar).
+_contador = ContextVar("db_metrics_contador", default=None)
+
+
+class _Contador:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.por_comando = {}
+        self.duracion_us = 0
+
+    def sumar(self, comando):
+        with self.lock:
+            self.total += 1
+            self.por_comando[comando] = self.por_comando.get(comando, 0) + 1
+
+    def sumar_duracion(self, micros):
+        with self.lock:
+            self.duracion_us += micros
+
+
+class ContadorComandos(monitoring.CommandListener):
+    """Listener de PyMongo: cuenta cada comando enviado mientras haya un contador activo."""
+
+    def started(self, event):
+        c = _contador.get()
+        if c is not None:
+            c.sumar(event.command_name)
+
+    def succeeded(self, event):
+        c = _contador.get()
+        if c is not None:
+            c.sumar_duracion(event.duration_micros)
+
+    def failed(self, event):
+        c = _contador.get()
+        if c is not None:
+            c.sumar_duracion(event.duration_micros)
+
+
+listener = ContadorComandos()
+
+
+def iniciar():
+    _contador.set(_Contador())
+
+def exportar():
+    """Totales crudos del contador activo (para fusionar en otro hilo) o None."""
+    c = _contador.get()
+    if c is None:
+        return None
+    with c.lock:
+        return {"total": c.total, "por_comando": dict(c.por_comando), "duracion_us": c.duracion_us}
+
+def fusionar(datos):
+    """Suma al contador activo lo exportado por otra tarea."""
+    c = _contador.get()
+    if c is None or not datos:
+        return
+    with c.lock:
+        c.total += datos["total"]
+        for comando, n in datos["por_comando"].items():
+            c.por_comando[comando] = c.por_comando.get(comando, 0) + n
+        c.duracion_us += datos["duracion_us"]
+
+def actual():
+    """Resumen del request actual: {"total", "por_comando", "ms"} o None."""
+    c = _contador.get()
+    if c is None:
+        return None
+    with c.lock:
+        return {"total": c.total, "por_comando": dict(c.por_comando), "ms": round(c.duracion_us / 1000.0, 2)}
+
+
+def init_app(app):
+    """
+    Registra los hooks por request. Con DB_DEBUG_HEADERS (o app.debug) la respuesta
+    lleva X-DB-Calls, X-DB-Commands y X-DB-Time-ms.
+    """
+    @app.before_request
+    def _db_metrics_inicio():
+        iniciar()
+
+    @app.after_request
+    def _db_metrics_headers(response):
+        if current_app.config.get("DB_DEBUG_HEADERS") or current_app.debug:
+            m = actual()
+            if m is not None:
+                response.headers["X-DB-Calls"] = str(m["total"])
+                response.headers["X-DB-Commands"] = ",".join(
+                    f"{k}={v}" for k, v in sorted(m["por_comando"].items())
+                )
+                response.headers["X-DB-Time-ms"] = str(m["ms"])
+        return response
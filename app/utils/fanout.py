@@ -0,0 +1,134 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import current_app, has_app_context
+from app.db import identity_map
+from app.utils import db_metrics
+
+# Pool compartido por proceso. Todas las lecturas comparten el MongoClient de
+# PyMongo (thread-safe y con su propio pool de conexiones).
+_pool = None
+_pool_size = None
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool(max_workers):
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != max_workers:
+            viejo = _pool
+            _pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout")
+            _pool_size = max_workers
+            if viejo:
+                viejo.shutdown(wait=False)
+        return _pool
+
+
+def ejecutar_en_paralelo(tareas, max_workers=None, timeout=None, default=None):
+    """
+    Ejecuta tareas independientes en paralelo y devuelve {clave: resultado}.
+
+    tareas: dict {clave: callable sin argumentos}
+    max_workers: límite de concurrencia (config FANOUT_MAX_WORKERS, por defecto 4)
+    timeout: segundos máximos por tarea desde que empieza a correr (config
+             FANOUT_TIMEOUT, por defecto 5); una tarea que espera en la cola del pool
+             más de timeout se cancela sin correr. Las tareas que no terminan a tiempo
+             o fallan devuelven `default`, para que una colección lenta no bloquee todo
+             el agregado. Una tarea ya en curso no se puede interrumpir: su resultado se
+             descarta y el hilo queda ocupado hasta que la consulta vuelve.
+
+    Cada tarea corre en un contexto nuevo con su propio app context (su propio `g`):
+    nada del request se comparte entre hilos. El identity map arranca con una copia
+    del del request y, al terminar, lo leído y los comandos contados (db_metrics) se
+    fusionan en los del request desde este hilo.
+    Con max_workers <= 1 (o fuera de un app context) se ejecuta en secuencia.
+    """
+    if not tareas:
+        return {}
+
+    if not has_app_context():
+        return {k: _seguro(fn, default) for k, fn in tareas.items()}
+
+    app = current_app._get_current_object()
+    if max_workers is None:
+        max_workers = int(app.config.get("FANOUT_MAX_WORKERS", 4))
+    if timeout is None:
+        timeout = float(app.config.get("FANOUT_TIMEOUT", 5))
+
+    if max_workers <= 1 or len(tareas) == 1:
+        return {k: _seguro(fn, default) for k, fn in tareas.items()}
+
+    semilla = identity_map.exportar()
+    inicios = {}
+
+    def _envolver(clave, fn):
+        def _run():
+            inicios[clave] = time.monotonic()
+            with app.app_context():
+                db_metrics.iniciar()
+                identity_map.cargar(semilla)
+                estado = {}
+                try:
+                    estado["resultado"] = fn()
+                except Exception as e:
+                    estado["error"] = e
+                estado["metricas"] = db_metrics.exportar()
+                estado["identity_map"] = identity_map.exportar()
+                return estado
+        # contexto vacío: sin contextvars del request ni de tareas anteriores del hilo
+        return lambda: contextvars.Context().run(_run)
+
+    pool = _obtener_pool(max_workers)
+    enviado = time.monotonic()
+    futuros = {pool.submit(_envolver(k, fn)): k for k, fn in tareas.items()}
+    pendientes = set(futuros)
+
+    out = {}
+    while pendientes:
+        ahora = time.monotonic()
+        limites = {f: inicios.get(futuros[f], enviado) + timeout for f in pendientes}
+        for fut in [f for f in pendientes if limites[f] <= ahora]:
+            clave = futuros[fut]
+            if clave not in inicios:
+                if not fut.cancel():
+                    inicios.setdefault(clave, ahora)  # empezó justo ahora: corre su plazo
+                    continue
+                app.logger.warning(f"[fanout] '{clave}' no empezó en {timeout}s; se cancela")
+            elif not fut.done():
+                app.logger.warning(f"[fanout] '{clave}' excedió {timeout}s; se omite")
+            else:
+                continue  # terminó entre el wait y este chequeo
+            out[clave] = default
+            pendientes.discard(fut)
+        if not pendientes:
+            break
+
+        espera = min(inicios.get(futuros[f], enviado) + timeout for f in pendientes) - time.monotonic()
+        hechos, _ = wait(pendientes, timeout=max(espera, 0), return_when=FIRST_COMPLETED)
+        for fut in hechos:
+            pendientes.discard(fut)
+            out[futuros[fut]] = _resultado(app, futuros[fut], fut, default)
+    return out
+
+
+def _resultado(app, clave, fut, default):
+    """Resultado de una tarea terminada; fusiona su identity map y sus métricas."""
+    try:
+        estado = fut.result()
+    except Exception as e:
+        app.logger.warning(f"[fanout] '{clave}' falló: {e}")
+        return default
+    identity_map.fusionar(estado.get("identity_map"))
+    db_metrics.fusionar(estado.get("metricas"))
+    if "error" in estado:
+        app.logger.warning(f"[fanout] '{clave}' falló: {estado['error']}")
+        return default
+    return estado["resultado"]
+
+
+def _seguro(fn, default):
+    try:
+        return fn()
+    except Exception:
+        return default
@@ -0,0 +1,119 @@
+import decimal
+import json
+import uuid
+from datetime import date, datetime
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:  # opcional: 5-10x más rápido que json de la stdlib en listados
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+# Serialización JSON única para la app (app.json) y para exportaciones:
+# ObjectId -> str, datetime/date -> según JSON_FECHAS (abajo), Decimal128 y
+# Decimal -> str (como hace Flask con Decimal), UUID -> str; dicts/listas anidados
+# tal cual. Así un service puede devolver el documento de Mongo sin convertir campo
+# por campo.
+#
+# Con orjson instalado se usa orjson (tipos nativos en C + default() solo para los
+# de BSON); si no, json de la stdlib con el mismo default().
+# Fechas: JSON_FECHAS = "http" (por defecto) mantiene el formato de siempre de Flask
+# ("Tue, 14 Oct 2025 10:00:00 GMT"); JSON_FECHAS = "iso" es opt-in para ISO 8601.
+
+
+def _iso(o):
+    if isinstance(o, datetime):
+        s = o.isoformat()
+        return s[:-6] + "Z" if s.endswith("+00:00") else s
+    return o.isoformat()
+
+def _default_base(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, Decimal128):
+        return str(o.to_decimal())
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    raise TypeError(f"Objeto de tipo {type(o).__name__} no serializable a JSON")
+
+def _default_iso(o):
+    if isinstance(o, (datetime, date)):
+        return _iso(o)
+    return _default_base(o)
+
+def _default_http(o):
+    if isinstance(o, (datetime, date)):
+        return http_date(o)
+    return _default_base(o)
+
+
+def _opciones_orjson(fechas_http: bool, sort_keys: bool, indent: bool) -> int:
+    opt = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    if fechas_http:
+        opt |= orjson.OPT_PASSTHROUGH_DATETIME
+    if sort_keys:
+        opt |= orjson.OPT_SORT_KEYS
+    if indent:
+        opt |= orjson.OPT_INDENT_2
+    return opt
+
+def dumps_bytes(obj, fechas_http: bool = False, sort_keys: bool = False, indent: bool = False) -> bytes:
+    """JSON en UTF-8 (para respuestas y streams). Fuera de request: exportaciones, CLI."""
+    default = _default_http if fechas_http else _default_iso
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=_opciones_orjson(fechas_http, sort_keys, indent))
+    return json.dumps(
+        obj, default=default, ensure_ascii=False, sort_keys=sort_keys,
+        indent=2 if indent else None, separators=None if indent else (",", ":"),
+    ).encode("utf-8")
+
+
+class BSONJSONProvider(DefaultJSONProvider):
+    """Proveedor de app.json: lo usan jsonify() y los return de dict en las rutas."""
+
+    def _fechas_http(self) -> bool:
+        return usa_fechas_http(self._app)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs or orjson is None:
+            kwargs.setdefault("default", _default_http if self._fechas_http() else _default_iso)
+            kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+            kwargs.setdefault("sort_keys", self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return dumps_bytes(obj, fechas_http=self._fechas_http(), sort_keys=self.sort_keys).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        cuerpo = dumps_bytes(
+            obj, fechas_http=self._fechas_http(), sort_keys=self.sort_keys,
+            indent=self.compact is False or (self.compact is None and self._app.debug),
+        )
+        # bytes directo a la respuesta: sin pasar por str ni volver a codificar
+        return self._app.response_class(cuerpo + b"\n", mimetype=self.mimetype)
+
+
+def usa_fechas_http(app) -> bool:
+    return (app.config.get("JSON_FECHAS") or "http").lower() == "http"
+
+def init_app(app):
+    """
+    Instala el proveedor. Llamar DESPUÉS de mongo.init_app: Flask-PyMongo reemplaza
+    app.json con su propio BSONProvider al inicializarse.
+    """
+    app.config.setdefault("JSON_FECHAS", "http")
+    app.json = BSONJSONProvider(app)
+
+def verificar(app):
+    """Falla al arrancar si otra extensión reemplazó el proveedor después de init_app."""
+    if not isinstance(app.json, BSONJSONProvider):
+        raise RuntimeError(
+            f"app.json es {type(app.json).__name__}, se esperaba BSONJSONProvider: "
+            "json_bson.init_app debe ir después de las extensiones que lo reemplazan"
+        )
@@ -0,0 +1,241 @@
+import base64
+import threading
+import time
+from bson import json_util
+from flask import current_app, has_app_context
+
+# Paginación por cursor (keyset) para listados ordenados.
+# En vez de .skip((page-1)*per_page), que recorre y descarta todo lo anterior,
+# el cliente envía ?after=<token> con los valores de orden del último elemento
+# visto y la consulta arranca justo después usando el índice compuesto
+# (campos de orden + _id como desempate).
+#
+# El token es opaco: base64url de {"s": <firma del orden>, "v": [valores]}
+# serializado con bson.json_util (conserva datetime/ObjectId).
+
+
+def orden_con_desempate(orden):
+    """Agrega _id al final del orden (misma dirección que el último campo) si no está."""
+    orden = [(c, int(d)) for c, d in orden]
+    if not any(c == "_id" for c, _ in orden):
+        orden.append(("_id", orden[-1][1] if orden else -1))
+    return orden
+
+def _firma(orden):
+    return ",".join(f"{c}:{d}" for c, d in orden)
+
+def _valor(doc, campo):
+    v = doc
+    for parte in campo.split("."):
+        v = v.get(parte) if isinstance(v, dict) else None
+    return v
+
+
+def codificar_cursor(doc: dict, orden) -> str:
+    """Token para continuar después de `doc` con el orden dado."""
+    orden = orden_con_desempate(orden)
+    crudo = json_util.dumps({"s": _firma(orden), "v": [_valor(doc, c) for c, _ in orden]})
+    return base64.urlsafe_b64encode(crudo.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decodificar_cursor(token: str, orden) -> list:
+    """Valores del token. ValueError si está mal formado o es de otro orden."""
+    orden = orden_con_desempate(orden)
+    try:
+        relleno = "=" * (-len(token) % 4)
+        data = json_util.loads(base64.urlsafe_b64decode(token + relleno).decode("utf-8"))
+        valores = data["v"]
+    except Exception:
+        raise ValueError("Cursor 'after' inválido")
+    if data.get("s") != _firma(orden) or len(valores) != len(orden):
+        raise ValueError("Cursor 'after' no corresponde al orden solicitado")
+    return valores
+
+
+def filtro_despues(orden, valores) -> dict:
+    """
+    Condición "estrictamente después de `valores`" para el orden dado:
+      (a > va) OR (a == va AND b > vb) OR ...   (con < para campos descendentes)
+    Un null (o campo ausente) ordena primero en Mongo: tras null en ascendente vienen
+    los no-null; en descendente no hay nada más allá de null salvo empates, y después
+    de cualquier valor no-null vienen también los null ($lt no los alcanza).
+    """
+    orden = orden_con_desempate(orden)
+    ramas = []
+    for i, (campo, direccion) in enumerate(orden):
+        rama = {c: valores[j] for j, (c, _) in enumerate(orden[:i])}
+        v = valores[i]
+        if v is None:
+            if direccion < 0:
+                continue
+            rama[campo] = {"$ne": None}
+        elif direccion > 0 or campo == "_id":
+            rama[campo] = {"$gt" if direccion > 0 else "$lt": v}
+        else:
+            rama["$or"] = [{campo: {"$lt": v}}, {campo: None}]
+        ramas.append(rama)
+    if not ramas:
+        return {"_id": {"$exists": False}}  # nada después
+    return ramas[0] if len(ramas) == 1 else {"$or": ramas}
+
+def combinar(filtro: dict, extra: dict) -> dict:
+    """AND de dos filtros sin pisar claves (p. ej. un $or de búsqueda)."""
+    if not filtro:
+        return extra
+    if not extra:
+        return filtro
+    return {"$and": [filtro, extra]}
+
+
+def parsear_after(valor):
+    """None si no vino ?after (modo page/per_page); "" = primera página en modo cursor."""
+    if valor is None:
+        return None
+    return str(valor).strip()
+
+def paginar_keyset(coleccion, filtro: dict, orden, per_page: int, after: str = "",
+                   serializar=None, proyeccion=None, conteo: str = "none", base: dict | None = None):
+    """
+    Una página en modo cursor. Retorna
+    {"items", "per_page", "next_cursor", "has_more"}; next_cursor es None en la última página.
+    Trae per_page + 1 documentos para saber si hay más sin contar.
+    Con conteo exact/estimated agrega "total" (del filtro, sin el cursor; `base` como en contar).
+    """
+    orden = orden_con_desempate(orden)
+    total = contar(coleccion, filtro, conteo, base)
+    if after:
+        filtro = combinar(filtro, filtro_despues(orden, decodificar_cursor(after, orden)))
+    docs = list(coleccion.find(filtro, proyeccion).sort(orden).limit(per_page + 1))
+    has_more = len(docs) > per_page
+    docs = docs[:per_page]
+    out = {
+        "items": [serializar(d) if serializar else d for d in docs],
+        "per_page": per_page,
+        "next_cursor": codificar_cursor(docs[-1], orden) if has_more and docs else None,
+        "has_more": has_more,
+    }
+    if total is not None:
+        out["total"] = total
+    return out
+
+
+# ---------------- Conteo (?count=exact|estimated|none) ----------------
+# exact:     count_documents(filtro) (compat; con regex es un scan completo)
+# estimated: solo sin filtro es O(1) (estimated_document_count(), metadatos).
+#            Con filtro es count_documents, cacheado COUNT_CACHE_TTL segundos (60 por
+#            defecto) por (colección, filtro base, forma del resto): `base` es el filtro
+#            por defecto del listado (activo, deleted...) y del resto solo cuentan campos
+#            y operadores, no los valores. Así dos búsquedas ?q= distintas comparten el
+#            conteo mientras dura el TTL: el total es aproximado.
+# none:      sin total; has_more se obtiene trayendo per_page + 1 filas
+MODOS_CONTEO = ("exact", "estimated", "none")
+
+_cache_conteos = {}
+_cache_lock = threading.Lock()
+_CACHE_MAX = 512
+
+
+def parsear_conteo(valor, default="exact"):
+    modo = (valor or default).strip().lower()
+    if modo not in MODOS_CONTEO:
+        raise ValueError("count debe ser exact, estimated o none")
+    return modo
+
+def _ttl():
+    if has_app_context():
+        return float(current_app.config.get("COUNT_CACHE_TTL", 60))
+    return 60.0
+
+def _forma(v):
+    """El filtro sin sus valores: campos y operadores, con el tipo en cada hoja."""
+    if isinstance(v, dict):
+        return {k: _forma(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_forma(x) for x in v]
+    return type(v).__name__
+
+def _clave_conteo(coleccion, filtro: dict, base: dict | None):
+    base = base or {}
+    resto = {k: v for k, v in filtro.items() if k not in base or base[k] != v}
+    return (
+        coleccion.name,
+        json_util.dumps({k: v for k, v in filtro.items() if k not in resto}, sort_keys=True),
+        json_util.dumps(_forma(resto), sort_keys=True),
+    )
+
+def contar(coleccion, filtro: dict, modo: str = "exact", base: dict | None = None):
+    """
+    Total según el modo (None con "none"). `base`: filtro por defecto del listado,
+    la parte del filtro que sí distingue entradas del cache de "estimated".
+    """
+    if modo == "none":
+        return None
+    if modo == "estimated":
+        if not filtro:
+            return coleccion.estimated_document_count()
+        clave = _clave_conteo(coleccion, filtro, base)
+        ahora = time.monotonic()
+        with _cache_lock:
+            hit = _cache_conteos.get(clave)
+        if hit and hit[1] > ahora:
+            return hit[0]
+        total = coleccion.count_documents(filtro)
+        with _cache_lock:
+            if len(_cache_conteos) >= _CACHE_MAX:
+                # descarta el que vence primero
+                _cache_conteos.pop(min(_cache_conteos, key=lambda k: _cache_conteos[k][1]), None)
+            _cache_conteos[clave] = (total, ahora + _ttl())
+        return total
+    return coleccion.count_documents(filtro)
+
+
+def paginar_offset(coleccion, filtro: dict, orden, page: int, per_page: int,
+                   serializar=None, conteo: str = "exact", proyeccion=None, base: dict | None = None):
+    """
+    Modo page/per_page. Retorna {"items", "page", "per_page", "total", "has_more", "next_cursor"}.
+    total es None con conteo="none"; has_more sale de la fila extra, no del total.
+    `base`: filtro por defecto del listado (ver contar).
+    """
+    orden = orden_con_desempate(orden)
+    docs = list(
+        coleccion.find(filtro, proyeccion)
+        .sort(orden)
+        .skip((page - 1) * per_page)
+        .limit(per_page + 1)
+    )
+    total = contar(coleccion, filtro, conteo, base)
+    has_more = len(docs) > per_page
+    docs = docs[:per_page]
+    return {
+        "items": [serializar(d) if serializar else d for d in docs],
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "has_more": has_more,
+        "next_cursor": codificar_cursor(docs[-1], orden) if has_more and docs else None,
+    }
+
+
+# ---------------- Stream (?stream=1, app.utils.streaming) ----------------
+def iterar(coleccion, filtro: dict, orden, serializar=None, proyeccion=None, batch_size: int = 500):
+    """
+    Todos los documentos del filtro en el orden del listado, sin page/limit.
+    find() es perezoso: el primer lote se pide aquí, así un error del servidor
+    (filtro inválido, timeout) sale antes de empezar la respuesta y no después
+    del 200. El resto se recorre de a `batch_size`; el cursor se cierra al
+    terminar o si el cliente corta.
+    """
+    cursor = coleccion.find(filtro, proyeccion, batch_size=batch_size).sort(orden_con_desempate(orden))
+    try:
+        primero = next(cursor, None)
+    except Exception:
+        cursor.close()
+        raise
+
+    def _docs():
+        with cursor:
+            if primero is None:
+                return
+            yield serializar(primero) if serializar else primero
+            for d in cursor:
+                yield serializar(d) if serializar else d
+    return _docs()
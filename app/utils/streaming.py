@@ -0,0 +1,45 @@
+from flask import Response, current_app, request, stream_with_context
+from app.utils.json_bson import dumps_bytes, usa_fechas_http
+
+# Respuestas NDJSON (un documento JSON por línea) para listados grandes.
+# Se activan con ?stream=1 o Accept: application/x-ndjson; el service entrega un
+# iterable perezoso (cursor de PyMongo con batch_size) y aquí se serializa y envía
+# documento por documento, así la memoria no crece con el tamaño del resultado.
+# Si el cursor falla a mitad de camino ya se envió el 200: la última línea es
+# {"ok": false, "error": ...} para que el cliente sepa que el stream quedó incompleto.
+
+MIMETYPE = "application/x-ndjson"
+_VERDADERO = ("1", "true", "t", "yes", "y")
+
+
+def pide_stream() -> bool:
+    """?stream=1 o Accept con application/x-ndjson como tipo preferido (no vale */*)."""
+    if (request.args.get("stream") or "").strip().lower() in _VERDADERO:
+        return True
+    return request.accept_mimetypes.best == MIMETYPE
+
+def batch_size() -> int:
+    """Documentos por getMore del cursor (STREAM_BATCH_SIZE, 500 por defecto)."""
+    return int(current_app.config.get("STREAM_BATCH_SIZE") or 500)
+
+
+def _lineas(items):
+    http = usa_fechas_http(current_app)
+    try:
+        for item in items:
+            yield dumps_bytes(item, fechas_http=http) + b"\n"
+    except Exception as e:
+        current_app.logger.warning(f"[stream] cortado: {e}")
+        yield dumps_bytes({"ok": False, "error": "Stream interrumpido"}) + b"\n"
+    finally:
+        cerrar = getattr(items, "close", None)
+        if cerrar:
+            cerrar()
+
+def ndjson(items) -> Response:
+    """Response NDJSON (chunked) a partir de un iterable de documentos ya serializables."""
+    resp = Response(stream_with_context(_lineas(items)), mimetype=MIMETYPE)
+    # que nginx/proxies no acumulen la respuesta completa antes de enviarla
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
@@ -0,0 +1,299 @@
+import re
+from datetime import datetime
+from bson import ObjectId
+
+# Validadores declarativos por sección HCP.
+# Un esquema es una lista de campo(...) con el tipo de cada uno; compilar() lo
+# convierte UNA vez (al importar el service) en una función
+#     validar(payload, parcial=False) -> dict normalizado
+# que recorre el esquema en una sola pasada, junta todos los errores y al final
+# lanza ErrorValidacion (subclase de ValueError -> 422 en los services).
+#
+# Cada tipo es una fábrica: recibe sus parámetros (rango, opciones) y devuelve
+# un conversor v -> valor que lanza ValueError con el texto SIN el nombre del
+# campo; el nombre se antepone solo si hay error, así no se formatea nada en el
+# camino feliz (ni siquiera en listas como apn[i]).
+#
+# Cuándo se convierte un campo presente en el payload (`si`):
+#   "presente": siempre (None incluido, el tipo decide si lo acepta)
+#   "no_nulo":  solo si el valor no es None
+#   "valor":    solo si el valor es truthy
+# Si no se convierte (o no viene): se guarda `ausente` (None) u OMITIR (no se guarda).
+# Con parcial=True (actualizaciones) no se exigen requeridos, los None no se
+# validan y los campos ausentes no se tocan.
+
+OMITIR = object()
+_SI = ("presente", "no_nulo", "valor")
+_RE_YMD = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+
+class ErrorValidacion(ValueError):
+    """Todos los errores de un payload: errores = [(campo, texto)]."""
+
+    def __init__(self, errores):
+        self.errores = errores
+        super().__init__(mensaje(errores))
+
+
+def mensaje(errores) -> str:
+    """Texto único para el 422: requeridos agrupados primero, luego "campo texto" separados por "; "."""
+    faltan = [c for c, t in errores if t is None]
+    partes = ["Campos requeridos faltantes: " + ", ".join(faltan)] if faltan else []
+    partes += [f"{c} {t}" for c, t in errores if t is not None]
+    return "; ".join(partes)
+
+
+def campo(nombre, tipo, requerido=False, si=None, ausente=OMITIR):
+    """Declaración de un campo. Por defecto: requeridos si="presente", opcionales si="no_nulo"."""
+    si = si or ("presente" if requerido else "no_nulo")
+    if si not in _SI:
+        raise ValueError(f"campo {nombre}: si debe ser uno de {_SI}")
+    return {"nombre": nombre, "tipo": tipo, "requerido": requerido, "si": si, "ausente": ausente}
+
+
+# ---------------- Tipos ----------------
+def booleano():
+    def conv(v):
+        if v is True or v is False:
+            return v
+        if isinstance(v, (int, float)) and v in (0, 1):
+            return bool(v)
+        if isinstance(v, str):
+            s = v.lower()
+            if s == "true":
+                return True
+            if s == "false":
+                return False
+        raise ValueError("debe ser booleano")
+    return conv
+
+def _texto_rango(lo, hi) -> str:
+    if hi is None:
+        return f"debe ser >= {lo}"
+    if lo is None:
+        return f"debe ser <= {hi}"
+    return f"fuera de rango permitido [{lo}, {hi}]"
+
+def entero(lo=None, hi=None):
+    rango = _texto_rango(lo, hi)
+    def conv(v):
+        try:
+            x = int(v)
+        except Exception:
+            raise ValueError("debe ser entero")
+        if (lo is not None and x < lo) or (hi is not None and x > hi):
+            raise ValueError(rango)
+        return x
+    return conv
+
+def decimal(lo=None, hi=None):
+    rango = _texto_rango(lo, hi)
+    def conv(v):
+        try:
+            x = float(v)
+        except Exception:
+            raise ValueError("debe ser numérico")
+        if (lo is not None and x < lo) or (hi is not None and x > hi):
+            raise ValueError(rango)
+        return x
+    return conv
+
+def fecha_ymd():
+    def conv(v):
+        if not isinstance(v, str):
+            raise ValueError("debe ser string con formato YYYY-MM-DD")
+        s = v.strip()
+        m = _RE_YMD.fullmatch(s)
+        try:
+            if m:  # forma canónica: sin pasar por strptime (la mitad del costo de un payload)
+                return datetime(int(m[1]), int(m[2]), int(m[3]))
+            return datetime.strptime(s, "%Y-%m-%d")
+        except Exception:
+            raise ValueError("debe tener formato YYYY-MM-DD")
+    return conv
+
+_LEGIBLE = (("%Y", "YYYY"), ("%m", "MM"), ("%d", "DD"), ("%H", "HH"), ("%M", "MM"), ("%S", "SS"))
+
+def _legible(fmt: str) -> str:
+    for patron, texto in _LEGIBLE:
+        fmt = fmt.replace(patron, texto)
+    return f"'{fmt}'"
+
+def _texto_formatos(formatos) -> str:
+    """'debe tener formato ...' legible (sin los %Y de strptime)."""
+    if all(f.startswith("%Y-%m") for f in formatos):
+        return f"con formato de fecha/hora inválido (ISO 8601, p. ej. {_legible(formatos[0])})"
+    # las variantes con "T" o con segundos se dan por entendidas ("(o ISO)")
+    base = list(dict.fromkeys(f.replace("T", " ").removesuffix(":%S") for f in formatos))
+    legibles = [_legible(f) for f in base]
+    sufijo = " (o ISO)" if len(base) < len(formatos) else ""
+    if len(legibles) == 1:
+        return f"debe tener formato {legibles[0]}{sufijo}"
+    return f"debe tener formato {', '.join(legibles[:-1])} o {legibles[-1]}{sufijo}"
+
+def fecha_hora(formatos):
+    """
+    datetime con el primer formato de strptime que calce (en orden); los
+    formatos de solo fecha quedan a las 00:00.
+    """
+    formatos = tuple(formatos)
+    error = _texto_formatos(formatos)
+    def conv(v):
+        if not isinstance(v, str):
+            raise ValueError("debe ser string")
+        s = v.strip()
+        for fmt in formatos:
+            try:
+                return datetime.strptime(s, fmt)
+            except ValueError:
+                continue
+        raise ValueError(error)
+    return conv
+
+def opcion(opciones, desde_bool=None, minusculas=False):
+    """
+    Enum de strings. desde_bool=(si_true, si_false) acepta además booleanos
+    legacy y los mapea (p. ej. ("si", "no") o ("+", "-")); minusculas=True
+    compara (y guarda) el valor en minúsculas.
+    """
+    permitidas = frozenset(opciones)
+    error = f"inválido; use uno de: {', '.join(sorted(permitidas))}"
+    def conv(v):
+        if desde_bool is not None and (v is True or v is False):
+            return desde_bool[0] if v else desde_bool[1]
+        if isinstance(v, str):
+            s = v.strip().lower() if minusculas else v.strip()
+            if s in permitidas:
+                return s
+        raise ValueError(error)
+    return conv
+
+def texto(strip=True):
+    def conv(v):
+        if v is None:
+            raise ValueError("es requerido")
+        return str(v).strip() if strip else str(v)
+    return conv
+
+def crudo():
+    """Se guarda tal cual (notas libres)."""
+    return lambda v: v
+
+def object_id():
+    def conv(v):
+        try:
+            return ObjectId(v)
+        except Exception:
+            raise ValueError("no es un ObjectId válido")
+    return conv
+
+def objeto(esquema):
+    """
+    Subdocumento con su propio esquema, siempre completo (también al actualizar:
+    reemplaza el subdocumento). Los errores salen como nombre.campo.
+    """
+    validar = compilar(esquema)
+    def conv(v):
+        if not isinstance(v, dict):
+            raise ValueError("debe ser un objeto")
+        try:
+            return validar(v)
+        except ErrorValidacion as ev:
+            raise ErrorValidacion([(f".{c}", t) for c, t in ev.errores])
+    return conv
+
+def lista_de(tipo, max_items=None):
+    """Lista de valores simples convertidos con `tipo` (códigos, opciones); errores como nombre[i]."""
+    excede = f"admite hasta {max_items} elementos"
+    def conv(v):
+        if not isinstance(v, list):
+            raise ValueError("debe ser una lista")
+        if max_items is not None and len(v) > max_items:
+            raise ValueError(excede)
+        out, errores = [], []
+        for i, x in enumerate(v):
+            try:
+                out.append(tipo(x))
+            except ValueError as ve:
+                errores.append((f"[{i}]", str(ve)))
+        if errores:
+            raise ErrorValidacion(errores)
+        return out
+    return conv
+
+def lista(esquema_item):
+    """
+    Lista de objetos con su propio esquema; los errores salen como nombre[i].campo.
+    null se guarda como [] (un $push posterior sobre null falla).
+    """
+    validar_item = compilar(esquema_item)
+    def conv(v):
+        if v is None:
+            return []
+        if not isinstance(v, list):
+            raise ValueError("debe ser una lista")
+        out, errores = [], []
+        for i, raw in enumerate(v):
+            if not isinstance(raw, dict):
+                errores.append((f"[{i}]", "debe ser un objeto"))
+                continue
+            try:
+                out.append(validar_item(raw))
+            except ErrorValidacion as ev:
+                errores += [(f"[{i}].{c}", t if t is not None else "es requerido") for c, t in ev.errores]
+        if errores:
+            raise ErrorValidacion(errores)
+        return out
+    return conv
+
+
+# ---------------- Compilación ----------------
+def compilar(esquema):
+    """
+    Esquema -> validar(payload, parcial=False). Todo lo que no depende del
+    payload (tuplas planas, modo de cada campo, lista de requeridos) se resuelve aquí.
+    """
+    nombres = [c["nombre"] for c in esquema]
+    if len(set(nombres)) != len(nombres):
+        raise ValueError("esquema con campos repetidos")
+    requeridos = tuple(c["nombre"] for c in esquema if c["requerido"])
+    # modo: 0 presente, 1 no_nulo, 2 valor
+    plan = tuple(
+        (c["nombre"], c["tipo"], _SI.index(c["si"]), c["ausente"])
+        for c in esquema
+    )
+
+    def validar(payload: dict, parcial: bool = False) -> dict:
+        errores = []
+        if not parcial:
+            for n in requeridos:
+                if n not in payload:
+                    errores.append((n, None))
+        doc = {}
+        for nombre, conv, modo, ausente in plan:
+            if nombre in payload:
+                v = payload[nombre]
+                if parcial:
+                    aplica = v is not None and (modo != 2 or v)
+                else:
+                    aplica = modo == 0 or (v is not None if modo == 1 else bool(v))
+                if aplica:
+                    try:
+                        doc[nombre] = conv(v)
+                    except ErrorValidacion as ev:  # objeto/lista anidados
+                        errores += [(nombre + c, t) for c, t in ev.errores]
+                    except ValueError as ve:
+                        errores.append((nombre, str(ve)))
+                    continue
+                if parcial:
+                    continue
+            elif parcial:
+                continue
+            if ausente is not OMITIR:
+                doc[nombre] = ausente
+        if errores:
+            raise ErrorValidacion(errores)
+        return doc
+
+    validar.campos = tuple(nombres)
+    return validar